@@ -64,7 +64,7 @@ def register():
 
     Scene.rfc_killPython = BoolProperty(
         name="Kill Python",
-        description="Run 'killall -9 python' on host server after render process cancelled",
+        description="Run 'killall -9 python' on host server after render process cancelled (unless it runs a render service)",
         default=False)
 
     Scene.rfc_compress = BoolProperty(
@@ -97,6 +97,22 @@ def register():
         min=1, max=8,
         default=1)
 
+    Scene.rfc_autoServerLoad = BoolProperty(
+        name="Auto Server Load",
+        description="Set each server's load from its cores, free memory and current load (up to Max Server Load), and keep adjusting it while rendering",
+        default=False)
+
+    Scene.rfc_chunkTime = IntProperty(
+        name="Chunk Time",
+        description="Target time (in seconds) for each animation job; consecutive frames are rendered in one Blender session with persistent data (0 for one frame per job)",
+        min=0, max=3600,
+        default=0)
+
+    Scene.rfc_residentWorkers = BoolProperty(
+        name="Resident Workers",
+        description="Keep Blender running with the project loaded on each server between jobs, instead of starting Blender for every job",
+        default=False)
+
     Scene.rfc_timeout = FloatProperty(
         name="Timeout",
         description="Time (in seconds) to wait for client servers to respond",
@@ -115,6 +131,31 @@ def register():
         min=100, max=9999,
         default=1000)
 
+    Scene.rfc_splitMode = EnumProperty(
+        name="Split Frame",
+        description="How to split the current frame between servers",
+        items=[("AUTO", "Auto", "Split into tiles for large images, or when there are more job slots than jobs of 'Samples Per Job'; split by samples otherwise, and always for float or 16 bit outputs (tiles have no progressive preview or noise threshold)"),
+               ("SEEDS", "Samples", "Each job renders the whole frame at 'Samples Per Job' samples, and the results are averaged"),
+               ("TILES", "Tiles", "Each job renders a strip of the frame at 'Max Samples' samples, and the strips are stitched together (8 bit outputs only; no progressive preview or noise threshold)")],
+        default="SEEDS")
+
+    Scene.rfc_progressivePreview = BoolProperty(
+        name="Progressive Preview",
+        description="Fetch and average each sample job's image as soon as it finishes, updating the render preview as the current frame renders",
+        default=False)
+
+    Scene.rfc_sumOnServers = BoolProperty(
+        name="Sum Samples On Servers",
+        description="Render each server's share of the current frame's sample jobs as one job, and sum them on that server, so less comes back over the network (the progressive preview updates less often)",
+        default=False)
+
+    Scene.rfc_noiseThreshold = FloatProperty(
+        name="Noise Threshold",
+        description="Stop rendering the current frame once the estimated noise of the progressive preview drops below this (0 to render all of 'Max Samples')",
+        min=0, max=1,
+        precision=4,
+        default=0)
+
     Scene.rfc_renderDevice = EnumProperty(
         name="Device",
         description="Device to use for remote rendering",
@@ -199,9 +240,16 @@ def unregister():
     del Scene.rfc_imageRenderStatus
     del Scene.rfc_animPreviewAvailable
     del Scene.rfc_imagePreviewAvailable
+    del Scene.rfc_noiseThreshold
+    del Scene.rfc_sumOnServers
+    del Scene.rfc_progressivePreview
+    del Scene.rfc_splitMode
     del Scene.rfc_maxSamples
     del Scene.rfc_samplesPerFrame
     del Scene.rfc_timeout
+    del Scene.rfc_autoServerLoad
+    del Scene.rfc_chunkTime
+    del Scene.rfc_residentWorkers
     del Scene.rfc_maxServerLoad
     del Scene.rfc_renderDumpLoc
     del Scene.rfc_tempLocalDir
@@ -131,7 +131,7 @@ class sendAnimation(Operator):
                         # start render process from the defined start and end frames
                         elif self.state[i] == 2:
                             bpy.props.rfc_needsUpdating = False
-                            self.processes[i] = renderFrames(str(self.expandedFrameRange), self.projectName)
+                            self.processes[i] = renderFrames(self.expandedFrameRange, self.projectName)
                             setRenderStatus("animation", "Rendering...")
                             self.state[i] += 1
                             return{"PASS_THROUGH"}
@@ -196,12 +196,8 @@ class sendAnimation(Operator):
             if not setFrameRangesDict(self):
                 setRenderStatus("animation", "ERROR")
                 return{"CANCELLED"}
-            # store expanded results in 'expandedFrameRange'
+            # store expanded results in 'expandedFrameRange' (kept as ranges, so there's no limit on its size)
             self.expandedFrameRange = expandFrames(json.loads(self.rfc_frameRangesDict["string"]))
-            # restrict length of frame range string to 50000 characters
-            if len(str(self.expandedFrameRange)) > 75000:
-                self.report({"ERROR"}, "ERROR: Frame range too large (maximum character count after conversion to ints list: 75000)")
-                return{"CANCELLED"}
 
             # set the file extension and frame range for use with 'open animation' button
             scn.rfc_animExtension = scn.render.file_extension
@@ -260,4 +256,4 @@ class sendAnimation(Operator):
 
     def cancel(self, context):
         print("process cancelled")
-        cleanupCancelledRender(self, context, bpy.types.Scene.rfc_killPython)
+        cleanupCancelledRender(self, context, context.scene.rfc_killPython)
@@ -72,6 +72,14 @@ class sendFrame(Operator):
 
 
             if event.type == "TIMER":
+                # fetch each seed as soon as its job is done, to fold it into the preview while the rest render
+                if self.progressive and self.state[0] == 3:
+                    self.pendingResults += readStreamedResults(self, self.processes[0])
+                    if self.pendingResults and not self.processes[1]:
+                        self.processes[1] = fetchResults(self.projectName, self.pendingResults)
+                        self.pendingResults = []
+                        self.state[1] = 4
+
                 numIters = 1
                 if self.processes[1]:
                     numIters += 1
@@ -133,8 +141,23 @@ class sendFrame(Operator):
                         # start render process at current frame
                         elif self.state[i] == 2:
                             bpy.props.rfc_needsUpdating = False
-                            jobsPerFrame = scn.rfc_maxSamples // self.sampleSize
-                            self.processes[i] = renderFrames(str([scn.rfc_imFrame]), self.projectName, jobsPerFrame)
+                            if getSplitMode(scn) == "TILES":
+                                # the stitched strips come back as one tga at full samples (averaged like a single seed)
+                                self.sampleSize = scn.rfc_maxSamples
+                                scn.rfc_imExtension = ".tga"
+                                self.processes[i] = renderFrames(FrameSet([scn.rfc_imFrame]), self.projectName, numTiles=getNumTiles(scn))
+                            else:
+                                # the host server averages 8 bit seeds (rendered as tga) as they come in, so only their float average comes back
+                                hostAverage = isEightBitOutput(scn)
+                                if hostAverage:
+                                    scn.rfc_imExtension = ".tga"
+                                else:
+                                    scn.rfc_imExtension = scn.render.file_extension
+                                    self.report({"INFO"}, "Averaging samples in Blender: the host server only averages 8 bit images")
+                                self.averageInPool = not hostAverage
+                                jobsPerFrame = scn.rfc_maxSamples // self.sampleSize
+                                self.progressive = scn.rfc_progressivePreview
+                                self.processes[i] = renderFrames(FrameSet([scn.rfc_imFrame]), self.projectName, jobsPerFrame, streamResults=self.progressive, averageResults=hostAverage)
                             self.state[i] += 1
                             setRenderStatus("image", "Rendering...")
                             return{"PASS_THROUGH"}
@@ -143,6 +166,10 @@ class sendFrame(Operator):
                         elif self.state[i] == 3:
                             if self.processes[1] and self.processes[1].returncode == None:
                                 self.processes[1].kill()
+                                # anything it left behind is averaged with the rest of the render
+                                self.processes[1] = False
+                            # the final fetch picks up any seeds not streamed in yet
+                            self.pendingResults = []
                             self.state[i] += 1
                             self.processes[0] = getFrames(self.projectName, True)
                             if not self.renderCancelled:
@@ -150,20 +177,27 @@ class sendFrame(Operator):
                             return{"PASS_THROUGH"}
 
                         # average the rendered frames if there are new frames to average
-                        elif self.state[i] == 4:
-                            # only average if there are new frames to average
-                            numRenderedFiles = getNumRenderedFiles("image", [scn.rfc_imFrame], None)
-                            if numRenderedFiles > 0:
-                                averaged = True
-                                aveName = averageFrames(self, scn.rfc_nameImOutputFiles)
-                                if aveName != None:
-                                    scn.rfc_nameAveragedImage = aveName
+                        elif self.state[i] in [4, 5]:
+                            if self.state[i] == 4:
+                                # only average if there are new frames to average
+                                numRenderedFiles = getNumRenderedFiles("image", [scn.rfc_imFrame], None)
+                                if numRenderedFiles > 0:
+                                    # many seeds the host server didn't average are summed in worker processes, coming back here (at state 5) once they're done
+                                    averagePool = startAveragePool(self, scn.rfc_nameImOutputFiles) if self.averageInPool else None
+                                    if averagePool:
+                                        self.processes[i] = averagePool
+                                        self.state[i] += 1
+                                        return{"PASS_THROUGH"}
+                                    aveName = averageFrames(self, scn.rfc_nameImOutputFiles)
                                 else:
-                                    averaged = False
+                                    aveName = None
                             else:
-                                averaged = False
-                            # calculate number of samples represented in averaged image
-                            self.numSamples = self.sampleSize * self.avDict["numFrames"]
+                                aveName = finishAveragePool(self, self.processes[i], scn.rfc_nameImOutputFiles)
+                            averaged = aveName != None
+                            if averaged:
+                                scn.rfc_nameAveragedImage = aveName
+                            # number of samples represented in averaged image (seeds are weighted by their own sample counts)
+                            self.numSamples = self.avDict["numSamples"]
                             if i == 0:
                                 setRenderStatus("image", "Complete!")
                                 if bpy.data.images.find(scn.rfc_nameAveragedImage) >= 0:
@@ -179,16 +213,25 @@ class sendFrame(Operator):
                                 self.processes[1] = False
                             else:
                                 if bpy.data.images.find(scn.rfc_nameAveragedImage) >= 0:
-                                    # open preview image in UV/Image_Editor
-                                    changeContext(context, "IMAGE_EDITOR")
+                                    # open preview image in UV/Image_Editor (only the first time for a progressive preview, so the user can switch away)
+                                    if not (self.progressive and self.previewed):
+                                        changeContext(context, "IMAGE_EDITOR")
                                     for area in context.screen.areas:
                                         if area.type == "IMAGE_EDITOR":
                                             area.spaces.active.image = bpy.data.images[scn.rfc_nameAveragedImage]
+                                            area.tag_redraw()
                                             self.previewed = True
                                             break
                                 self.processes[1] = False
                                 previewString = "Render preview loaded ({num} samples)".format(num=str(self.numSamples))
                                 self.report({"INFO"}, previewString)
+                                # stop rendering seeds once the streamed ones have converged
+                                noise = self.avDict["noise"]
+                                if self.progressive and scn.rfc_noiseThreshold > 0 and noise is not None and noise <= scn.rfc_noiseThreshold and not self.stopRequested:
+                                    self.stopRequested = True
+                                    stopRender(self.projectName)
+                                    setRenderStatus("image", "Finishing...")
+                                    self.report({"INFO"}, "Noise below threshold at {num} samples ({noise:.5f}) - stopping render".format(num=str(self.numSamples), noise=noise))
                             scn.rfc_imagePreviewAvailable = True
                             if i == 0:
                                 if self.renderCancelled:
@@ -282,9 +325,14 @@ class sendFrame(Operator):
         self.numSuccessFrames = 0
         self.finishedFrames = 0
         self.previewed = False
+        self.progressive = False
+        self.pendingResults = []
+        self.stdoutBuffer = ""
         self.numSamples = 0
-        self.avDict = {"array":False, "numFrames":0}
+        self.avDict = {"array":False, "sqArray":False, "buffer":None, "sqBuffer":None, "numFrames":0, "numSamples":0, "noise":None, "unfolded":None}
+        self.stopRequested = False
         self.averageIm = None
+        self.averageInPool = False
         scn.rfc_imFrame = scn.frame_current
         self.projectName = bashSafeName(bpy.path.display_name_from_filepath(bpy.data.filepath))
 
@@ -295,4 +343,4 @@ class sendFrame(Operator):
 
     def cancel(self, context):
         print("process cancelled")
-        cleanupCancelledRender(self, context, bpy.types.Scene.rfc_killPython)
+        cleanupCancelledRender(self, context, context.scene.rfc_killPython)
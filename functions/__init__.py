@@ -16,7 +16,9 @@
 # along with this program.  If not, see <http://www.gnu.org/licenses/>.
 
 from .averageFrames import *
+from .averagePool import *
 from .common import *
+from .frameSet import *
 from .general import *
 from .jobIsValid import *
 from .setupServers import *
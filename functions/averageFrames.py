@@ -18,71 +18,209 @@
 # system imports
 import bpy
 import fnmatch
+import json
 import numpy
 import os
+import re
 from .general import getRenderDumpPath
 
-def averageFrames(classObject, outputFileName, verbose=0):
-    """ Averages final rendered images in blender to present one render result """
+def readPixels(im, buf):
+    """ copies the pixels of 'im' into the float32 array 'buf' """
+    try:
+        im.pixels.foreach_get(buf)
+    except AttributeError:
+        # Blender versions before 2.83 only hand image pixels over as a sequence
+        buf[:] = im.pixels[:]
+
+def writePixels(im, buf):
+    """ copies the float32 array 'buf' into the pixels of 'im' """
+    try:
+        im.pixels.foreach_set(buf)
+    except AttributeError:
+        im.pixels = buf.tolist()
+
+def getSeedSamples(classObject, fileName):
+    """ returns the sample count in the name of a seed (see 'seedOutputSuffix' in 'blender_task'), or the operator's sample size if it has none """
+    match = re.search(r"_seed-\d+-(\d+)s_", os.path.basename(fileName))
+    return int(match.group(1)) if match else classObject.sampleSize
+
+def readAverageInfo(imPath):
+    """ returns the info ('width', 'height', 'alpha', 'seeds', 'samples' and 'noise') on the first line of the average 'blender_task -a' writes, and the offset its pixels start at """
+    with open(imPath, "rb") as f:
+        header = f.readline()
+    return json.loads(header.decode("utf-8")), len(header)
+
+def setAverageImage(outputFileName, w, h, alpha, buf):
+    """ puts the averaged pixels 'buf' in the image the add-on shows the render in, returning its name """
     scn = bpy.context.scene
+    imName = "{outputFileName}_{frame}_average{extension}".format(outputFileName=outputFileName, frame=str(scn.rfc_imFrame).zfill(4), extension=scn.rfc_imExtension)
+    if bpy.data.images.find(imName) < 0:
+        new = bpy.data.images.new(imName, w, h, alpha)
+    else:
+        new = bpy.data.images[imName]
+    writePixels(new, buf)
+    return imName
+
+def loadHostAverage(classObject, imPath, verbose=0):
+    """ loads the average of the seeds 'blender_task -a' made on the host server into the sums, returning its width, height, whether it has alpha, and the names of the seeds in it """
+    info, start = readAverageInfo(imPath)
+    w = info["width"]
+    h = info["height"]
+    buf = classObject.avDict["buffer"]
+    if buf is None or len(buf) != w * h * 4:
+        buf = numpy.empty(w * h * 4, numpy.float32)
+    # float32 RGBA pixels, bottom row first (the same as Blender's), so they're read as they are
+    with open(imPath, "rb") as f:
+        f.seek(start)
+        f.readinto(buf)
+    os.remove(imPath)
     if verbose >= 1:
-        print("Averaging images...")
+        print("Loaded the average of {numSeeds} seeds".format(numSeeds=info["seeds"]))
 
-    # get image files to average
+    # the host server keeps the sums, so they're rebuilt from its average (replacing, rather than adding to, what has been
+    # shown so far), with its noise estimate spread evenly over the pixels so seeds it didn't fold in can be added to them
+    N = info["seeds"]
+    W = info.get("samples") or N * classObject.sampleSize
+    arr = buf * numpy.float64(W)
+    sqArr = numpy.square(buf, dtype=numpy.float64) * W
+    if N >= 2 and info["noise"] is not None:
+        sqArr += (N - 1) * W * info["noise"] ** 2
+    unfolded = classObject.avDict.get("unfolded")
+    if unfolded is not None:
+        # see 'addUnfoldedSeeds'
+        numpy.add(arr, unfolded[0], out=arr)
+        numpy.add(sqArr, unfolded[1], out=sqArr)
+        N += unfolded[2]
+        W += unfolded[3]
+    classObject.avDict["numFrames"] = N
+    classObject.avDict["numSamples"] = W
+    classObject.avDict["array"] = arr
+    classObject.avDict["sqArray"] = sqArr
+    classObject.avDict["buffer"] = buf
+    classObject.avDict["sqBuffer"] = numpy.empty(len(buf), numpy.float64)
+    return w, h, info["alpha"], set(info.get("folded", ()))
+
+def addUnfoldedSeeds(classObject, imList, arr, sqArr, buf, sqBuf, verbose=0):
+    """ adds seeds the host server couldn't fold into its average to the sums; they're kept apart too, as the host's next average replaces the sums """
+    if classObject.avDict.get("unfolded") is None:
+        classObject.avDict["unfolded"] = [numpy.zeros(len(arr), numpy.float64), numpy.zeros(len(arr), numpy.float64), 0, 0]
+    unfolded = classObject.avDict["unfolded"]
+    seedArr = numpy.zeros(len(arr), numpy.float64)
+    seedSqArr = numpy.zeros(len(arr), numpy.float64)
+    W = addSeeds(classObject, imList, seedArr, seedSqArr, buf, sqBuf, verbose)
+    for sums, seedSums in ((arr, seedArr), (sqArr, seedSqArr), (unfolded[0], seedArr), (unfolded[1], seedSqArr)):
+        numpy.add(sums, seedSums, out=sums)
+    unfolded[2] += len(imList)
+    unfolded[3] += W
+    classObject.avDict["numFrames"] += len(imList)
+    classObject.avDict["numSamples"] += W
+
+def getHostAverageName(outputFileName):
+    """ name of the average of the current frame's seeds 'blender_task -a' makes on the host server """
+    scn = bpy.context.scene
+    return "{outputFileName}_average_{frame}.raw".format(outputFileName=outputFileName, frame=str(scn.rfc_imFrame).zfill(4))
+
+def getSeedFiles(outputFileName):
+    """ returns the file names in the render dump folder, and the paths of the seeds of the current frame among them """
+    scn = bpy.context.scene
     renderPath = getRenderDumpPath()[0]
     allFiles = os.listdir(renderPath)
     inFileName = "{outputFileName}_seed-*_{frame}{extension}".format(outputFileName=outputFileName, frame=str(scn.rfc_imFrame).zfill(4), extension=scn.rfc_imExtension)
     imListNames = [filename for filename in allFiles if fnmatch.fnmatch(filename, inFileName)]
-    imList = [os.path.join(renderPath, im) for im in imListNames]
-    if not imList:
-        print("No image files to average")
-        return None
+    return allFiles, [os.path.join(renderPath, im) for im in imListNames]
 
-    # Assuming all images are the same size, get dimensions of first image
-    imRef = bpy.data.images.load(imList[0])
-    w = imRef.size[0]
-    h = imRef.size[1]
-    ch = imRef.channels
-    alpha = (ch == 4)
-    bpy.data.images.remove(imRef, do_unlink=True)
+def getSumBuffers(classObject, numValues):
+    """ returns the sum, sum of squares and scratch buffers to fold 'numValues' long images into """
+    # the buffers are kept between calls, so a progressive preview allocates nothing per seed
     if type(classObject.avDict["array"]) == numpy.ndarray:
-        arr = classObject.avDict["array"]
-    elif ch in [3, 4]:
-        arr = numpy.zeros((w * h * ch), numpy.float)
+        return classObject.avDict["array"], classObject.avDict["sqArray"], classObject.avDict["buffer"], classObject.avDict["sqBuffer"]
+    # sums are kept at double precision, so many seeds can be added up without losing the small ones
+    return numpy.zeros(numValues, numpy.float64), numpy.zeros(numValues, numpy.float64), numpy.empty(numValues, numpy.float32), numpy.empty(numValues, numpy.float64)
+
+def finishAverage(classObject, outputFileName, w, h, alpha, N, W, arr, sqArr, buf, sqBuf, verbose=0):
+    """ shows the average of the 'N' images (of 'W' samples in all) summed in 'arr', each weighted by its samples; returns the name of the image it's in """
+    # save current info for averaged image to "self" object of class this function was called from
+    classObject.avDict["numFrames"] = N
+    classObject.avDict["numSamples"] = W
+    classObject.avDict["array"] = arr
+    classObject.avDict["sqArray"] = sqArr
+    classObject.avDict["buffer"] = buf
+    classObject.avDict["sqBuffer"] = sqBuf
+
+    numpy.divide(arr, W, out=buf)
+    # estimate how far the average is from converged: the standard error of each pixel's mean, averaged over the image
+    # (each seed's variance shrinks with its samples, so the variance of one sample is estimated from the weighted sums)
+    if N >= 2:
+        sampleVariance = numpy.maximum(sqArr/W - numpy.square(arr/W), 0) * W/(N-1)
+        classObject.avDict["noise"] = float(numpy.mean(numpy.sqrt(sampleVariance/W)))
     else:
-        arr = numpy.zeros((w * h), numpy.float)
-    N = len(imList) + classObject.avDict["numFrames"]
+        classObject.avDict["noise"] = None
 
-    # Build up average pixel intensities, casting each image as an array of floats
+    # Print details
+    if verbose >= 1:
+        print("Averaged successfully!")
+
+    # Generate final averaged image and add it to the main database
+    return setAverageImage(outputFileName, w, h, alpha, buf)
+
+def addSeeds(classObject, imList, arr, sqArr, buf, sqBuf, verbose=0):
+    """ folds the seed images 'imList' into the sums, each weighted by its samples, removing them; returns the samples added """
+    W = 0
+    # Build up average pixel intensities, reading each image into the same float buffer
     if verbose >= 2:
         print("Averaging the following images:")
 
     for image in imList:
         if verbose >= 2:
             print(image)
-        # load image                                    # runtime per iteration:
-        im = bpy.data.images.load(image)                # ~.0002 sec
-        data = list(im.pixels)                          # ~.10 sec
-        imarr = numpy.array(data, dtype=numpy.float)    # ~.07 sec
-        arr = arr+imarr                                 # ~.008 sec
-        bpy.data.images.remove(im, do_unlink=True)      # ~.0002 sec
+        # see 'lib/benchmarkAverageFrames.py' for the cost of each step
+        # each seed counts for as many samples as it was rendered with
+        weight = getSeedSamples(classObject, image)
+        im = bpy.data.images.load(image)
+        readPixels(im, buf)
+        numpy.multiply(buf, weight, out=sqBuf)
+        numpy.add(arr, sqBuf, out=arr)
+        numpy.multiply(sqBuf, buf, out=sqBuf)
+        numpy.add(sqArr, sqBuf, out=sqArr)
+        bpy.data.images.remove(im, do_unlink=True)
         os.remove(image)
+        W += weight
+    return W
 
-    # save current info for averaged image to "self" object of class this function was called from
-    classObject.avDict["numFrames"] = N
-    classObject.avDict["array"] = arr
-
-    arr = arr/N
-
-    # Print details
+def averageFrames(classObject, outputFileName, verbose=0):
+    """ Averages final rendered images in blender to present one render result """
     if verbose >= 1:
-        print("Averaged successfully!")
+        print("Averaging images...")
 
-    # Generate final averaged image and add it to the main database
-    imName = "{outputFileName}_{frame}_average{extension}".format(outputFileName=outputFileName, frame=str(scn.rfc_imFrame).zfill(4), extension=scn.rfc_imExtension)
-    if bpy.data.images.find(imName) < 0:
-        new = bpy.data.images.new(imName, w, h, alpha)
-    else:
-        new = bpy.data.images[imName]
-    new.pixels = arr.tolist()
-    return imName
+    # get image files to average
+    renderPath = getRenderDumpPath()[0]
+    allFiles, imList = getSeedFiles(outputFileName)
+    hostAverageName = getHostAverageName(outputFileName)
+    if hostAverageName in allFiles:
+        w, h, alpha, folded = loadHostAverage(classObject, os.path.join(renderPath, hostAverageName), verbose)
+        arr, sqArr, buf, sqBuf = getSumBuffers(classObject, w * h * 4)
+        for image in imList:
+            if os.path.basename(image) in folded:
+                # a late copy of a seed already in it
+                os.remove(image)
+        # any others failed to fold in on the host server, so they're averaged with it here
+        imList = [image for image in imList if os.path.basename(image) not in folded]
+        if imList:
+            addUnfoldedSeeds(classObject, imList, arr, sqArr, buf, sqBuf, verbose)
+        return finishAverage(classObject, outputFileName, w, h, alpha, classObject.avDict["numFrames"], classObject.avDict["numSamples"], arr, sqArr, buf, sqBuf, verbose)
+    if not imList:
+        print("No image files to average")
+        return None
+
+    # Assuming all images are the same size, get dimensions of first image
+    imRef = bpy.data.images.load(imList[0])
+    w = imRef.size[0]
+    h = imRef.size[1]
+    ch = imRef.channels
+    numValues = len(imRef.pixels)
+    alpha = (ch == 4)
+    bpy.data.images.remove(imRef, do_unlink=True)
+    arr, sqArr, buf, sqBuf = getSumBuffers(classObject, numValues)
+    N = len(imList) + classObject.avDict["numFrames"]
+    W = classObject.avDict["numSamples"] + addSeeds(classObject, imList, arr, sqArr, buf, sqBuf, verbose)
+    return finishAverage(classObject, outputFileName, w, h, alpha, N, W, arr, sqArr, buf, sqBuf, verbose)
@@ -0,0 +1,122 @@
+# Copyright (C) 2018 Christopher Gearhart
+# chris@bblanimation.com
+# http://bblanimation.com/
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+# system imports
+import importlib
+import multiprocessing
+import numpy
+import os
+import sys
+import traceback
+
+# Blender imports
+import bpy
+
+# Addon imports
+from .averageFrames import *
+
+def getWorkerModule():
+    """ imports 'workers/sumSeeds.py' under its own name, so the workers of 'AveragePool' can import it too (the add-on's package needs bpy) """
+    workersPath = os.path.join(os.path.dirname(os.path.abspath(__file__)), "workers")
+    if workersPath not in sys.path:
+        # spawned workers start with this 'sys.path'
+        sys.path.append(workersPath)
+    return importlib.import_module("sumSeeds")
+
+def addPartialSums(partialSums):
+    """ adds up the workers' partial sums pairwise (a reduction tree), returning the total """
+    while len(partialSums) > 1:
+        paired = []
+        for first, second in zip(partialSums[::2], partialSums[1::2]):
+            if (first[0], first[1]) != (second[0], second[1]):
+                raise ValueError("seed images aren't all the same size")
+            first[2] += second[2]
+            first[3] += second[3]
+            paired.append(first)
+        if len(partialSums) % 2:
+            paired.append(partialSums[-1])
+        partialSums = paired
+    return partialSums[0]
+
+
+class AveragePool():
+    """ Sums seed images in worker processes, so averaging many seeds uses every core and leaves Blender's UI running
+
+    Polled from the modal timer of 'sendFrame' like the rsync processes it keeps in 'processes'
+    """
+
+    def __init__(self, imPaths, weights, numWorkers=None):
+        self.imPaths = imPaths
+        # Samples each image counts for
+        self.weights = weights
+        numWorkers = min(numWorkers or multiprocessing.cpu_count(), len(imPaths))
+        # forking Blender's process (and its threads' locks) can deadlock the workers, so they start afresh in Blender's
+        # own python ('sys.executable' is Blender itself in here)
+        context = multiprocessing.get_context("spawn")
+        context.set_executable(bpy.app.binary_path_python)
+        self.pool = context.Pool(numWorkers)
+        self.results = [self.pool.apply_async(getWorkerModule().sumImages, (imPaths[i::numWorkers], weights[i::numWorkers])) for i in range(numWorkers)]
+        self.returncode = None
+        self.stderr = None
+        # (width, height, sum, sum of squares) of all the images, once they're summed
+        self.total = None
+        self.error = None
+
+    def poll(self):
+        if self.returncode is None and all(result.ready() for result in self.results):
+            try:
+                self.total = addPartialSums([list(result.get()) for result in self.results])
+            except Exception:
+                self.error = traceback.format_exc()
+            self.pool.close()
+            # averaged in Blender instead if this failed, so it doesn't count as an error of the render
+            self.returncode = 0
+        return self.returncode
+
+    def kill(self):
+        self.pool.terminate()
+        self.returncode = -9
+
+
+def startAveragePool(classObject, outputFileName):
+    """ starts summing the current frame's seeds in worker processes, returning the 'AveragePool' (None if they're few enough, or can't be read outside Blender)
+
+    Only used when the seeds aren't averaged on the host server (see 'isEightBitOutput')
+    """
+    allFiles, imList = getSeedFiles(outputFileName)
+    if len(imList) < 2 or multiprocessing.cpu_count() < 2 or not os.path.exists(bpy.app.binary_path_python):
+        return None
+    if not all(getWorkerModule().canReadImage(imPath) for imPath in imList):
+        return None
+    return AveragePool(imList, [getSeedSamples(classObject, imPath) for imPath in imList])
+
+def finishAveragePool(classObject, pool, outputFileName, verbose=0):
+    """ shows the average of the seeds 'pool' summed (averaging in Blender if it failed), returning the name of the image it's in """
+    if pool.total is None:
+        if pool.error is not None:
+            print("Averaging in worker processes failed, averaging in Blender instead:")
+            print(pool.error)
+        return averageFrames(classObject, outputFileName, verbose)
+    w, h, total, sqTotal = pool.total
+    arr, sqArr, buf, sqBuf = getSumBuffers(classObject, len(total))
+    numpy.add(arr, total, out=arr)
+    numpy.add(sqArr, sqTotal, out=sqArr)
+    for imPath in pool.imPaths:
+        os.remove(imPath)
+    N = len(pool.imPaths) + classObject.avDict["numFrames"]
+    W = sum(pool.weights) + classObject.avDict["numSamples"]
+    return finishAverage(classObject, outputFileName, w, h, True, N, W, arr, sqArr, buf, sqBuf, verbose)
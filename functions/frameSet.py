@@ -0,0 +1,151 @@
+# Copyright (C) 2018 Christopher Gearhart
+# chris@bblanimation.com
+# http://bblanimation.com/
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+# NOTE: keep in sync with 'to_host_server/blender_task/FrameSet.py' on the host server
+
+# System imports
+import json
+from bisect import bisect_right
+
+class FrameSet():
+    """ Sorted set of frame numbers stored as runs of consecutive frames, so a huge animation takes no more memory than its ranges """
+
+    def __init__(self, frames=None):
+        # Start and end (inclusive) of each run, sorted and never touching; runs before 'first' have been popped
+        self.starts = list()
+        self.ends = list()
+        self.first = 0
+        self.numFrames = 0
+        if frames is None:
+            return
+        if isinstance(frames, FrameSet):
+            ranges = list(frames.ranges())
+        else:
+            # frame lists are made of ints and [start, end] pairs (see 'buildFrameRangesString' in the add-on)
+            ranges = sorted((frame, frame) if isinstance(frame, int) else (int(frame[0]), int(frame[1])) for frame in frames)
+        for start, end in ranges:
+            if start > end:
+                continue
+            if self.ends and start <= self.ends[-1] + 1:
+                if end > self.ends[-1]:
+                    self.numFrames += end - self.ends[-1]
+                    self.ends[-1] = end
+            else:
+                self.starts.append(start)
+                self.ends.append(end)
+                self.numFrames += end - start + 1
+
+    @classmethod
+    def from_string(cls, string):
+        """ parses a json frame list ('[[1,250],300]') or a frame ranges string ('1-250,300') """
+        string = string.strip()
+        if string.startswith("["):
+            return cls(json.loads(string))
+        frames = list()
+        for part in string.replace(" ", "").split(","):
+            if not part:
+                continue
+            if "-" in part:
+                start, end = part.split("-", 1)
+                frames.append([int(start), int(end)])
+            else:
+                frames.append(int(part))
+        return cls(frames)
+
+    def __len__(self):
+        return self.numFrames
+
+    def __bool__(self):
+        return self.numFrames > 0
+    __nonzero__ = __bool__
+
+    def __contains__(self, frame):
+        i = bisect_right(self.starts, frame, self.first) - 1
+        return i >= self.first and frame <= self.ends[i]
+
+    def __iter__(self):
+        for start, end in self.ranges():
+            for frame in range(start, end + 1):
+                yield frame
+
+    def __eq__(self, other):
+        return isinstance(other, FrameSet) and list(self.ranges()) == list(other.ranges())
+
+    def __ne__(self, other):
+        return not self == other
+
+    def __str__(self):
+        """ frame ranges string, e.g. '1-250,300' """
+        return ",".join(str(start) if start == end else "{start}-{end}".format(start=start, end=end) for start, end in self.ranges())
+
+    def __repr__(self):
+        return "FrameSet({frames})".format(frames=self.to_json())
+
+    def ranges(self):
+        """ yields (start, end) for each run of consecutive frames """
+        for i in range(self.first, len(self.starts)):
+            yield self.starts[i], self.ends[i]
+
+    def num_ranges(self):
+        return len(self.starts) - self.first
+
+    def to_list(self):
+        """ json-ready frame list, e.g. [[1,250],300] """
+        return [start if start == end else [start, end] for start, end in self.ranges()]
+
+    def to_json(self):
+        return json.dumps(self.to_list(), separators=(",", ":"))
+
+    def min(self):
+        return self.starts[self.first] if self else None
+
+    def max(self):
+        return self.ends[-1] if self else None
+
+    def pop_range(self, maxFrames=1):
+        """ removes and returns (start, end) for up to 'maxFrames' consecutive frames from the front of the set """
+        if not self:
+            raise IndexError("pop from an empty FrameSet")
+        start = self.starts[self.first]
+        end = min(self.ends[self.first], start + max(1, maxFrames) - 1)
+        if end == self.ends[self.first]:
+            self.first += 1
+        else:
+            self.starts[self.first] = end + 1
+        self.numFrames -= end - start + 1
+        return start, end
+
+    def difference(self, frames):
+        """ returns a new FrameSet of the frames in this set and not in 'frames' """
+        if not isinstance(frames, FrameSet):
+            frames = FrameSet(frames)
+        remaining = list()
+        other = list(frames.ranges())
+        j = 0
+        for start, end in self.ranges():
+            # skip the other runs that end before this one starts
+            while j < len(other) and other[j][1] < start:
+                j += 1
+            k = j
+            while start <= end and k < len(other) and other[k][0] <= end:
+                if other[k][0] > start:
+                    remaining.append([start, other[k][0] - 1])
+                start = max(start, other[k][1] + 1)
+                k += 1
+            if start <= end:
+                remaining.append([start, end])
+        return FrameSet(remaining)
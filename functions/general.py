@@ -16,6 +16,7 @@
 # along with this program.  If not, see <http://www.gnu.org/licenses/>.
 
 # System imports
+import fcntl
 import fnmatch
 import itertools
 import operator
@@ -34,6 +35,7 @@ import bpy
 # Addon imports
 from .setupServers import *
 from .common import *
+from .frameSet import *
 
 def have_internet():
     conn = httplib.HTTPConnection("www.google.com", timeout=5)
@@ -83,8 +85,8 @@ def getFrames(projectName, archiveFiles=False, frameRange=False):
     if outFilePath is not None:
         os.remove(outFilePath)
 
-    # exclude blend files, averaged files, and strange temporary files
-    exclusions =  "--exclude='*.blend' --exclude='*_average.???' --exclude='*.???.*'"
+    # exclude blend files, averaged files, strange temporary files and tiles that haven't been stitched together yet
+    exclusions =  "--exclude='*.blend' --exclude='*_average.???' --exclude='*.???.*' --exclude='*_tile-*'"
 
     # rsync files from host server to local directory
     fetchRsyncCommand = "rsync -ax --progress --remove-source-files {exclusions} -e 'ssh -T -oCompression=no -oStrictHostKeyChecking=no -x' '{login}:{remotePath}{projectName}/results/' '{dumpLocation}';".format(exclusions=exclusions, login=bpy.props.rfc_serverPrefs["login"], remotePath=bpy.props.rfc_serverPrefs["path"], projectName=projectName, dumpLocation=dumpLocation)
@@ -149,8 +151,75 @@ def copyFiles():
     process = subprocess.Popen(rsyncCommand, stdout=subprocess.PIPE, stderr=subprocess.PIPE, shell=True)
     return process
 
-def renderFrames(frameRange, projectName, jobsPerFrame=False):
-    """ calls 'blender_task' on host server """
+def getSplitMode(scn):
+    """ 'SEEDS' to split the current frame into jobs by samples, or 'TILES' to split it into strips (see 'rfc_splitMode') """
+    if scn.rfc_splitMode != "AUTO":
+        return scn.rfc_splitMode
+    # the strips are rendered and stitched as 8 bit tga, which would clip float or 16 bit outputs
+    if not isEightBitOutput(scn):
+        return "SEEDS"
+    rd = scn.render
+    numPixels = (rd.resolution_x * rd.resolution_percentage // 100) * (rd.resolution_y * rd.resolution_percentage // 100)
+    numSeedJobs = scn.rfc_maxSamples // scn.rfc_samplesPerFrame
+    numSlots = max(1, scn.rfc_availableServers) * scn.rfc_maxServerLoad
+    # seed jobs can't use more slots than there are seeds, and each one sends back (and gets averaged as) a full size image
+    if numSeedJobs < numSlots or numPixels >= 4000000:
+        return "TILES"
+    return "SEEDS"
+
+def isEightBitOutput(scn):
+    """ whether the scene renders 8 bit images, which 'blender_task -a' can average as it goes (it renders the seeds as 8 bit tga, which would clip float or 16 bit outputs) """
+    imageSettings = scn.render.image_settings
+    return imageSettings.file_format not in ("OPEN_EXR", "OPEN_EXR_MULTILAYER", "HDR", "CINEON", "DPX") and imageSettings.color_depth in ("", "8")
+
+def getNumTiles(scn):
+    """ number of strips to split the current frame into: two per job slot, so faster servers can take more of them """
+    rd = scn.render
+    height = rd.resolution_y * rd.resolution_percentage // 100
+    numSlots = max(1, scn.rfc_availableServers) * scn.rfc_maxServerLoad
+    return max(1, min(2 * numSlots, height // 16))
+
+def fetchResults(projectName, fileNames):
+    """ rsync just 'fileNames' from the host server's results for 'projectName' to the local machine """
+    dumpLocation = getRenderDumpPath()[0]
+    # files already taken by an earlier fetch are skipped, rather than failing the transfer
+    rsyncCommand = "mkdir -p '{dumpLocation}'; rsync -ax --remove-source-files --ignore-missing-args --files-from=- -e 'ssh -T -oCompression=no -oStrictHostKeyChecking=no -x' '{login}:{remotePath}{projectName}/results/' '{dumpLocation}'".format(login=bpy.props.rfc_serverPrefs["login"], remotePath=bpy.props.rfc_serverPrefs["path"], projectName=projectName, dumpLocation=dumpLocation)
+    process = subprocess.Popen(rsyncCommand, stdin=subprocess.PIPE, stdout=subprocess.PIPE, stderr=subprocess.PIPE, shell=True)
+    process.stdin.write("".join(fileName + "\n" for fileName in fileNames).encode("utf-8"))
+    process.stdin.close()
+    return process
+
+def stopRender(projectName):
+    """ tells 'blender_task' to end the render of 'projectName' with the jobs it has finished, cancelling the rest """
+    stopCommand = "ssh -T -oStrictHostKeyChecking=no -x {login} 'touch {remotePath}{projectName}/render.stop'".format(login=bpy.props.rfc_serverPrefs["login"], remotePath=bpy.props.rfc_serverPrefs["path"], projectName=projectName)
+    process = subprocess.Popen(stopCommand, stdout=subprocess.PIPE, stderr=subprocess.PIPE, shell=True)
+    return process
+
+def readStreamedResults(classObject, process):
+    """ returns the output files 'blender_task --stream_results' has announced since the last call, printing the rest of its output """
+    data = b""
+    while True:
+        try:
+            chunk = os.read(process.stdout.fileno(), 65536)
+        except BlockingIOError:
+            break
+        if not chunk:
+            break
+        data += chunk
+    classObject.stdoutBuffer += data.decode("utf-8", "replace")
+    # keep a partial last line for the next call
+    lines = classObject.stdoutBuffer.split("\n")
+    classObject.stdoutBuffer = lines.pop()
+    fileNames = []
+    for line in lines:
+        if line.startswith("##RESULT##") and line.endswith("##RESULT##"):
+            fileNames.append(line[len("##RESULT##"):-len("##RESULT##")])
+        else:
+            print(line)
+    return fileNames
+
+def renderFrames(frameRange, projectName, jobsPerFrame=False, numTiles=0, streamResults=False, averageResults=False):
+    """ calls 'blender_task' on host server to render the frames in 'frameRange' (a FrameSet) """
     scn = bpy.context.scene
     # defines the name of the output files generated by 'blender_task'
     n = getNameOutputFiles()
@@ -159,10 +228,31 @@ def renderFrames(frameRange, projectName, jobsPerFrame=False):
     if jobsPerFrame:
         extraFlags += " -j {jobsPerFrame}".format(jobsPerFrame=jobsPerFrame)
         extraFlags += " -s {numImSamples}".format(numImSamples=scn.rfc_samplesPerFrame)
+    elif numTiles:
+        extraFlags += " --tiles {numTiles}".format(numTiles=numTiles)
+        extraFlags += " -s {numImSamples}".format(numImSamples=scn.rfc_maxSamples)
+    elif scn.rfc_chunkTime > 0:
+        extraFlags += " --chunk_time {chunkTime}".format(chunkTime=scn.rfc_chunkTime)
+    if scn.rfc_autoServerLoad:
+        extraFlags += " --auto_load"
+    if scn.rfc_residentWorkers:
+        extraFlags += " --resident_workers"
+    if streamResults:
+        extraFlags += " --stream_results"
+    if averageResults:
+        extraFlags += " -a"
+        if scn.rfc_sumOnServers:
+            extraFlags += " --node_reduce"
 
     # runs blender command to render given range from the remote server
-    renderCommand = "ssh -T -oStrictHostKeyChecking=no -x {login} 'python {remotePath}blender_task -v -p -n {projectName} -l {frameRange} --hosts_file {remotePath}servers.txt -R {remotePath} --connection_timeout {t} --max_server_load {maxServerLoad}{extraFlags}'".format(login=bpy.props.rfc_serverPrefs["login"], remotePath=bpy.props.rfc_serverPrefs["path"], projectName=projectName, frameRange=frameRange.replace(" ", ""), t=scn.rfc_timeout, maxServerLoad=str(scn.rfc_maxServerLoad), extraFlags=extraFlags)
-    process = subprocess.Popen(renderCommand, stderr=subprocess.PIPE, shell=True)
+    # the frame list goes over stdin, so it can't run past the command line length limit
+    renderCommand = "ssh -T -oStrictHostKeyChecking=no -x {login} 'python {remotePath}blender_task -v -p -n {projectName} -l - --hosts_file {remotePath}servers.txt -R {remotePath} --connection_timeout {t} --max_server_load {maxServerLoad}{extraFlags}'".format(login=bpy.props.rfc_serverPrefs["login"], remotePath=bpy.props.rfc_serverPrefs["path"], projectName=projectName, t=scn.rfc_timeout, maxServerLoad=str(scn.rfc_maxServerLoad), extraFlags=extraFlags)
+    process = subprocess.Popen(renderCommand, stdin=subprocess.PIPE, stdout=subprocess.PIPE if streamResults else None, stderr=subprocess.PIPE, shell=True)
+    if streamResults:
+        # read with 'readStreamedResults' from the modal timer, which mustn't block
+        fcntl.fcntl(process.stdout.fileno(), fcntl.F_SETFL, fcntl.fcntl(process.stdout.fileno(), fcntl.F_GETFL) | os.O_NONBLOCK)
+    process.stdin.write(frameRange.to_json().encode("utf-8"))
+    process.stdin.close()
     print("Process sent to remote servers!")
     return process
 
@@ -184,31 +274,15 @@ def getRenderStatus(key):
         return ""
 
 def expandFrames(frame_range):
-    """ Helper function takes frame range string and returns list with frame ranges expanded """
-    frames = []
+    """ Helper function takes frame range list (ints and [start, end] lists) and returns a FrameSet of its frames """
     for i in frame_range:
-        if type(i) == list:
-            frames += range(i[0], i[1]+1)
-        elif type(i) == int:
-            frames.append(i)
-        else:
+        if type(i) not in (list, int):
             sys.stderr.write("Unknown type in frames list")
-
-    return list(set(frames))
+    return FrameSet(i for i in frame_range if type(i) in (list, int))
 
 def intsToFrameRanges(intsList):
     """ turns list of ints to list of frame ranges """
-    frameRangesS = ""
-    i = 0
-    while i < len(intsList):
-        s = intsList[i] # start index
-        e = s           # end index
-        while i < len(intsList) - 1 and intsList[i + 1] - intsList[i] == 1:
-            e += 1
-            i += 1
-        frameRangesS += "{s},".format(s=s) if s == e else "{s}-{e},".format(s=s, e=e)
-        i += 1
-    return frameRangesS[:-1]
+    return str(FrameSet(intsList))
 
 def listMissingFiles(filename, frameRange):
     """ lists all missing files from local render dump directory """
@@ -218,24 +292,22 @@ def listMissingFiles(filename, frameRange):
         errorMsg = "The folder does not exist: {path}".format(path=dumpFolder)
         sys.stderr.write(errorMsg)
         print(errorMsg)
-        return str(compList)[1:-1]
+        return str(compList)
     try:
         allFiles = os.listdir(dumpFolder)
     except:
         errorMsg = "Error listing directory {path}".format(path=dumpFolder)
         sys.stderr.write(errorMsg)
         print(errorMsg)
-        return str(compList)[1:-1]
+        return str(compList)
     imList = []
     for f in allFiles:
         if "_average." not in f and not fnmatch.fnmatch(f, "*_seed-*_????.???") and f[:len(filename)] == filename:
             imList.append(int(f[len(filename)+1:len(filename)+5]))
     # compare lists to determine which frames are missing from imlist
-    missingF = [i for i in compList if i not in imList]
-    # convert list of ints to string with frame ranges
-    missingFR = intsToFrameRanges(missingF)
-    # return the list of missing frames as string, omitting the open and close brackets
-    return missingFR
+    missingF = compList.difference(imList)
+    # return the missing frames as a frame ranges string
+    return str(missingF)
 
 def handleError(classObject, errorSource, i="Not Provided"):
     errorMessage = False
@@ -335,7 +407,8 @@ def getNumRenderedFiles(jobType, frameRange=None, fileName=None):
     scn = bpy.context.scene
     dumpPath = getRenderDumpPath()[0]
     if jobType == "image":
-        numRenderedFiles = len([f for f in os.listdir(dumpPath) if "_seed-" in f and f.endswith(str(frameRange[0]) + scn.rfc_imExtension)])
+        # seeds averaged on the host server come back as one float '_average_' image
+        numRenderedFiles = len([f for f in os.listdir(dumpPath) if ("_seed-" in f and f.endswith(str(frameRange[0]) + scn.rfc_imExtension)) or ("_average_" in f and f.endswith(str(frameRange[0]) + ".raw"))])
     else:
         renderedFiles = []
         for f in os.listdir(dumpPath):
@@ -348,7 +421,15 @@ def getNumRenderedFiles(jobType, frameRange=None, fileName=None):
         numRenderedFiles = len(renderedFiles)
     return numRenderedFiles
 
-def cleanupCancelledRender(classObject, context, killPython=True):
+def cancelRender(projectName, killPython=False):
+    """ has 'blender_task' cancel the render of 'projectName', leaving the renders of other projects (and a render service they share) running """
+    cancelCommand = "python {remotePath}blender_task -n {projectName} -R {remotePath} --cancel".format(remotePath=bpy.props.rfc_serverPrefs["path"], projectName=projectName)
+    if killPython:
+        # every project's renders run in the render service, so leave python running if there is one
+        cancelCommand += "; python {remotePath}blender_task -R {remotePath} --service_status > /dev/null || killall -9 python".format(remotePath=bpy.props.rfc_serverPrefs["path"])
+    subprocess.call("ssh -T -oStrictHostKeyChecking=no -x {login} '{cancelCommand}'".format(login=bpy.props.rfc_serverPrefs["login"], cancelCommand=cancelCommand), shell=True)
+
+def cleanupCancelledRender(classObject, context, killPython=False):
     """ Kills running processes when render job cancelled """
     wm = context.window_manager
     wm.event_timer_remove(classObject._timer)
@@ -358,8 +439,7 @@ def cleanupCancelledRender(classObject, context, killPython=True):
                 classObject.processes[j].kill()
             except:
                 pass
-    if killPython:
-        subprocess.call("ssh -T -oStrictHostKeyChecking=no -x {login} 'killall -9 python'".format(login=bpy.props.rfc_serverPrefs["login"]), shell=True)
+    cancelRender(classObject.projectName, killPython)
 
 def changeContext(context, areaType):
     """ Changes current context and returns previous area type """
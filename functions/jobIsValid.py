@@ -17,7 +17,7 @@
 
 # system imports
 import bpy
-from .general import getRenderDumpPath
+from .general import getRenderDumpPath, isEightBitOutput
 
 def jobIsValid(jobType, classObject):
     """ verifies that the job is valid before sending it to the host server """
@@ -43,6 +43,10 @@ def jobIsValid(jobType, classObject):
     if not jobValidityDict and scn.render.image_settings.file_format in unsupportedFormats:
         jobValidityDict = {"valid":False, "errorType":"WARNING", "errorMessage":"RENDER FAILED: Output file format not supported. Supported formats: BMP, PNG, TARGA, JPEG, JPEG 2000, TIFF. (Animation only: IRIS, CINEON, HDR, DPX, OPEN_EXR, OPEN_EXR_MULTILAYER)"}
 
+    # verify that a frame split into tiles (stitched as an 8 bit tga) won't clip the output
+    if not jobValidityDict and jobType == "image" and scn.rfc_splitMode == "TILES" and not isEightBitOutput(scn):
+        jobValidityDict = {"valid":False, "errorType":"WARNING", "errorMessage":"RENDER FAILED: 'Tiles' only supports 8 bit outputs. Split the frame by 'Samples' (or 'Auto') to render float or 16 bit images."}
+
     # verify that the user input for renderDumpLoc is valid and can be created
     rdf, errorMsg = getRenderDumpPath()
     if errorMsg is not None:
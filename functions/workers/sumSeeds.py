@@ -0,0 +1,115 @@
+# Copyright (C) 2018 Christopher Gearhart
+# chris@bblanimation.com
+# http://bblanimation.com/
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""
+Reads and sums seed images for 'AveragePool'. Its workers run Blender's own python, without bpy or the add-on, so this
+module imports nothing from either and is imported under its own name (see 'getWorkerModule' in 'averagePool')
+"""
+
+# system imports
+import numpy
+import os
+import struct
+try:
+    from PIL import Image
+except ImportError:
+    Image = None
+try:
+    import imageio
+except ImportError:
+    imageio = None
+
+# Uncompressed true-color and grayscale TGA images (what the host server and Blender's 'TARGA_RAW' write)
+TGA_TRUECOLOR = 2
+TGA_GRAYSCALE = 3
+# Descriptor bit set when the first row stored is the top one
+TGA_TOP_ORIGIN = 0x20
+
+def readTarga(imPath):
+    """ returns (width, height, RGBA float32 pixels in Blender's order) for an uncompressed TGA image """
+    with open(imPath, "rb") as f:
+        data = f.read()
+    if len(data) < 18:
+        raise ValueError("'{imPath}' is truncated".format(imPath=imPath))
+    idLength, colorMapType, imageType = struct.unpack("<BBB", data[:3])
+    colorMapLength, colorMapDepth = struct.unpack("<HB", data[5:8])
+    w, h, pixelDepth, descriptor = struct.unpack("<HHBB", data[12:18])
+    if imageType not in (TGA_TRUECOLOR, TGA_GRAYSCALE) or pixelDepth not in (8, 24, 32):
+        raise ValueError("'{imPath}' is not an uncompressed 8 bit TGA image".format(imPath=imPath))
+    start = 18 + idLength + (colorMapLength * ((colorMapDepth + 7) // 8) if colorMapType else 0)
+    ch = pixelDepth // 8
+    values = numpy.frombuffer(data, numpy.uint8, w * h * ch, start).reshape(h, w, ch)
+    if descriptor & TGA_TOP_ORIGIN:
+        values = values[::-1]
+    rgba = numpy.empty((h, w, 4), numpy.float32)
+    if ch == 1:
+        rgba[..., :3] = values
+    else:
+        # stored as BGR(A)
+        rgba[..., :3] = values[..., 2::-1]
+    rgba[..., 3] = values[..., 3] if ch == 4 else 255
+    rgba /= 255
+    return w, h, rgba.reshape(-1)
+
+def readWithLibrary(imPath):
+    """ returns (width, height, RGBA float32 pixels in Blender's order) read with Pillow or imageio """
+    if os.path.splitext(imPath)[1].lower() in (".exr", ".hdr"):
+        # float images come back linear, the same as Blender's pixels for them
+        values = numpy.asarray(imageio.imread(imPath), numpy.float32)
+    else:
+        im = Image.open(imPath)
+        # Blender hands 8 bit images over as the stored values / 255, but converts 16 bit ones, so leave those to it
+        if im.mode not in ("L", "LA", "RGB", "RGBA", "P"):
+            raise ValueError("'{imPath}' isn't an 8 bit image".format(imPath=imPath))
+        values = numpy.asarray(im.convert("RGBA"), numpy.float32) / 255
+    if values.ndim == 2:
+        values = values[..., numpy.newaxis].repeat(3, axis=2)
+    h, w = values.shape[:2]
+    rgba = numpy.ones((h, w, 4), numpy.float32)
+    rgba[..., :min(4, values.shape[2])] = values[..., :4]
+    # Blender's pixels start at the bottom row
+    return w, h, rgba[::-1].reshape(-1)
+
+def canReadImage(imPath):
+    """ whether 'readImage' can read 'imPath' with the libraries installed """
+    extension = os.path.splitext(imPath)[1].lower()
+    if extension == ".tga":
+        return True
+    if extension in (".exr", ".hdr"):
+        return imageio is not None
+    return Image is not None and extension in (".png", ".jpg", ".bmp", ".tif")
+
+def readImage(imPath):
+    if os.path.splitext(imPath)[1].lower() == ".tga":
+        return readTarga(imPath)
+    return readWithLibrary(imPath)
+
+def sumImages(imPaths, weights):
+    """ (runs in a worker process) returns the width, height, sum and sum of squares of the images 'imPaths', each multiplied by its weight """
+    total = None
+    for imPath, weight in zip(imPaths, weights):
+        w, h, values = readImage(imPath)
+        if total is None:
+            total = numpy.zeros(len(values), numpy.float64)
+            sqTotal = numpy.zeros(len(values), numpy.float64)
+        elif len(values) != len(total):
+            raise ValueError("'{imPath}' isn't the size of the seeds before it".format(imPath=imPath))
+        weighted = values * numpy.float64(weight)
+        total += weighted
+        weighted *= values
+        sqTotal += weighted
+    return w, h, total, sqTotal
@@ -0,0 +1,125 @@
+# Copyright (C) 2018 Christopher Gearhart
+# chris@bblanimation.com
+# http://bblanimation.com/
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""
+Times the cost per seed of averaging rendered images, the old way (python lists of floats) against the
+pixel buffers 'averageFrames' reads into. Not part of the add-on; run it from Blender:
+
+    blender -b --factory-startup -P lib/benchmarkAverageFrames.py -- [width] [height] [numSeeds]
+"""
+
+# system imports
+import importlib
+import os
+import shutil
+import sys
+import tempfile
+import time
+
+# Blender imports
+import bpy
+import numpy
+
+# load the add-on's 'averageFrames' module without registering the add-on
+addonPath = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.dirname(addonPath))
+averageFramesModule = importlib.import_module("{addonName}.functions.averageFrames".format(addonName=os.path.basename(addonPath)))
+readPixels = averageFramesModule.readPixels
+writePixels = averageFramesModule.writePixels
+
+def writeSeeds(path, w, h, numSeeds):
+    """ saves 'numSeeds' noisy RGBA images to 'path', returning their file paths """
+    im = bpy.data.images.new("benchmark_seed", w, h, alpha=True)
+    im.file_format = "PNG"
+    buf = numpy.empty(w * h * 4, numpy.float32)
+    imPaths = []
+    for seed in range(numSeeds):
+        buf[:] = numpy.random.random(w * h * 4)
+        writePixels(im, buf)
+        im.filepath_raw = os.path.join(path, "benchmark_seed-{seed}_0001.png".format(seed=seed))
+        im.save()
+        imPaths.append(im.filepath_raw)
+    bpy.data.images.remove(im, do_unlink=True)
+    return imPaths
+
+def averageLists(imPaths, w, h):
+    """ the averaging loop 'averageFrames' used to run """
+    arr = numpy.zeros(w * h * 4, numpy.float64)
+    times = {"load":0, "convert":0, "accumulate":0, "write":0}
+    for imPath in imPaths:
+        startTime = time.time()
+        im = bpy.data.images.load(imPath)
+        # pixels are read when first used, so count the decode with the load
+        im.pixels[0]
+        times["load"] += time.time() - startTime
+        startTime = time.time()
+        data = list(im.pixels)
+        imarr = numpy.array(data, dtype=numpy.float64)
+        times["convert"] += time.time() - startTime
+        startTime = time.time()
+        arr = arr+imarr
+        times["accumulate"] += time.time() - startTime
+        bpy.data.images.remove(im, do_unlink=True)
+    new = bpy.data.images.new("benchmark_average", w, h, alpha=True)
+    startTime = time.time()
+    new.pixels = (arr/len(imPaths)).tolist()
+    times["write"] += time.time() - startTime
+    bpy.data.images.remove(new, do_unlink=True)
+    return times
+
+def averageBuffers(imPaths, w, h):
+    """ the averaging loop 'averageFrames' runs now """
+    arr = numpy.zeros(w * h * 4, numpy.float64)
+    buf = numpy.empty(w * h * 4, numpy.float32)
+    times = {"load":0, "convert":0, "accumulate":0, "write":0}
+    for imPath in imPaths:
+        startTime = time.time()
+        im = bpy.data.images.load(imPath)
+        im.pixels[0]
+        times["load"] += time.time() - startTime
+        startTime = time.time()
+        readPixels(im, buf)
+        times["convert"] += time.time() - startTime
+        startTime = time.time()
+        numpy.add(arr, buf, out=arr)
+        times["accumulate"] += time.time() - startTime
+        bpy.data.images.remove(im, do_unlink=True)
+    new = bpy.data.images.new("benchmark_average", w, h, alpha=True)
+    startTime = time.time()
+    numpy.divide(arr, len(imPaths), out=buf)
+    writePixels(new, buf)
+    times["write"] += time.time() - startTime
+    bpy.data.images.remove(new, do_unlink=True)
+    return times
+
+def main():
+    argv = sys.argv[sys.argv.index("--") + 1:] if "--" in sys.argv else []
+    w = int(argv[0]) if len(argv) > 0 else 1920
+    h = int(argv[1]) if len(argv) > 1 else 1080
+    numSeeds = int(argv[2]) if len(argv) > 2 else 8
+    path = tempfile.mkdtemp(prefix="benchmarkAverageFrames-")
+    try:
+        print("Writing {numSeeds} {w}x{h} seeds...".format(numSeeds=numSeeds, w=w, h=h))
+        imPaths = writeSeeds(path, w, h, numSeeds)
+        print("{method:>8} {load:>10} {convert:>10} {accumulate:>10} {write:>10}   (ms per seed; 'write' is per average)".format(method="", load="load", convert="convert", accumulate="accumulate", write="write"))
+        for method, averageFunc in (("lists", averageLists), ("buffers", averageBuffers)):
+            times = averageFunc(imPaths, w, h)
+            print("{method:>8} {load:10.1f} {convert:10.1f} {accumulate:10.1f} {write:10.1f}".format(method=method, load=times["load"] * 1000 / numSeeds, convert=times["convert"] * 1000 / numSeeds, accumulate=times["accumulate"] * 1000 / numSeeds, write=times["write"] * 1000))
+    finally:
+        shutil.rmtree(path)
+
+main()
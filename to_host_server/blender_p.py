@@ -18,6 +18,7 @@
 # system imports
 import bpy
 import random
+import sys
 from bpy.app.handlers import persistent
 
 scn = bpy.context.scene
@@ -56,6 +57,92 @@ bpy.app.handlers.frame_change_pre.append(handle_bricker_animation)
 
 """ END SUPPORT FOR BRICKER """
 
+""" BEGIN SUPPORT FOR TILE RENDERS """
+
+# tile jobs end with '-- --tile <index> <count>' (see 'buildTileJobStrings' in 'blender_task')
+scriptArgs = sys.argv[sys.argv.index("--") + 1:] if "--" in sys.argv else []
+if "--tile" in scriptArgs:
+    tileIndex = int(scriptArgs[scriptArgs.index("--tile") + 1])
+    numTiles = int(scriptArgs[scriptArgs.index("--tile") + 2])
+    for scn in bpy.data.scenes:
+        rd = scn.render
+        height = rd.resolution_y * rd.resolution_percentage // 100
+        # tile 0 is the bottom strip; each edge sits a quarter row past its pixel row, so Blender picks the same row whether it rounds or truncates
+        minRow = height * tileIndex // numTiles
+        maxRow = height * (tileIndex + 1) // numTiles
+        rd.use_border = True
+        rd.use_crop_to_border = True
+        rd.border_min_x = 0
+        rd.border_max_x = 1
+        rd.border_min_y = (minRow + .25) / height
+        rd.border_max_y = min(1, (maxRow + .25) / height)
+        # uncompressed, so the host server can stitch the strips without an imaging library
+        rd.image_settings.file_format = "TARGA_RAW"
+    scn = bpy.context.scene
+
+""" END SUPPORT FOR TILE RENDERS """
+
+""" BEGIN SUPPORT FOR SUMMING SEEDS ON THE NODE """
+
+# jobs of several seeds repeat '-a' for each and end with '-- --seeds <count>' (see 'buildJobString' in 'blender_task')
+if "--seeds" in scriptArgs:
+    import json
+    import os
+    import struct
+    import numpy
+
+    numSeeds = int(scriptArgs[scriptArgs.index("--seeds") + 1])
+    seedSums = {"seeds":0, "samples":0, "image":None, "sum":None, "sqSum":None}
+
+    def read_seed(path):
+        """ returns the header fields and stored values (bottom row first) of the uncompressed TGA image at 'path' """
+        with open(path, "rb") as f:
+            data = f.read()
+        idLength, colorMapType, imageType = struct.unpack("<BBB", data[:3])
+        colorMapLength, colorMapDepth = struct.unpack("<HB", data[5:8])
+        width, height, pixelDepth, descriptor = struct.unpack("<HHBB", data[12:18])
+        if imageType not in (2, 3):
+            raise ValueError("'{path}' is not an uncompressed TGA image".format(path=path))
+        start = 18 + idLength + (colorMapLength * ((colorMapDepth + 7) // 8) if colorMapType else 0)
+        values = numpy.frombuffer(data, numpy.uint8, height * width * pixelDepth // 8, start).reshape(height, -1)
+        if descriptor & 0x20:
+            values = values[::-1]
+        image = {"width":width, "height":height, "imageType":imageType, "pixelDepth":pixelDepth, "alphaBits":descriptor & 0x0f}
+        return image, values.astype(numpy.float64)
+
+    @persistent
+    def sum_seed(scene):
+        """ folds the seed just written into the sums (weighted by its samples), writing them out in its place after the last seed """
+        path = bpy.path.abspath(scene.render.frame_path(frame=scene.frame_current))
+        image, values = read_seed(path)
+        samples = scene.cycles.samples ** 2 if scene.cycles.use_square_samples else scene.cycles.samples
+        if seedSums["sum"] is None:
+            seedSums["image"] = image
+            seedSums["sum"] = numpy.zeros(values.shape)
+            seedSums["sqSum"] = numpy.zeros(values.shape)
+        weighted = values * samples
+        seedSums["sum"] += weighted
+        weighted *= values
+        seedSums["sqSum"] += weighted
+        seedSums["seeds"] += 1
+        seedSums["samples"] += samples
+        os.remove(path)
+        if seedSums["seeds"] < numSeeds:
+            # the next '-a' renders the next seed
+            for s in bpy.data.scenes:
+                s.cycles.seed = randomSeed + seedSums["seeds"]
+            return
+        # read back with 'read_partial_sums_header' in 'blender_task'
+        info = dict(seedSums["image"], seeds=seedSums["seeds"], samples=seedSums["samples"])
+        with open(os.path.splitext(path)[0] + ".sum", "wb") as f:
+            f.write((json.dumps(info) + "\n").encode("utf-8"))
+            f.write(seedSums["sum"].astype(numpy.float64).tobytes())
+            f.write(seedSums["sqSum"].astype(numpy.float64).tobytes())
+
+    bpy.app.handlers.render_write.append(sum_seed)
+
+""" END SUPPORT FOR SUMMING SEEDS ON THE NODE """
+
 randomSeed = random.randint(1, 10000)
 for scn in bpy.data.scenes:
     scn.cycles.seed = randomSeed
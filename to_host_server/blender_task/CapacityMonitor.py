@@ -0,0 +1,137 @@
+#!/usr/bin/env python
+# Copyright (C) 2018 Christopher Gearhart
+# chris@bblanimation.com
+# http://bblanimation.com/
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+# system imports
+import shlex
+import subprocess
+import threading
+import time
+from supporting_methods import *
+
+CAPACITY_COMMAND = "nproc; cat /proc/loadavg; grep -E \"^(MemTotal|MemAvailable):\" /proc/meminfo"
+
+def parse_capacity(output):
+    """ returns {"cores", "load", "memTotal", "memAvailable"} (memory in MB) from the output of 'CAPACITY_COMMAND' (None if it is incomplete) """
+    lines = output.strip().splitlines()
+    if len(lines) < 3:
+        return None
+    try:
+        capacity = {"cores":int(lines[0]), "load":float(lines[1].split()[0])}
+        for line in lines[2:]:
+            key, value = line.split(":", 1)
+            capacity[key[0].lower() + key[1:]] = int(value.split()[0]) / 1024.
+    except (ValueError, IndexError):
+        return None
+    if "memTotal" not in capacity:
+        return None
+    # kernels older than 3.14 don't report MemAvailable
+    capacity.setdefault("memAvailable", capacity["memTotal"])
+    return capacity
+
+class CapacityMonitor(threading.Thread):
+    """ Samples each host's cores, memory and load over ssh and sets how many jobs it may run at once """
+
+    def __init__(self, username, hosts=None, interval=30.0, cores_per_job=8, job_memory=2048, max_on_host=8, ssh_pool=None, max_workers=64, verbose=0):
+        super(CapacityMonitor, self).__init__()
+        self.name = "Thread-CapacityMonitor"
+        self.daemon = True
+        self.username = username
+        self.verbose = verbose
+        # Seconds between samples of the same host
+        self.interval = interval
+        # Cores and MB of memory each job is expected to use
+        self.cores_per_job = cores_per_job
+        self.job_memory = job_memory
+        # Upper bound on any host's limit
+        self.max_on_host = max_on_host
+        self.ssh_pool = ssh_pool
+        self.max_workers = max_workers
+
+        # JobHost objects to tune, indexed by hostname
+        self.hosts = dict()
+        for host in hosts or []:
+            self.add_host(host)
+        # Latest sample from each host, indexed by hostname
+        self.capacity = dict()
+        self.stop_event = threading.Event()
+
+    def add_host(self, host):
+        self.hosts[host.get_hostname()] = host
+
+    def get_capacity(self, hostname):
+        return self.capacity.get(hostname)
+
+    def sample(self, hostname):
+        """ runs 'CAPACITY_COMMAND' on 'hostname' over the host's ssh master connection (if there is one) """
+        sshOptions = "-oBatchMode=yes -oConnectTimeout=5"
+        if self.ssh_pool:
+            # open the master now, so the host thread finds it ready when it starts its first job
+            self.ssh_pool.open(hostname)
+            sshOptions = "{poolOptions} {sshOptions}".format(poolOptions=self.ssh_pool.ssh_options(hostname), sshOptions=sshOptions)
+            self.ssh_pool.record_use(hostname)
+        sshCommand = "{ssh_c_string} '{command}'".format(ssh_c_string=ssh_string(self.username, hostname, self.verbose, sshOptions), command=CAPACITY_COMMAND)
+        try:
+            process = subprocess.Popen(shlex.split(sshCommand), stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+            output = process.communicate()[0]
+        except OSError:
+            return None
+        if process.returncode != 0:
+            return None
+        if not isinstance(output, str):
+            output = output.decode("utf-8", "replace")
+        return parse_capacity(output)
+
+    def compute_limit(self, capacity, numRunning):
+        """ number of jobs a host with 'capacity' should run, given it was running 'numRunning' when sampled """
+        # our own renders show up in the load and used memory, so only hold other users' share against the host
+        ownLoad = min(capacity["cores"], numRunning * self.cores_per_job)
+        otherLoad = max(0, capacity["load"] - ownLoad)
+        freeCores = capacity["cores"] - otherLoad
+        if freeCores < min(capacity["cores"], self.cores_per_job) / 2.:
+            # someone else is using most of this machine, so leave it alone until they're done
+            cpuLimit = 0
+        else:
+            cpuLimit = max(1, int(freeCores / self.cores_per_job))
+        memLimit = int((capacity["memAvailable"] + numRunning * self.job_memory) / self.job_memory) if self.job_memory else cpuLimit
+        return max(0, min(self.max_on_host, cpuLimit, memLimit))
+
+    def update(self, hostname):
+        host = self.hosts.get(hostname)
+        if not host or not host.is_reachable():
+            return
+        numRunning = host.num_running
+        capacity = self.sample(hostname)
+        if not capacity:
+            return
+        capacity["checked"] = time.time()
+        self.capacity[hostname] = capacity
+        limit = self.compute_limit(capacity, numRunning)
+        if limit != host.max_on_host and self.verbose >= 2:
+            pflush("Setting max server load on {hostname} to {limit} ({cores} cores, load {load:.1f}, {memAvailable:.0f}MB free)".format(hostname=hostname, limit=limit, **capacity))
+        host.set_max_on_host(limit)
+
+    def update_all(self):
+        """ samples every host concurrently, returning once every sample has finished """
+        run_threaded(self.update, list(self.hosts.keys()), self.max_workers, self.name)
+
+    def run(self):
+        while not self.stop_event.wait(self.interval):
+            self.update_all()
+
+    def stop(self):
+        self.stop_event.set()
@@ -0,0 +1,128 @@
+#!/usr/bin/env python
+# Copyright (C) 2018 Christopher Gearhart
+# chris@bblanimation.com
+# http://bblanimation.com/
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+# system imports
+import socket
+import telnetlib
+import threading
+import time
+from supporting_methods import *
+
+class HostMonitor(threading.Thread):
+    """ Probes the ssh port of every host in the background and caches the result for the scheduler """
+
+    def __init__(self, hostnames=None, interval=5.0, ttl=None, timeout=.01, max_timeout=2.0, max_workers=256, verbose=0, print_connection_issue=False):
+        super(HostMonitor, self).__init__()
+        self.name = "Thread-HostMonitor"
+        self.daemon = True
+        self.verbose = verbose
+        self.print_connection_issue = print_connection_issue
+
+        # Seconds between probes of the same host
+        self.interval = interval
+        # Seconds a probe result is trusted; a host that has not been probed since is treated as unreachable
+        self.ttl = ttl or interval * 3
+        # Timeouts adapt per host between these bounds, based on the measured connect time
+        self.min_timeout = timeout
+        self.max_timeout = max(timeout, max_timeout)
+        # Upper bound on the number of probes in flight at once
+        self.max_workers = max_workers
+
+        # Stores probe results, indexed by hostname
+        self.status = dict()
+        for hostname in hostnames or []:
+            self.add_host(hostname)
+
+        # Functions called with (hostname, reachable) whenever a host comes online or drops off
+        self.callbacks = list()
+        self.stop_event = threading.Event()
+
+    def add_host(self, hostname):
+        if hostname not in self.status:
+            self.status[hostname] = {"reachable":False, "checked":0, "rtt":None, "timeout":self.min_timeout}
+
+    def add_callback(self, callback):
+        self.callbacks.append(callback)
+
+    def get_hostnames(self):
+        return list(self.status.keys())
+
+    def is_reachable(self, hostname):
+        """ O(1) lookup of the cached probe result (never touches the network) """
+        hostStatus = self.status.get(hostname)
+        if not hostStatus:
+            return False
+        return hostStatus["reachable"] and time.time() - hostStatus["checked"] <= self.ttl
+
+    def get_rtt(self, hostname):
+        return self.status[hostname]["rtt"]
+
+    def get_timeout(self, hostname):
+        return self.status[hostname]["timeout"]
+
+    def probe(self, hostname):
+        """ connects to port 22 on 'hostname', updating the cached status and the adaptive timeout """
+        self.add_host(hostname)
+        hostStatus = self.status[hostname]
+        timeout = hostStatus["timeout"]
+        startTime = time.time()
+        try:
+            tn = telnetlib.Telnet(hostname, 22, timeout)
+            tn.close()
+            reachable = True
+            rtt = time.time() - startTime
+            # smooth the connect time so one slow handshake doesn't swing the timeout
+            hostStatus["rtt"] = rtt if hostStatus["rtt"] is None else .75 * hostStatus["rtt"] + .25 * rtt
+            hostStatus["timeout"] = min(self.max_timeout, max(self.min_timeout, hostStatus["rtt"] * 4))
+        except Exception as e:
+            reachable = False
+            if self.verbose >= 1 and self.print_connection_issue:
+                print("Encountered following error connecting to '" + str(hostname) + "': " + str(e))
+            # a slow link looks just like a dead one with a tight timeout, so give it longer next time
+            if isinstance(e, socket.timeout):
+                hostStatus["timeout"] = min(self.max_timeout, timeout * 2)
+        changed = reachable != hostStatus["reachable"]
+        hostStatus["reachable"] = reachable
+        hostStatus["checked"] = time.time()
+        if changed:
+            for callback in self.callbacks:
+                callback(hostname, reachable)
+        return reachable
+
+    def probe_all(self, hostnames=None):
+        """ probes hosts concurrently on a bounded pool of threads, returning once every probe has finished """
+        hostnames = hostnames or self.get_hostnames()
+        for hostname in hostnames:
+            self.add_host(hostname)
+        if len(hostnames) <= 1:
+            for hostname in hostnames:
+                self.probe(hostname)
+            return
+        run_threaded(self.probe, hostnames, self.max_workers, self.name)
+
+    def run(self):
+        while not self.stop_event.is_set():
+            now = time.time()
+            dueHosts = [hostname for hostname in self.get_hostnames() if self.status[hostname]["checked"] + self.interval <= now]
+            if dueHosts:
+                self.probe_all(dueHosts)
+            nextCheck = min([self.status[hostname]["checked"] + self.interval for hostname in self.get_hostnames()] or [time.time() + self.interval])
+            self.stop_event.wait(max(0, nextCheck - time.time()))
+
+    def stop(self):
+        self.stop_event.set()
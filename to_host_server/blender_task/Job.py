@@ -0,0 +1,117 @@
+#!/usr/bin/env python
+# Copyright (C) 2018 Christopher Gearhart
+# chris@bblanimation.com
+# http://bblanimation.com/
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+# system imports
+import re
+import threading
+from supporting_methods import *
+
+JOB_QUEUED  = "queued"
+JOB_RUNNING = "running"
+JOB_DONE    = "done"
+JOB_FAILED  = "failed"
+JOB_STATES  = (JOB_QUEUED, JOB_RUNNING, JOB_DONE, JOB_FAILED)
+
+class Job(object):
+    """ One render job: its Blender command, the frames it covers and where it is in the schedule """
+
+    # no per-instance __dict__, since a long animation can have 100k of these; jobs hash by identity
+    __slots__ = ("id", "command", "outputName", "startFrame", "endFrame", "seed", "state", "attempts", "failed_hosts", "dispatch_time", "finish_time", "queue")
+
+    def __init__(self, command, id=None, queue=None):
+        self.id = id
+        # JobQueue the job was created by (its owner tells a shared host which render the job belongs to)
+        self.queue = queue
+        # Blender command run on the node (see 'buildJobString')
+        self.command = command
+        parsed = parseJobString(command)
+        self.outputName, self.startFrame, self.endFrame = parsed or (None, None, None)
+        seedMatch = re.search(r"_seed-(\d+)(-\d+s)?$", self.outputName or "")
+        self.seed = int(seedMatch.group(1)) if seedMatch else None
+        self.state = JOB_QUEUED
+        # Failed attempts so far, and the hosts they failed on (in order)
+        self.attempts = 0
+        self.failed_hosts = None
+        # When the job was first started on a host, and when it finished
+        self.dispatch_time = None
+        self.finish_time = None
+
+    def __str__(self):
+        return self.command
+
+    def __repr__(self):
+        return "Job({id}, {frames})".format(id=self.id, frames=self.describe_frames())
+
+    def num_frames(self):
+        if self.startFrame is None:
+            return 1
+        return self.endFrame - self.startFrame + 1
+
+    def add_failed_host(self, hostname):
+        if self.failed_hosts is None:
+            self.failed_hosts = list()
+        self.failed_hosts.append(hostname)
+
+    def failed_on(self, hostname):
+        return self.failed_hosts is not None and hostname in self.failed_hosts
+
+    def describe_frames(self):
+        if self.startFrame is None:
+            return self.command
+        if self.startFrame == self.endFrame:
+            return "frame {frame} ({outputName})".format(frame=self.startFrame, outputName=self.outputName)
+        return "frames {startFrame}-{endFrame} ({outputName})".format(startFrame=self.startFrame, endFrame=self.endFrame, outputName=self.outputName)
+
+
+class JobStore():
+    """ Creates jobs and counts them by state, so checking on the schedule never means going through every job """
+
+    def __init__(self, queue=None):
+        self.lock = threading.Lock()
+        self.next_id = 0
+        # Queue every job made here belongs to
+        self.queue = queue
+        # Number of jobs in each state (finished jobs aren't kept here, so they can be freed)
+        self.counts = dict((state, 0) for state in JOB_STATES)
+
+    def add(self, command):
+        """ returns a new queued Job running 'command' """
+        with self.lock:
+            job = Job(command, self.next_id, self.queue)
+            self.next_id += 1
+            self.counts[JOB_QUEUED] += 1
+        return job
+
+    def set_state(self, job, state):
+        with self.lock:
+            if job.state == state:
+                return
+            self.counts[job.state] -= 1
+            self.counts[state] += 1
+            job.state = state
+
+    def count(self, state):
+        return self.counts[state]
+
+    def num_unfinished(self):
+        """ jobs that are queued, waiting to be retried or running """
+        return self.counts[JOB_QUEUED] + self.counts[JOB_RUNNING]
+
+    def get_counts(self):
+        with self.lock:
+            return dict(self.counts)
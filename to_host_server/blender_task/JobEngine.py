@@ -0,0 +1,249 @@
+#!/usr/bin/env python
+# Copyright (C) 2018 Christopher Gearhart
+# chris@bblanimation.com
+# http://bblanimation.com/
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+# system imports
+import errno
+import fcntl
+import os
+import select
+import signal
+import subprocess
+import sys
+import threading
+from supporting_methods import *
+
+class EngineJob():
+    """ One job's task pipeline (see 'task_pipeline') run by a JobEngine; stands in for the 'Process' running 'start_tasks' """
+
+    def __init__(self, engine, name, pipeline, callback=None):
+        self.engine = engine
+        self.name = name
+        self.pipeline = pipeline
+        # Called from the engine thread with this job once it has finished
+        self.callback = callback
+        self.exitcode = None
+        self.pid = None
+        self.done = threading.Event()
+        self.killed = False
+        # The running step's process, and its stdout not yet split into lines
+        self.process = None
+        self.command = None
+        self.output = None
+        self.buffer = b""
+
+    def start(self):
+        self.engine.submit(self)
+
+    def is_alive(self):
+        return not self.done.is_set()
+
+    def join(self, timeout=None):
+        self.done.wait(timeout)
+
+    def terminate(self):
+        self.engine.terminate(self)
+
+
+class JobEngine(threading.Thread):
+    """ Runs every job's rsync/ssh/blender commands from a single thread, polling their output instead of waiting on each in a process of its own """
+
+    def __init__(self, poll_interval=.2, verbose=0):
+        super(JobEngine, self).__init__()
+        self.name = "Thread-JobEngine"
+        self.daemon = True
+        self.verbose = verbose
+        # Longest the engine sleeps before checking whether commands have exited
+        self.poll_interval = poll_interval
+        # Jobs submitted or terminated from other threads, picked up by the engine thread
+        self.lock = threading.Lock()
+        self.submitted = list()
+        self.terminated = list()
+        self.stopped = False
+        # Jobs with a command running, and the same jobs indexed by the fd of their command's stdout
+        self.running = set()
+        self.outputs = dict()
+        self.poller = select.poll()
+        # Other threads write a byte here to wake the engine from 'poll'
+        self.wake_read, self.wake_write = os.pipe()
+        for fd in (self.wake_read, self.wake_write):
+            set_nonblocking(fd)
+        self.poller.register(self.wake_read, select.POLLIN)
+
+    def submit(self, job):
+        with self.lock:
+            self.submitted.append(job)
+        self.wake()
+
+    def terminate(self, job):
+        with self.lock:
+            self.terminated.append(job)
+        self.wake()
+
+    def stop(self):
+        self.stopped = True
+        self.wake()
+
+    def wake(self):
+        try:
+            os.write(self.wake_write, b"x")
+        except OSError as e:
+            # the pipe is full, so the engine is due to wake anyway
+            if e.errno not in (errno.EAGAIN, errno.EWOULDBLOCK):
+                raise
+
+    def run(self):
+        while not self.stopped:
+            for fd, event in self.poller.poll(self.poll_interval * 1000):
+                if fd == self.wake_read:
+                    self.read_wake()
+                elif fd in self.outputs:
+                    self.read_output(self.outputs[fd])
+            self.handle_requests()
+            self.reap()
+        # nothing will wait on these any more, so don't leave them rendering
+        for job in list(self.running):
+            job.process.terminate()
+        with self.lock:
+            jobs = list(self.running) + self.submitted
+            self.submitted = list()
+        for job in jobs:
+            self.finish(job, -signal.SIGTERM)
+
+    def read_wake(self):
+        try:
+            while os.read(self.wake_read, 4096):
+                pass
+        except OSError as e:
+            if e.errno not in (errno.EAGAIN, errno.EWOULDBLOCK):
+                raise
+
+    def handle_requests(self):
+        with self.lock:
+            submitted = self.submitted
+            terminated = self.terminated
+            self.submitted = list()
+            self.terminated = list()
+        for job in submitted:
+            self.advance(job, None)
+        for job in terminated:
+            job.killed = True
+            if job.process:
+                job.process.terminate()
+
+    def launch(self, job, command):
+        try:
+            # close_fds so other jobs' commands don't hold this one's stdout open
+            job.process = subprocess.Popen(command.args, shell=command.shell, stdout=subprocess.PIPE, close_fds=True)
+        except OSError as e:
+            eflush("could not run command for job {name}: {error}\n".format(name=job.name, error=str(e)))
+            self.advance(job, 127)
+            return
+        job.command = command
+        job.pid = job.process.pid
+        job.output = job.process.stdout.fileno()
+        set_nonblocking(job.output)
+        self.outputs[job.output] = job
+        self.poller.register(job.output, select.POLLIN)
+        self.running.add(job)
+
+    def read_output(self, job):
+        """ reads what 'job's command has written so far, returning False once its stdout is closed """
+        while job.output is not None:
+            try:
+                data = os.read(job.output, 65536)
+            except OSError as e:
+                if e.errno in (errno.EAGAIN, errno.EWOULDBLOCK):
+                    return True
+                raise
+            if not data:
+                self.close_output(job)
+                return False
+            job.buffer += data
+            lines = job.buffer.split(b"\n")
+            job.buffer = lines.pop()
+            for line in lines:
+                self.handle_line(job, line + b"\n")
+        return False
+
+    def handle_line(self, job, line):
+        if not isinstance(line, str):
+            line = line.decode("utf-8", "replace")
+        if job.command.on_line:
+            try:
+                job.command.on_line(line)
+            except Exception as e:
+                eflush("error handling output of job {name}: {error}\n".format(name=job.name, error=str(e)))
+        else:
+            sys.stdout.write(line)
+            sys.stdout.flush()
+
+    def close_output(self, job):
+        if job.output is None:
+            return
+        self.poller.unregister(job.output)
+        del self.outputs[job.output]
+        job.process.stdout.close()
+        job.output = None
+        if job.buffer:
+            self.handle_line(job, job.buffer)
+            job.buffer = b""
+
+    def reap(self):
+        """ moves every job whose command has exited on to its next step """
+        for job in list(self.running):
+            returncode = job.process.poll()
+            if returncode is None:
+                continue
+            # pick up whatever it wrote before exiting
+            self.read_output(job)
+            self.close_output(job)
+            self.running.discard(job)
+            job.process = None
+            self.advance(job, returncode)
+
+    def advance(self, job, returncode):
+        """ sends 'returncode' to 'job's pipeline and starts the command it yields next (finishing the job if there is none) """
+        if job.killed:
+            self.finish(job, returncode or -signal.SIGTERM)
+            return
+        try:
+            if returncode is None:
+                step = next(job.pipeline)
+            else:
+                step = job.pipeline.send(returncode)
+        except Exception as e:
+            eflush("job {name} failed: {error}\n".format(name=job.name, error=str(e)))
+            step = 1
+        if isinstance(step, Command):
+            self.launch(job, step)
+        else:
+            self.finish(job, step)
+
+    def finish(self, job, exitcode):
+        if job.done.is_set():
+            return
+        job.pipeline.close()
+        job.exitcode = exitcode
+        job.done.set()
+        if job.callback:
+            job.callback(job)
+
+
+def set_nonblocking(fd):
+    flags = fcntl.fcntl(fd, fcntl.F_GETFL)
+    fcntl.fcntl(fd, fcntl.F_SETFL, flags | os.O_NONBLOCK)
@@ -17,17 +17,25 @@
 # along with this program.  If not, see <http://www.gnu.org/licenses/>.
 
 # system imports
+import os
+import subprocess
+import sys
 import telnetlib
 import threading
 import time
 from supporting_methods import *  #start_tasks
+from JobQueue import *
+from HostMonitor import *
+from SSHConnectionPool import *
+from RenderWorker import *
+from JobEngine import *
 # from multiprocessing import Pool
 from multiprocessing import Process
 
 class JobHost(threading.Thread):
     """ Write tooltip here """
 
-    def __init__(self, hostname, jobs_list=None, thread_func=None, kwargs=None, callback=None, timeout=.01, print_connection_issue=False, verbose=0, error_callback=None, max_on_host=4, cleanup_when_done=False):
+    def __init__(self, hostname, jobs_list=None, thread_func=None, kwargs=None, callback=None, timeout=.01, print_connection_issue=False, verbose=0, error_callback=None, max_on_host=4, cleanup_when_done=False, job_queue=None, host_monitor=None, ssh_pool=None, use_workers=False, engine=None):
         super(JobHost, self).__init__()
         self.verbose = verbose
         self.rfc_timeout = timeout
@@ -44,7 +52,12 @@ class JobHost(threading.Thread):
         self.reachable = False
         # In case the status of the host changes after we have checked it once
         self.reachable_change = False
-        self.is_telnetable() # Will set up self.reachable
+        # Shared background prober; when set, reachability is read from its cache instead of probing here
+        self.host_monitor = host_monitor
+        if host_monitor:
+            host_monitor.add_host(hostname)
+        else:
+            self.is_telnetable() # Will set up self.reachable
 
         self.max_on_host = max_on_host
         # List of job strings. This is how jobs are initially handed over to the host
@@ -54,7 +67,7 @@ class JobHost(threading.Thread):
         else:
             self.job_count = 0
 
-        self.jobs = dict() # Stores info about a job. Indexed by job string
+        self.jobs = dict() # Stores info about each running job. Indexed by Job (dropped once the job has been handled)
 
         if not kwargs: kwargs = dict()
         self.kwargs = kwargs # Arguments to be handed over to the thread_func
@@ -65,11 +78,39 @@ class JobHost(threading.Thread):
         if not callback: callback = lambda *x: x
         self.callback = callback # Set up callback so host can notify outside world when it finishes jobs
         self.error_callback = error_callback # If an error comes up while working on jobs
+        self.start_callback = None # Notified when a job is started (e.g. to journal the dispatch)
 
         self.killed  = False
         self.started = False
         # self.pool = Pool(processes=self.max_on_host,maxtasksperchild=1)
 
+        # Guards 'jobs_list' and 'finished_jobs'; notified whenever the host thread has something to do
+        self.job_event = threading.Condition()
+        # Jobs whose child processes have exited but have not been handled by the host thread yet
+        self.finished_jobs = list()
+        self.num_running = 0
+
+        # Shared queue the host pulls from once its local 'jobs_list' backlog is empty
+        self.job_queue = None
+        if job_queue is not None:
+            self.set_job_queue(job_queue)
+
+        # Shared ssh master connections (every job on this host reuses one connection when set)
+        self.ssh_pool = ssh_pool
+
+        # Run jobs on resident Blender processes that keep the project loaded, instead of one Blender per job
+        self.use_workers = use_workers
+        # Resident workers waiting for their next job, and every worker started on this host
+        self.idle_workers = list()
+        self.workers = list()
+        self.worker_lock = threading.Lock()
+
+        # Shared engine running every host's job commands from one thread (each job gets a child process of its own when None)
+        self.engine = engine
+
+        # Threads killing cancelled jobs on the node (joined in 'join_cancellers' before the ssh connections close)
+        self.cancellers = list()
+
     def __str__(self):
         aString = threading.Thread.__str__(self)
         return aString
@@ -83,6 +124,29 @@ class JobHost(threading.Thread):
     def set_error_callback(self, error_callback):
         self.error_callback = error_callback
 
+    def set_start_callback(self, start_callback):
+        self.start_callback = start_callback
+
+    def set_job_queue(self, job_queue):
+        self.job_queue = job_queue
+        job_queue.add_host(self)
+
+    def set_ssh_pool(self, ssh_pool):
+        self.ssh_pool = ssh_pool
+
+    def set_max_on_host(self, max_on_host):
+        """ changes how many jobs may run at once; running jobs are left alone if it drops """
+        with self.job_event:
+            self.max_on_host = max_on_host
+            self.job_event.notify()
+
+    def set_use_workers(self, use_workers):
+        self.use_workers = use_workers
+
+    def set_engine(self, engine):
+        """ runs jobs as 'task_pipeline' steps on 'engine' instead of calling 'thread_func' in a child process """
+        self.engine = engine
+
     def is_complete_without_error(self):
         for job in self.jobs:
             if not job["exit_status"] == 0:
@@ -98,47 +162,135 @@ class JobHost(threading.Thread):
     def get_hostname(self):
         return self.hostname
 
+    def get_job_time(self, job):
+        """ seconds 'job' took from start to finish (or so far, if it is still running) """
+        jobInfo = self.jobs[job]
+        return jobInfo.get('end_time', time.time()) - jobInfo['start_time']
+
     def is_reachable(self):
+        if self.host_monitor:
+            return self.host_monitor.is_reachable(self.hostname)
         return self.reachable
 
     def is_started(self):
         return self.started
 
+    def is_running(self, job):
+        jobInfo = self.jobs.get(job)
+        return jobInfo is not None and 'exit_status' not in jobInfo and not jobInfo.get('cancelled')
+
+    def has_job(self, job):
+        """ True while this host has a copy of 'job' (even a cancelled one that hasn't exited yet) """
+        return job in self.jobs
+
+    def get_running_jobs(self):
+        """ returns (job, info) for every job running on this host """
+        return [(job, jobInfo) for job, jobInfo in list(self.jobs.items()) if 'exit_status' not in jobInfo and not jobInfo.get('cancelled')]
+
+    def cancel_job(self, job):
+        """ stops this host's copy of 'job' (e.g. another host finished it first), killing Blender on the node too """
+        with self.job_event:
+            if not self.is_running(job):
+                return False
+            jobInfo = self.jobs[job]
+            jobInfo['cancelled'] = True
+            # 'start_job' won't launch it, or kills it itself once it has
+            if not jobInfo.get('launched'):
+                return True
+        self.start_canceller(job, jobInfo['process'])
+        return True
+
+    def start_canceller(self, job, job_process):
+        if self.verbose >= 2:
+            pflush("Cancelling job on host {hostname}: {job}".format(hostname=self.hostname, job=job))
+        # don't hold up the calling thread on the ssh round trip
+        canceller = threading.Thread(target=self.kill_job, args=(job, job_process), name="{name}-cancel".format(name=self.name))
+        canceller.daemon = True
+        canceller.start()
+        with self.job_event:
+            self.cancellers = [thread for thread in self.cancellers if thread.is_alive()] + [canceller]
+
+    def join_cancellers(self, timeout=None):
+        """ waits up to 'timeout' seconds for the jobs cancelled on this host to be killed on the node, returning False if some still aren't """
+        deadline = None if timeout is None else time.time() + timeout
+        with self.job_event:
+            cancellers = list(self.cancellers)
+        for canceller in cancellers:
+            canceller.join(None if deadline is None else max(0, deadline - time.time()))
+        return not any(canceller.is_alive() for canceller in cancellers)
+
+    def kill_job(self, job, job_process):
+        jobArgs = self.get_job_args(job)
+        if not self.use_workers and "username" in jobArgs:
+            # terminating the local process would leave Blender rendering on the node
+            killCommand = kill_blender_string(jobArgs["username"], self.hostname, job.command, self.verbose, self.get_ssh_options())
+            devnull = open(os.devnull, "w")
+            subprocess.call(killCommand, shell=True, stdout=devnull, stderr=devnull)
+            devnull.close()
+        job_process.terminate()
+
     def print_job_status(self, state, job=None, verbose=1):
         if self.verbose >= 2 or verbose >= 1:
             pflush("Job {state} on host {hostname}".format(state=state, hostname=self.get_hostname()))
             if self.verbose >= 2:
-                pflush(job + "\n")
+                pflush(str(job) + "\n")
 
     def run(self):
         # checks job queue for jobs that were created on the host before the start command was issued.
-        # runs host main loop
-        acc = 0
+        # runs host main loop, sleeping until a job exits, a job is added or the host is killed
+        if self.ssh_pool:
+            self.ssh_pool.open(self.hostname)
         while True:
-            if acc < self.max_on_host:
-                job = self.get_next_job()
-                # Start jobs in the pool if we are not already past the max running jobs
-                if job and job not in self.jobs:
-                    self.start_job(job)
-                    acc += 1
-            # Check on child processes
-            for job_key in self.jobs.keys():
-                job_process=self.jobs[job_key]['process']
-                if( job_process.exitcode != None and 'printed' not in self.jobs[job_key] ):
-                    acc -= 1
-                    exitstatus = job_process.exitcode
-                    self.jobs[job_key]['exit_status'] = exitstatus
-                    self.jobs[job_key]['printed'] = True
+            with self.job_event:
+                while not self.finished_jobs and not self.can_start_job() and not self.terminate():
+                    self.job_event.wait()
+                finished_jobs = self.finished_jobs
+                self.finished_jobs = list()
+            # Handle child processes that have exited
+            for job_key in finished_jobs:
+                self.num_running -= 1
+                exitstatus = self.jobs[job_key]['process'].exitcode
+                self.jobs[job_key]['exit_status'] = exitstatus
+                self.jobs[job_key]['end_time'] = time.time()
+                self.jobs[job_key]['printed'] = True
+                # another host finished this job first, so nobody is waiting on this copy
+                if self.jobs[job_key].get('cancelled'):
+                    self.job_count -= 1
+                    self.print_job_status("cancelled", job_key, verbose=0)
+                else:
+                    self.job_complete(job=job_key)
                     if exitstatus == 0:
-                        (self.get_callback())(self.hostname,job_key)
+                        (self.get_callback(job_key))(self.hostname,job_key)
                     else:
-                        (self.get_error_callback())(self.hostname,job_key)
-
-                    self.job_complete(job=job_key)
+                        (self.get_error_callback(job_key))(self.hostname,job_key)
+                # let go of the finished process, so memory doesn't grow with the number of jobs run
+                del self.jobs[job_key]
+            # Start jobs if we are not already past the max running jobs
+            while self.can_start_job():
+                job = self.get_next_job()
+                if not job:
+                    break
+                # the queue doesn't hand a host a job it still has a copy of, but if one slips through it goes back for another host
+                if self.has_job(job):
+                    self.return_job(job)
+                    break
+                self.start_job(job)
             if self.terminate():
                 break
         for job_string in self.jobs.keys():
-            self.jobs[job_string]['process'].terminate()
+            if 'exit_status' not in self.jobs[job_string] and self.jobs[job_string].get('launched'):
+                self.jobs[job_string]['process'].terminate()
+        self.stop_workers()
+
+    def watch_job(self, job, job_process):
+        """ blocks until the child process for 'job' exits, then wakes the host thread """
+        job_process.join()
+        self.job_exited(job)
+
+    def job_exited(self, job):
+        with self.job_event:
+            self.finished_jobs.append(job)
+            self.job_event.notify()
 
     def terminate(self):
         return ( self.cleanup_when_done and self.started and self.all_jobs_complete() or self.jobHostKilled() )
@@ -147,7 +299,9 @@ class JobHost(threading.Thread):
         return self.killed
 
     def kill(self):
-        self.killed = True
+        with self.job_event:
+            self.killed = True
+            self.job_event.notify()
 
     def all_jobs_complete(self):
         remaining_jobs = 0
@@ -157,34 +311,187 @@ class JobHost(threading.Thread):
         return remaining_jobs == 0
 
     def get_next_job(self):
-        if self.can_start_job():
-            return self.jobs_list.pop()
-        return False
+        with self.job_event:
+            if self.num_running >= self.max_on_host:
+                return False
+            if self.jobs_list:
+                return self.jobs_list.pop()
+        # NOTE: our own lock is released before touching the shared queue or other hosts' backlogs
+        if self.job_queue is None or not self.is_reachable():
+            return False
+        job = self.job_queue.get(self) or self.job_queue.steal(self)
+        if not job:
+            return False
+        with self.job_event:
+            self.job_count += 1
+        numQueued = str(len(self.job_queue))
+        if self.job_queue.is_speculative(job):
+            pflush("Speculative copy of a straggling job sent to host '{hostname}'".format(hostname=self.hostname))
+            return job
+        if self.verbose >= 3:
+            pflush("Running job {job} on host {host}. ({numQueued} jobs remain in queue)".format(job=job, host=self.hostname, numQueued=numQueued))
+        pflush("Job sent to host '{hostname}' ({numQueued} jobs remain in queue)".format(hostname=self.hostname, numQueued=numQueued))
+        return job
 
     def can_start_job(self):
-        return (self.job_count <= self.max_on_host) and (len(self.jobs_list) > 0)
+        if self.num_running >= self.max_on_host:
+            return False
+        if self.jobs_list:
+            return True
+        return self.job_queue is not None and self.is_reachable() and (self.job_queue.has_jobs(self) or self.job_queue.can_steal(self))
+
+    def has_backlog(self):
+        """ True if jobs are waiting in 'jobs_list' because every slot on this host is busy """
+        return bool(self.jobs_list) and self.num_running >= self.max_on_host
+
+    def backlog_size(self):
+        return len(self.jobs_list) if self.jobs_list else 0
+
+    def give_up_job(self):
+        """ hands the oldest job in the local backlog to an idle host """
+        with self.job_event:
+            if self.has_backlog():
+                self.job_count -= 1
+                return self.jobs_list.pop(0)
+        return None
+
+    def return_job(self, job):
+        """ hands a job taken from the queue back to it without starting it """
+        with self.job_event:
+            self.job_count -= 1
+        self.job_queue.retry(job)
+
+    def wake(self):
+        with self.job_event:
+            self.job_event.notify()
 
     def can_take_job(self):
         return self.job_count < self.max_on_host
 
-    def get_callback(self):
-        return self.callback
+    def get_owner(self, job):
+        """ the JobHostManager that queued 'job' if this host is shared by several renders (see 'RenderService'), else None """
+        if job.queue is None:
+            return None
+        return job.queue.owner
+
+    def get_job_args(self, job):
+        owner = self.get_owner(job)
+        return owner.function_args if owner else self.kwargs
+
+    def is_first_job(self, job):
+        """ True if the project 'job' renders may not have been synced to this host yet """
+        owner = self.get_owner(job)
+        if owner:
+            return self.hostname not in owner.synced_hosts
+        return self.firstTime
 
-    def get_error_callback(self):
-        return self.error_callback
+    def get_callback(self, job=None):
+        owner = self.get_owner(job) if job else None
+        return owner.host_finished_job if owner else self.callback
+
+    def get_error_callback(self, job=None):
+        owner = self.get_owner(job) if job else None
+        return owner.host_failed_job if owner else self.error_callback
+
+    def get_start_callback(self, job=None):
+        owner = self.get_owner(job) if job else None
+        return owner.host_started_job if owner else self.start_callback
 
     def start_job(self, job):
         self.started = True
-        self.jobs[job] = dict()
-        self.kwargs["jobString"] = job
-        self.kwargs["hostname"] = self.get_hostname()
-        self.kwargs["firstTime"] = self.firstTime
-        job_process=Process(target=self.thread_func,kwargs=self.kwargs)
+        # each job gets its own arguments, since 'self.kwargs' is shared by every host
+        kwargs = dict(self.get_job_args(job))
+        kwargs["jobString"] = job.command
+        kwargs["jobId"] = job.id
+        kwargs["hostname"] = self.get_hostname()
+        kwargs["firstTime"] = self.is_first_job(job)
+        if self.ssh_pool:
+            kwargs["sshOptions"] = self.get_ssh_options()
+        if self.use_workers:
+            job_process = WorkerJob(self, job, kwargs)
+        elif self.engine:
+            # the engine calls back when the job is done, so there's nothing to wait on here
+            job_process = EngineJob(self.engine, job, task_pipeline(**kwargs), callback=lambda job_process: self.job_exited(job))
+        else:
+            job_process=Process(target=run_job_process,args=(self.thread_func, kwargs))
+        # only published complete, so 'cancel_job' always finds the process
+        jobInfo = {'start_time': time.time(), 'process': job_process}
+        with self.job_event:
+            # another host finished it (a speculative copy or a late retry) while it was being set up
+            if job.state == JOB_DONE:
+                self.job_count -= 1
+                return
+            self.jobs[job] = jobInfo
+            self.num_running += 1
+        start_callback = self.get_start_callback(job)
+        if start_callback:
+            start_callback(self.hostname, job)
+        with self.job_event:
+            cancelled = jobInfo.get('cancelled')
+        if cancelled:
+            # handled like any cancelled copy, without ever running it
+            self.job_exited(job)
+            return
+        if self.ssh_pool:
+            # start_tasks runs the blender command and the rsync back, plus the rsync to the host on the first job
+            self.ssh_pool.record_use(self.hostname, 3 if kwargs["firstTime"] else 2)
         job_process.start()
-        self.jobs[job]['process'] = job_process
+        with self.job_event:
+            jobInfo['launched'] = True
+            cancelled = jobInfo.get('cancelled')
+        if cancelled:
+            # cancelled while it was being launched
+            self.start_canceller(job, job_process)
+        if self.engine and not self.use_workers:
+            return
+        # Wait on the child in its own thread so the host thread can sleep instead of polling exit codes
+        watcher = threading.Thread(target=self.watch_job, args=(job, job_process), name="{name}-{pid}".format(name=self.name, pid=job_process.pid))
+        watcher.daemon = True
+        watcher.start()
+
+    def get_ssh_options(self):
+        if self.ssh_pool:
+            return self.ssh_pool.ssh_options(self.hostname)
+        return self.kwargs.get("sshOptions", "")
+
+    def acquire_worker(self):
+        """ returns an idle resident worker, starting a new one if they are all busy (None if it could not be started) """
+        with self.worker_lock:
+            if self.idle_workers:
+                return self.idle_workers.pop()
+        worker = RenderWorker(self.hostname, self.kwargs["username"], self.kwargs["projectName"], self.kwargs["projectPath"], sshOptions=self.get_ssh_options(), progress=self.kwargs.get("progress", False), verbose=self.verbose, statusQueue=self.kwargs.get("statusQueue"))
+        with self.worker_lock:
+            self.workers.append(worker)
+        if self.verbose >= 2:
+            pflush("Starting render worker on host {hostname}".format(hostname=self.hostname))
+        if not worker.start():
+            worker.terminate()
+            return None
+        return worker
+
+    def release_worker(self, worker):
+        """ returns 'worker' to the idle list, dropping it if its Blender process has died """
+        if not worker:
+            return
+        with self.worker_lock:
+            if worker.is_alive():
+                self.idle_workers.append(worker)
+            elif worker in self.workers:
+                self.workers.remove(worker)
+
+    def stop_workers(self):
+        with self.worker_lock:
+            workers = self.workers
+            self.workers = list()
+            self.idle_workers = list()
+        for worker in workers:
+            worker.stop()
 
     def job_complete(self, job=None, exit_status=0):
         self.firstTime = False
+        owner = self.get_owner(job)
+        if owner:
+            owner.synced_hosts.add(self.hostname)
         self.job_count -= 1
 
         # Call the callback
@@ -223,13 +530,22 @@ class JobHost(threading.Thread):
             self.job_count += 1
 
     def add_job(self, job):
-        if not self.jobs_list: self.jobs_list = list()
-        self.jobs_list.append(job)
-        self.job_count += 1
+        with self.job_event:
+            if not self.jobs_list: self.jobs_list = list()
+            self.jobs_list.append(job)
+            self.job_count += 1
+            self.job_event.notify()
+        # let idle hosts know there may be something to steal
+        if self.job_queue is not None:
+            self.job_queue.wake_hosts()
 
     def print_job_list(self):
         print(self.jobs_list)
 
+def run_job_process(thread_func, kwargs):
+    """ runs 'thread_func' in a child process, exiting with its return value ('start_tasks' returns its status) """
+    sys.exit(thread_func(**kwargs))
+
 break_loop = False
 
 def callback_func(host, job):
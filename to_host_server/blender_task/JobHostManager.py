@@ -17,16 +17,40 @@
 # along with this program.  If not, see <http://www.gnu.org/licenses/>.
 
 # system imports
+import heapq
+import os
+import threading
 import time
 from JobHost import *
+from ThroughputTracker import *
+
+# Seconds to wait for cancelled jobs to be killed on the nodes before the ssh connections close
+CANCEL_TIMEOUT = 15
 
 class JobHostManager():
     """ Manages and distributes jobs for all available hosts """
 
-    def __init__(self, jobs=None, hosts=None, max_on_hosts=1, verbose=0, function_args=None):
+    def __init__(self, jobs=None, hosts=None, max_on_hosts=1, verbose=0, function_args=None, wait_timeout=1.0, host_monitor=None, ssh_pool=None, job_queue=None, max_attempts=3, retry_delay=2.0, throughput=None, capacity_monitor=None, journal=None, engine=None, shared=False, result_callback=None, stop_file=None):
         self.jobs               = jobs
-        self.original_jobs      = list(jobs)
         self.function_args      = function_args
+        # ssh master connections shared by every host (closed in 'stop_all_threads')
+        self.ssh_pool           = ssh_pool
+        # Runs the job commands of every host from one thread (stopped in 'stop_all_threads')
+        self.engine             = engine
+        # Every host pulls from this one queue as soon as it has a free slot
+        self.job_queue          = job_queue if job_queue is not None else JobQueue(jobs)
+        # Per-host seconds per frame, fed by finished jobs and Blender status lines from the job processes
+        self.throughput         = throughput or ThroughputTracker(verbose=verbose)
+        self.job_queue.set_throughput(self.throughput)
+        if self.function_args is not None:
+            self.function_args["statusQueue"] = self.throughput.get_status_queue()
+        # Hosts, monitors and the engine belong to a RenderService serving other renders too, so they are left running
+        # when this render is done, and each job tells its host which render it is from (see 'JobQueue.set_owner')
+        self.shared             = shared
+        # Hosts this render's project files have been synced to (tracked by the hosts themselves when not shared)
+        self.synced_hosts       = set()
+        if shared:
+            self.job_queue.set_owner(self)
 
         self.hosts = dict()
         if not hosts: self.hosts = dict()
@@ -34,11 +58,40 @@ class JobHostManager():
         self.host_keys = sorted(self.hosts.keys(), reverse=True)
 
         self.hosts_with_jobs = dict()
-        self.job_status      = dict()
         self.errors          = list()
         self.verbose         = verbose
         self.max_on_hosts    = max_on_hosts
         self.stop_now        = False
+        # Set by host callbacks so 'process_jobs' can sleep until a host reports back
+        self.job_event       = threading.Event()
+        # Upper bound on how long to sleep between passes, so unreachable hosts get re-checked
+        self.wait_timeout    = wait_timeout
+        self.last_probe      = 0
+        # Background prober shared by all hosts (hosts probe for themselves if this is None)
+        self.host_monitor    = host_monitor
+        # a RenderService outlives this render, so it wakes its hosts itself
+        if host_monitor and not shared:
+            host_monitor.add_callback(self.host_reachability_changed)
+        # Background sampler adjusting each host's 'max_on_host' (stopped with the hosts)
+        self.capacity_monitor = capacity_monitor
+        # Records every dispatch, completion and failure so an interrupted render can be resumed
+        self.journal = journal
+        # Called with (hostname, job) once a job's output files are back
+        self.result_callback = result_callback
+        # Once this file shows up, nothing more is dispatched and running jobs are cancelled (e.g. the image has converged)
+        self.stop_file = stop_file
+        self.stopped_early = False
+        # Set when the render ends with jobs unfinished for any other reason (a signal, or its client going away)
+        self.interrupted = False
+
+        # A failed job is retried up to 'max_attempts' times in total, waiting 'retry_delay' seconds (doubling each time) first
+        self.max_attempts    = max_attempts
+        self.retry_delay     = retry_delay
+        # Heap of (time due, job id, Job, hostname it failed on) for jobs waiting to be retried
+        self.pending_retries = list()
+        self.retry_lock      = threading.Lock()
+        # Reasons for the last failure of every job that ran out of attempts, indexed by Job
+        self.failed_jobs     = dict()
         if self.jobs:
             self.process_jobs()
 
@@ -47,82 +100,191 @@ class JobHostManager():
 
     # This blocks
     def process_jobs(self):
-        jobAccepted = False
         try:
             while not self.jobs_complete() and not self.stop_now:
-                # time.sleep(.25)
-                for aHost in self.host_keys:
-                    if self.jobs_complete() or self.stop_now:
-                        break
-                    host = self.hosts[aHost]
-                    if self.host_can_take_job(host=host) and len(self.jobs) > 0:
-                        # time.sleep(.1)
-                        hostname = host.get_hostname()
-                        job = self.jobs.pop()
-                        host.add_job(job)
-                        if host not in self.hosts_with_jobs:
-                            self.hosts_with_jobs[hostname] = host.get_job_count()
-                        if not host.is_started():
-                            host.start()
-                        numQueued = str(len(self.jobs))
-                        if self.verbose >= 3:
-                            pflush("Running job {job} on host {host}. ({numQueued} jobs remain in queue)".format(job=job, host=hostname, numQueued=numQueued))
-                        elif self.verbose >= 2:
-                            pflush("Job sent to host '{hostname}' ({numQueued} jobs remain in queue)".format(hostname=hostname, numQueued=numQueued))
-                        # else:
-                        #     pflush("Job sent to host '{hostname}' ({numRemaining} jobs left)".format(hostname=hostname, numRemaining=self.remaining_jobs()))
-                        pflush("Job sent to host '{hostname}' ({numQueued} jobs remain in queue)".format(hostname=hostname, numQueued=numQueued))
+                self.job_event.clear()
+                self.queue_due_retries()
+                if self.job_queue.speculate and not self.job_queue.has_jobs():
+                    # straggler estimates change as jobs run, so let idle hosts look for one to copy
+                    self.job_queue.wake_hosts()
+                self.start_hosts()
+                # hosts pull their own jobs, so just sleep until one of them reports back (or a retry is due)
+                self.job_event.wait(self.get_wait_time())
+                if self.stop_file and os.path.exists(self.stop_file):
+                    self.stop_early()
             self.stop_all_threads()
         except (KeyboardInterrupt, SystemExit):
             self.stop_all_threads()
+            self.interrupted = True
+        if not self.stopped_early and not self.jobs_complete():
+            self.interrupted = True
+
+    def start_hosts(self):
+        """ starts threads for reachable hosts and re-checks unreachable ones every 'wait_timeout' seconds """
+        if self.shared:
+            # the service started its hosts already
+            return
+        # the host monitor keeps reachability fresh on its own, so only probe here without one
+        probe = not self.host_monitor and time.time() - self.last_probe >= self.wait_timeout
+        if probe:
+            self.last_probe = time.time()
+        for hostname in self.host_keys:
+            if self.stop_now:
+                break
+            host = self.hosts[hostname]
+            if hostname not in self.hosts_with_jobs:
+                if host.is_reachable() or (probe and host.is_telnetable()):
+                    self.hosts_with_jobs[hostname] = host.get_job_count()
+                    host.start()
+            elif probe and not host.is_reachable() and host.is_telnetable():
+                host.wake()
+
+    def get_wait_time(self):
+        with self.retry_lock:
+            if not self.pending_retries:
+                return self.wait_timeout
+            return max(0, min(self.wait_timeout, self.pending_retries[0][0] - time.time()))
+
+    def queue_due_retries(self):
+        """ moves failed jobs whose backoff has expired back onto the job queue """
+        dueJobs = list()
+        with self.retry_lock:
+            while self.pending_retries and self.pending_retries[0][0] <= time.time():
+                dueJobs.append(heapq.heappop(self.pending_retries))
+        for dueTime, jobId, job, hostname in dueJobs:
+            self.job_queue.retry(job)
 
     def jobs_complete(self):
-        for job in self.original_jobs:
-            if job in self.job_status:
-                if self.job_status[job] != 0: return False
-            else:
-                return False
-        return True
+        # chunked queues build their jobs as they go, so check for frames that haven't been handed out yet
+        if self.job_queue.has_jobs() or self.pending_retries:
+            return False
+        # jobs that ran out of attempts are done too, so one bad frame can't keep the render running forever
+        return self.job_queue.store.num_unfinished() == 0
 
     def remaining_jobs(self):
-        remaining = len(self.original_jobs)
-        for job in self.original_jobs:
-            if job in self.job_status:
-                if self.job_status[job] == 0: remaining -= 1
-        return remaining
+        return self.job_queue.num_unbuilt() + self.job_queue.store.num_unfinished()
 
     def add_hosts(self, hosts):
         if type(hosts) == list:
             for host in hosts:
                 self.add_host(host)
-        if type(hosts) == dict:
+        if type(hosts) == dict and self.shared:
+            # leave the hosts pulling from the service's queue; this render's queue just needs to know about them
+            for host in hosts.values():
+                self.job_queue.add_host(host)
+            self.hosts = dict(hosts)
+        elif type(hosts) == dict:
             for key in hosts.keys():
                 host = hosts[key]
                 host.set_kwargs(self.function_args)
                 host.set_callback(self.host_finished_job)
                 host.set_error_callback(self.host_failed_job)
+                host.set_start_callback(self.host_started_job)
+                host.set_job_queue(self.job_queue)
+                if self.ssh_pool:
+                    host.set_ssh_pool(self.ssh_pool)
+                if self.engine:
+                    host.set_engine(self.engine)
                 hosts[key] = host
             self.hosts = hosts
 
     def add_host(self, host):
         host.set_callback(self.host_finished_job)
         host.set_error_callback(self.host_failed_job)
+        host.set_start_callback(self.host_started_job)
+        host.set_job_queue(self.job_queue)
+        if self.ssh_pool:
+            host.set_ssh_pool(self.ssh_pool)
+        if self.engine:
+            host.set_engine(self.engine)
         if self.function_args:
             host.set_kwargs(self.function_args)
         self.hosts[host.get_hostname()] = host
 
+    def host_started_job(self, hostname, job):
+        if job.dispatch_time is None:
+            job.dispatch_time = time.time()
+        # a speculative copy or a late retry of a finished job doesn't bring it back
+        if job.state == JOB_QUEUED:
+            self.job_queue.store.set_state(job, JOB_RUNNING)
+        if self.journal:
+            self.journal.record("dispatch", job.command, hostname)
+
     def host_finished_job(self, hostname, job):
         if self.verbose >= 3:
             print("Completed Job on {hostname}: {job}".format(hostname=hostname, job=job))
-        self.job_status[job] = 0
+        # a speculative copy finished after the job was already done
+        if job.state == JOB_DONE:
+            return
+        # a zero exit status doesn't guarantee the frames made it back, so check for them
+        if self.function_args and self.function_args.get("localResultsPath"):
+            missingFrames = missingOutputFiles(job.command, self.function_args["localResultsPath"])
+            if missingFrames:
+                self.retry_job(hostname, job, "no output file for frames {missingFrames}".format(missingFrames=missingFrames))
+                return
+        job.finish_time = time.time()
+        self.job_queue.store.set_state(job, JOB_DONE)
+        if self.journal:
+            self.journal.record("done", job.command, hostname)
+        if self.result_callback:
+            self.result_callback(hostname, job)
+        if self.job_queue.is_speculative(job):
+            # first copy to finish wins
+            for otherHostname in self.hosts:
+                if otherHostname != hostname:
+                    self.hosts[otherHostname].cancel_job(job)
+        jobTime = self.hosts[hostname].get_job_time(job)
+        self.throughput.job_finished(hostname, job, jobTime)
+        self.job_queue.job_finished(job, jobTime)
+        # hosts holding back for faster ones need to look again now the estimates have changed
+        self.job_queue.wake_hosts()
+        self.job_event.set()
 
     def host_failed_job(self, hostname, job):
         error_string = "Failed Job on {hostname}: {job}".format(hostname=hostname, job=job)
-        # eflush(error_string)
         if self.verbose >= 3:
             print(error_string)
-        # self.add_job(job)
-        self.job_status[job] = 1
+        if job.state == JOB_DONE:
+            return
+        self.retry_job(hostname, job, "exit status {exitStatus}".format(exitStatus=self.hosts[hostname].get_jobs_status()[job].get("exit_status")))
+
+    def retry_job(self, hostname, job, reason):
+        """ records a failed attempt at 'job' and schedules it to run again on another host, with exponential backoff """
+        self.throughput.job_stopped(hostname, job)
+        for otherHostname in self.hosts:
+            if otherHostname != hostname and self.hosts[otherHostname].is_running(job):
+                # a speculative copy is still going, so let it finish before trying again
+                job.add_failed_host(hostname)
+                self.job_event.set()
+                return
+        if self.journal:
+            self.journal.record("failed", job.command, hostname, reason=reason)
+        job.attempts += 1
+        attempts = job.attempts
+        job.add_failed_host(hostname)
+        if attempts < self.max_attempts:
+            self.job_queue.store.set_state(job, JOB_QUEUED)
+            delay = self.retry_delay * 2 ** (attempts - 1)
+            with self.retry_lock:
+                heapq.heappush(self.pending_retries, (time.time() + delay, job.id, job, hostname))
+            if self.verbose >= 1:
+                eflush("Job failed on host {hostname} ({reason}); retrying in {delay:g}s (attempt {attempt} of {maxAttempts})\n".format(hostname=hostname, reason=reason, delay=delay, attempt=attempts + 1, maxAttempts=self.max_attempts))
+        else:
+            self.job_queue.store.set_state(job, JOB_FAILED)
+            self.failed_jobs[job] = reason
+            eflush("Job failed on host {hostname} ({reason}); giving up after {attempts} attempts\n".format(hostname=hostname, reason=reason, attempts=attempts))
+        self.job_event.set()
+
+    def get_failed_jobs(self):
+        return self.failed_jobs
+
+    def print_failed_jobs(self):
+        """ reports every job that ran out of attempts, with the frames it covered and the hosts it failed on """
+        if not self.failed_jobs:
+            return
+        eflush("Failed frames:\n")
+        for job in sorted(self.failed_jobs, key=lambda job: job.id):
+            eflush("    {frames}: {reason} after {attempts} attempts on {hosts}\n".format(frames=job.describe_frames(), reason=self.failed_jobs[job], attempts=job.attempts, hosts=", ".join(job.failed_hosts)))
 
     def host_can_take_job(self, hostname=None, host=None):
         if not host and not hostname: return False
@@ -131,12 +293,22 @@ class JobHostManager():
             host = self.hosts[hostname]
         else:
             return False
-        if host.can_take_job() and host.is_telnetable():
+        if host.can_take_job() and host.is_reachable():
             return True
         return False
 
+    def host_reachability_changed(self, hostname, reachable):
+        """ called from the host monitor thread when a host comes online or drops off """
+        if reachable and hostname in self.hosts:
+            self.hosts[hostname].wake()
+        elif not reachable:
+            # a slow host may have been leaving the last jobs for this one
+            self.job_queue.wake_hosts()
+        self.job_event.set()
+
     def get_cumulative_status(self):
-        return self.job_status
+        """ number of jobs in each state """
+        return self.job_queue.store.get_counts()
 
     def print_jobs_status(self):
         if self.jobs_complete():
@@ -146,13 +318,58 @@ class JobHostManager():
             print("Jobs not yet completed.")
 
     def stop_all_threads(self):
+        if self.shared:
+            self.stop_render()
+            return
         for hostname in self.hosts_with_jobs.keys():
             tHost = self.hosts[hostname]
             tHost.kill()
             self.stop()
+        if self.host_monitor:
+            self.host_monitor.stop()
+        if self.capacity_monitor:
+            self.capacity_monitor.stop()
+        if self.engine:
+            self.engine.stop()
+        if self.throughput.stop() and self.verbose >= 2:
+            pflush("Render time per frame by host:")
+            self.throughput.print_stats()
+        self.join_cancellers()
+        if self.ssh_pool:
+            self.ssh_pool.close_all()
+
+    def join_cancellers(self, timeout=CANCEL_TIMEOUT):
+        """ waits for the jobs cancelled on any host to be killed on the node (closing the ssh connections first could leave Blender running there) """
+        deadline = time.time() + timeout
+        for hostname, host in self.hosts.items():
+            if not host.join_cancellers(max(0, deadline - time.time())):
+                eflush("Timed out cancelling jobs on host {hostname}: Blender may still be running there\n".format(hostname=hostname))
+
+    def cancel_running_jobs(self):
+        """ cancels this render's jobs running on any host """
+        for host in self.hosts.values():
+            for job, jobInfo in host.get_running_jobs():
+                if job.queue is self.job_queue:
+                    host.cancel_job(job)
+
+    def stop_early(self):
+        """ ends the render with the results it has, without dispatching the jobs left """
+        if self.verbose >= 1:
+            pflush("Stop requested: cancelling {numRunning} running jobs and skipping {numLeft} more".format(numRunning=self.job_queue.store.count(JOB_RUNNING), numLeft=self.remaining_jobs() - self.job_queue.store.count(JOB_RUNNING)))
+        self.stopped_early = True
+        self.cancel_running_jobs()
+        self.stop()
+
+    def stop_render(self):
+        """ cancels this render's jobs still running on the shared hosts (e.g. its client went away), leaving the hosts running """
+        self.cancel_running_jobs()
+        if self.throughput.stop() and self.verbose >= 2:
+            pflush("Render time per frame by host:")
+            self.throughput.print_stats()
 
     def stop(self):
         self.stop_now = True
+        self.job_event.set()
 
     def __str__(self):
         acc = ''
@@ -0,0 +1,140 @@
+#!/usr/bin/env python
+# Copyright (C) 2018 Christopher Gearhart
+# chris@bblanimation.com
+# http://bblanimation.com/
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+# system imports
+import json
+import os
+import threading
+import time
+from supporting_methods import *
+from FrameSet import *
+
+class JobJournal():
+    """ Append-only log of job dispatches, completions and failures, so a killed 'blender_task' can pick up where it left off """
+
+    def __init__(self, path, key, sync_interval=1.0, resume=True, verbose=0):
+        self.path = path
+        # Identifies the render (project file checksum, settings); a journal with a different key is started over
+        self.key = key
+        # Records are flushed to the OS as they are written (surviving a killed process), but only fsynced this often
+        self.sync_interval = sync_interval
+        self.verbose = verbose
+        self.lock = threading.Lock()
+        self.last_sync = 0
+        # Last event recorded for each job in earlier runs, indexed by job string
+        self.previous = dict()
+        self.completed_frames = None
+        # Set by 'replay' if the last line of the journal is incomplete
+        self.cut_short = False
+        self.resumed = resume and self.replay()
+        if self.resumed:
+            self.journal = open(path, "a")
+            if self.cut_short:
+                # end the line that was cut short, so the next record isn't read as part of it
+                self.journal.write("\n")
+        else:
+            self.journal = open(path, "w")
+            self.write({"event":"start", "key":key})
+        self.sync()
+
+    def replay(self):
+        """ loads the events of earlier runs with the same key, returning False if there's nothing to resume """
+        if not os.path.exists(self.path):
+            return False
+        with open(self.path, "r") as journal:
+            for lineNum, line in enumerate(journal):
+                # killed mid-write, the last line may be missing its end (even if its json is complete)
+                self.cut_short = not line.endswith("\n")
+                try:
+                    record = json.loads(line)
+                except ValueError:
+                    # the last line may be cut short if we were killed mid-write
+                    continue
+                if lineNum == 0:
+                    if record.get("event") != "start" or record.get("key") != self.key:
+                        return False
+                    continue
+                if "job" in record:
+                    self.previous[record["job"]] = record
+        return True
+
+    def write(self, record):
+        self.journal.write(json.dumps(record) + "\n")
+        self.journal.flush()
+
+    def sync(self):
+        os.fsync(self.journal.fileno())
+        self.last_sync = time.time()
+
+    def record(self, event, job, hostname=None, **info):
+        record = {"event":event, "job":job, "time":round(time.time(), 3)}
+        if hostname:
+            record["host"] = hostname
+        record.update(info)
+        with self.lock:
+            if self.journal.closed:
+                return
+            self.write(record)
+            # batch fsyncs, since one per record would cost more than some renders on a large animation
+            if time.time() - self.last_sync >= self.sync_interval:
+                self.sync()
+
+    def get_completed_frames(self, localResultsPath, foldedFiles=()):
+        """ returns the set of (outputName, frame) finished in earlier runs whose output file is still in 'localResultsPath' (or among 'foldedFiles', the seeds already averaged) """
+        if self.completed_frames is None:
+            self.completed_frames = self.find_completed_frames(localResultsPath, foldedFiles)
+        return self.completed_frames
+
+    def find_completed_frames(self, localResultsPath, foldedFiles=()):
+        completed = set()
+        # a seed that's been folded into its frame's average is gone, but it doesn't need rendering again
+        outputFiles = listOutputFiles(localResultsPath) | set(fileName[:-4] for fileName in foldedFiles)
+        for job, record in self.previous.items():
+            if record["event"] != "done":
+                continue
+            parsed = parseJobString(job)
+            if not parsed:
+                continue
+            outputName, startFrame, endFrame = parsed
+            missing = missingOutputFiles(job, localResultsPath, outputFiles)
+            for frame in range(startFrame, endFrame + 1):
+                if frame not in missing:
+                    completed.add((outputName, frame))
+        return completed
+
+    def remove_completed_jobs(self, jobStrings, localResultsPath, foldedFiles=()):
+        """ returns the job strings that still have frames to render """
+        completed = self.get_completed_frames(localResultsPath, foldedFiles)
+        remainingJobs = list()
+        for job in jobStrings:
+            parsed = parseJobString(job)
+            if not parsed or not all((parsed[0], frame) in completed for frame in range(parsed[1], parsed[2] + 1)):
+                remainingJobs.append(job)
+        return remainingJobs
+
+    def remove_completed_frames(self, frames, outputName, localResultsPath):
+        """ returns a FrameSet of the frames of 'outputName' that still need rendering """
+        completed = self.get_completed_frames(localResultsPath)
+        return FrameSet(frames).difference([frame for completedName, frame in completed if completedName == outputName])
+
+    def close(self):
+        with self.lock:
+            if self.journal.closed:
+                return
+            self.sync()
+            self.journal.close()
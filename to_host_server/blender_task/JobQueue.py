@@ -0,0 +1,350 @@
+#!/usr/bin/env python
+# Copyright (C) 2018 Christopher Gearhart
+# chris@bblanimation.com
+# http://bblanimation.com/
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+# system imports
+import math
+import threading
+import time
+from collections import deque
+from supporting_methods import *
+from FrameSet import *
+from Job import *
+
+class JobQueue():
+    """ Thread-safe queue of jobs shared by every JobHost; hosts pull from it when they have a free slot """
+
+    def __init__(self, jobs=None, speculate=True):
+        self.lock = threading.Lock()
+        # Creates a Job for each queued job string and keeps count of jobs in each state
+        self.store = JobStore(self)
+        # Jobs are handed out in the order they were queued
+        self.jobs = deque(self.store.add(job) for job in jobs or [])
+        # Hosts pulling from this queue (woken when jobs are added, robbed when they hoard a backlog)
+        self.hosts = list()
+        # Failed jobs waiting to run again
+        self.retries = deque()
+        # Measured seconds per frame on each host, used to keep the last jobs off slow hosts (see 'set_throughput')
+        self.throughput = None
+        # Once the queue is empty, idle hosts run copies of jobs projected to finish last (the first copy to finish wins)
+        self.speculate = speculate
+        self.speculative_jobs = set()
+        self.stragglers = list()
+        self.stragglers_updated = 0
+        # JobHostManager handling this queue's jobs, when its hosts are shared with other renders (see 'set_owner')
+        self.owner = None
+
+    def __len__(self):
+        return len(self.jobs) + len(self.retries)
+
+    def set_owner(self, owner):
+        """ marks this queue's jobs as belonging to 'owner', so hosts shared by several renders report back to the right one """
+        self.owner = owner
+
+    def add_host(self, host):
+        if host not in self.hosts:
+            self.hosts.append(host)
+
+    def set_throughput(self, throughput):
+        self.throughput = throughput
+
+    def has_jobs(self, host=None):
+        """ True if there is a job 'host' may run (any queued job if 'host' is None) """
+        if host is not None and self.defers_to_faster_hosts(host):
+            return False
+        if self.jobs:
+            return True
+        for job in list(self.retries):
+            if self.can_run(job, host):
+                return True
+        return host is not None and self.get_speculative_job(host) is not None
+
+    def can_run(self, job, host):
+        """ a retried job avoids the hosts it failed on, unless every reachable host has failed it, and never goes to a host that still has a copy of it """
+        if host is not None and host.has_job(job):
+            return False
+        if host is None or not job.failed_on(host.get_hostname()):
+            return True
+        for otherHost in self.hosts:
+            if not job.failed_on(otherHost.get_hostname()) and otherHost.is_reachable():
+                return False
+        return True
+
+    def put(self, jobString):
+        with self.lock:
+            self.jobs.append(self.store.add(jobString))
+        self.wake_hosts()
+
+    def put_all(self, jobStrings):
+        with self.lock:
+            self.jobs.extend(self.store.add(jobString) for jobString in jobStrings)
+        self.wake_hosts()
+
+    def defers_to_faster_hosts(self, host):
+        """ True if the jobs left are better left for hosts that could finish their current frame and the next one before 'host' finished one """
+        if self.throughput is None:
+            return False
+        numQueued = len(self)
+        # cheap checks first, since this runs every time a host looks for work
+        if numQueued == 0 or numQueued > sum(otherHost.max_on_host for otherHost in self.hosts):
+            return False
+        frameTime = self.throughput.get_frame_time(host.get_hostname())
+        if frameTime is None:
+            return False
+        fasterSlots = 0
+        for otherHost in self.hosts:
+            if otherHost is host or not otherHost.is_reachable():
+                continue
+            otherFrameTime = self.throughput.get_frame_time(otherHost.get_hostname())
+            if otherFrameTime is not None and otherFrameTime * 2 < frameTime:
+                fasterSlots += otherHost.max_on_host
+        return numQueued <= fasterSlots
+
+    def retry(self, job):
+        """ queues a failed job to run again ahead of new jobs, on a host it hasn't failed on if possible """
+        with self.lock:
+            self.retries.append(job)
+        self.wake_hosts()
+
+    def get_retry(self, host):
+        # NOTE: must be called with 'self.lock' held
+        for job in self.retries:
+            if self.can_run(job, host):
+                self.retries.remove(job)
+                return job
+        return None
+
+    def get(self, host=None):
+        """ returns the next job 'host' may run, or None if there isn't one """
+        if host is not None and self.defers_to_faster_hosts(host):
+            return None
+        with self.lock:
+            job = self.get_retry(host)
+            if job:
+                return job
+            if self.jobs:
+                return self.jobs.popleft()
+        return self.take_speculative_job(host)
+
+    def estimate_remaining(self, host, job, jobInfo):
+        """ projected seconds until 'job' finishes on 'host', from Blender's 'Remaining:' estimate or the host's frame time """
+        frameTime = self.throughput.get_frame_time(host.get_hostname())
+        if frameTime is None:
+            return None
+        progress = self.throughput.get_progress(host.get_hostname(), job)
+        if job.endFrame is not None and progress:
+            remaining = max(0, progress["remaining"] - (time.time() - progress["updated"]))
+            return remaining + (job.endFrame - progress["frame"]) * frameTime
+        return max(0, job.num_frames() * frameTime - (time.time() - jobInfo['start_time']))
+
+    def get_stragglers(self):
+        """ returns (remaining seconds, job, host, number of frames) for every running job, refreshed at most twice a second """
+        if time.time() - self.stragglers_updated > .5:
+            stragglers = list()
+            for host in self.hosts:
+                for job, jobInfo in host.get_running_jobs():
+                    # hosts shared with other renders run their jobs too
+                    if job.queue is not self:
+                        continue
+                    remaining = self.estimate_remaining(host, job, jobInfo)
+                    if remaining is None:
+                        continue
+                    stragglers.append((remaining, job, host, job.num_frames()))
+            self.stragglers = stragglers
+            self.stragglers_updated = time.time()
+        return self.stragglers
+
+    def get_speculative_job(self, host):
+        """ once the queue has drained, returns the running job a copy on 'host' would finish furthest ahead of the original """
+        if not self.speculate or self.throughput is None or self.jobs or self.retries:
+            return None
+        frameTime = self.throughput.get_frame_time(host.get_hostname()) or self.throughput.get_average_frame_time()
+        if frameTime is None:
+            return None
+        bestJob = None
+        bestSaving = 0
+        for remaining, job, otherHost, numFrames in self.get_stragglers():
+            # the cached list can be up to half a second old, so make sure the original is still going
+            if otherHost is host or job in self.speculative_jobs or host.has_job(job) or not otherHost.is_running(job):
+                continue
+            saving = remaining - frameTime * numFrames
+            if saving > bestSaving:
+                bestJob = job
+                bestSaving = saving
+        return bestJob
+
+    def take_speculative_job(self, host):
+        if host is None:
+            return None
+        job = self.get_speculative_job(host)
+        if job is None:
+            return None
+        with self.lock:
+            # only one copy per job, so a handful of stragglers can't tie up the whole farm
+            if job in self.speculative_jobs:
+                return None
+            self.speculative_jobs.add(job)
+        return job
+
+    def is_speculative(self, job):
+        return job in self.speculative_jobs
+
+    def num_unbuilt(self):
+        """ number of jobs (or frames, for a FrameChunkQueue) not yet made into a Job """
+        return 0
+
+    def job_finished(self, job, elapsed):
+        """ called when 'job' completes successfully after 'elapsed' seconds """
+        pass
+
+    def can_steal(self, thief):
+        for host in self.hosts:
+            if host is not thief and host.has_backlog():
+                return True
+        return False
+
+    def steal(self, thief):
+        """ takes a job from the local backlog of whichever other host has the most waiting """
+        victims = sorted((host for host in self.hosts if host is not thief), key=lambda host: host.backlog_size(), reverse=True)
+        for host in victims:
+            job = host.give_up_job()
+            if job:
+                return job
+        return None
+
+    def wake_hosts(self):
+        # NOTE: never called with 'self.lock' held, since hosts take their own lock first
+        for host in self.hosts:
+            host.wake()
+
+
+class FrameChunkQueue(JobQueue):
+    """ Queues frames instead of job strings, handing each host a contiguous chunk of frames sized from its measured frame time """
+
+    def __init__(self, frames, build_job, chunk_time=60, max_chunk_size=50, speculate=True):
+        JobQueue.__init__(self, None, speculate)
+        # Frames not handed out yet, kept as ranges so a long animation doesn't need a job string per frame up front
+        self.jobs = FrameSet(frames)
+        # Called with (startFrame, endFrame) to build the job string for a chunk
+        self.build_job = build_job
+        # Target seconds of rendering per chunk (one frame per job if None)
+        self.chunk_time = chunk_time
+        self.max_chunk_size = max_chunk_size
+
+    def num_unbuilt(self):
+        return len(self.jobs)
+
+    def get_frame_time(self, host):
+        """ seconds per frame on 'host', falling back to the farm average for hosts that haven't finished a chunk yet """
+        if self.throughput is None:
+            return None
+        if host is not None:
+            frameTime = self.throughput.get_frame_time(host.get_hostname())
+            if frameTime is not None:
+                return frameTime
+        return self.throughput.get_average_frame_time()
+
+    def next_chunk_size(self, host=None):
+        # render single frames until there is a measurement to size chunks from
+        frameTime = self.get_frame_time(host)
+        if frameTime is None or not self.chunk_time:
+            return 1
+        chunkSize = max(1, min(self.max_chunk_size, int(self.chunk_time / max(frameTime, .001))))
+        # near the end of the run, split what's left in proportion to each host's speed so they all finish together
+        totalRate = 0.
+        for otherHost in self.hosts:
+            if otherHost.is_reachable():
+                totalRate += otherHost.max_on_host / max(self.get_frame_time(otherHost), .001)
+        if host is None or totalRate == 0:
+            return chunkSize
+        share = len(self.jobs) * (1. / max(frameTime, .001)) / totalRate
+        return max(1, min(chunkSize, int(math.ceil(share))))
+
+    def get(self, host=None):
+        if host is not None and self.defers_to_faster_hosts(host):
+            return None
+        with self.lock:
+            # failed chunks are retried as they were issued
+            job = self.get_retry(host)
+            if job:
+                return job
+            if self.jobs:
+                # only consecutive frames can share a '-s/-e' range
+                startFrame, endFrame = self.jobs.pop_range(self.next_chunk_size(host))
+                return self.store.add(self.build_job(startFrame, endFrame))
+        return self.take_speculative_job(host)
+
+
+class FairShareQueue(JobQueue):
+    """ Queue of queues for hosts shared by several renders; each free slot goes to the render with the fewest jobs running """
+
+    def __init__(self):
+        JobQueue.__init__(self, None, speculate=False)
+        # Queue of each render being served, in the order they were added
+        self.queues = list()
+        # Number of jobs handed out from each queue, to take turns between renders with as many jobs running
+        self.served = dict()
+
+    def __len__(self):
+        return sum(len(job_queue) for job_queue in list(self.queues))
+
+    def add_queue(self, job_queue):
+        with self.lock:
+            self.queues.append(job_queue)
+            self.served[job_queue] = 0
+        self.wake_hosts()
+
+    def remove_queue(self, job_queue):
+        with self.lock:
+            if job_queue in self.queues:
+                self.queues.remove(job_queue)
+                del self.served[job_queue]
+        # hosts holding back for another render's faster hosts can take work again
+        self.wake_hosts()
+
+    def num_queues(self):
+        return len(self.queues)
+
+    def by_share(self):
+        """ queues ordered by how few of their jobs are running, then by how few jobs they have been handed """
+        with self.lock:
+            return sorted(self.queues, key=lambda job_queue: (job_queue.store.count(JOB_RUNNING), self.served[job_queue]))
+
+    def has_jobs(self, host=None):
+        for job_queue in self.by_share():
+            if job_queue.has_jobs(host):
+                return True
+        return False
+
+    def get(self, host=None):
+        for job_queue in self.by_share():
+            job = job_queue.get(host)
+            if job:
+                with self.lock:
+                    if job_queue in self.served:
+                        self.served[job_queue] += 1
+                return job
+        return None
+
+    def retry(self, job):
+        job.queue.retry(job)
+
+    def is_speculative(self, job):
+        return job.queue is not None and job.queue.is_speculative(job)
+
+    def num_unbuilt(self):
+        return sum(job_queue.num_unbuilt() for job_queue in list(self.queues))
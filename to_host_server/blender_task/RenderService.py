@@ -0,0 +1,299 @@
+#!/usr/bin/env python
+# Copyright (C) 2018 Christopher Gearhart
+# chris@bblanimation.com
+# http://bblanimation.com/
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+# system imports
+import errno
+import json
+import os
+import socket
+import sys
+import threading
+import traceback
+from supporting_methods import *
+from Job import *
+
+# Requests and replies are one json object per line:
+#   {"command":"render", "args":[...], "frames":"..."} -> {"out":"..."}, {"err":"..."}, ..., {"exit":0}
+#   {"command":"status"}                                -> {"renders":[...]}
+#   {"command":"cancel", "project":"..."}               -> {"cancelled":<number of renders cancelled>}
+
+class ThreadOutput():
+    """ Stands in for sys.stdout/sys.stderr, sending what each render's thread prints to its client instead of the service log """
+
+    # the python 2 print statement keeps its state on the stream
+    softspace = 0
+
+    def __init__(self, stream, key):
+        self.stream = stream
+        # Which half of the client's output this is ("out" or "err")
+        self.key = key
+        self.routes = dict()
+
+    def route(self, session):
+        self.routes[threading.current_thread()] = session
+
+    def unroute(self):
+        self.routes.pop(threading.current_thread(), None)
+
+    def write(self, string):
+        session = self.routes.get(threading.current_thread())
+        if session is None:
+            self.stream.write(string)
+        else:
+            session.send(self.key, string)
+
+    def flush(self):
+        if threading.current_thread() not in self.routes:
+            self.stream.flush()
+
+    def fileno(self):
+        return self.stream.fileno()
+
+
+class RenderSession():
+    """ One render submitted to the service, from the connection of the blender_task call that submitted it """
+
+    def __init__(self, service, connection):
+        self.service = service
+        self.connection = connection
+        self.lock = threading.Lock()
+        self.closed = False
+        self.done = False
+        # Set by the render once it has its JobHostManager, so the session can report on it and cancel it
+        self.manager = None
+        self.projectName = None
+
+    def send(self, key, value):
+        if not isinstance(value, (int, float, list, dict)) and not isinstance(value, type(u"")):
+            value = value.decode("utf-8", "replace")
+        line = (json.dumps({key:value}) + "\n").encode("utf-8")
+        with self.lock:
+            if self.closed:
+                return
+            try:
+                self.connection.sendall(line)
+            except socket.error:
+                self.closed = True
+
+    def set_manager(self, manager, projectName):
+        self.manager = manager
+        self.projectName = projectName
+        if self.closed:
+            manager.stop()
+
+    def watch(self):
+        """ blocks until the client hangs up, then cancels the render if it hasn't finished (the client sends nothing more) """
+        try:
+            while self.connection.recv(4096):
+                pass
+        except socket.error:
+            pass
+        with self.lock:
+            self.closed = True
+        if not self.done and self.manager:
+            self.manager.stop()
+
+    def get_status(self):
+        status = {"project":self.projectName}
+        if self.manager:
+            status["running"] = self.manager.job_queue.store.count(JOB_RUNNING)
+            status["remaining"] = self.manager.remaining_jobs()
+        return status
+
+
+class RenderService():
+    """ Resident blender_task that keeps hosts, their ssh connections and the job engine up between renders, taking renders from a Unix socket """
+
+    def __init__(self, socketPath, render_func, job_queue, verbose=0):
+        self.socketPath = socketPath
+        # Called as render_func(args, frames, session) from the thread serving each submission
+        self.render_func = render_func
+        # FairShareQueue every host of the service pulls from
+        self.job_queue = job_queue
+        self.verbose = verbose
+        self.sessions = list()
+        self.lock = threading.Lock()
+        self.server = None
+        self.stopped = False
+        self.stdout = ThreadOutput(sys.stdout, "out")
+        self.stderr = ThreadOutput(sys.stderr, "err")
+
+    def serve_forever(self):
+        if os.path.exists(self.socketPath):
+            if service_is_running(self.socketPath):
+                raise RuntimeError("a render service is already listening on '{socketPath}'".format(socketPath=self.socketPath))
+            # left behind by a service that didn't shut down cleanly
+            os.remove(self.socketPath)
+        self.server = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        # renders run with this account's ssh keys, so only this account may submit them
+        oldMask = os.umask(0o077)
+        try:
+            self.server.bind(self.socketPath)
+        finally:
+            os.umask(oldMask)
+        self.server.listen(16)
+        sys.stdout = self.stdout
+        sys.stderr = self.stderr
+        pflush("Render service listening on {socketPath}".format(socketPath=self.socketPath))
+        while not self.stopped:
+            try:
+                connection, address = self.server.accept()
+            except socket.error as e:
+                if e.args[0] == errno.EINTR:
+                    continue
+                if self.stopped:
+                    break
+                raise
+            handler = threading.Thread(target=self.handle_connection, args=(connection,), name="Thread-RenderSession")
+            handler.daemon = True
+            handler.start()
+
+    def stop(self):
+        """ stops taking renders and removes the socket (renders in progress are cancelled along with the hosts) """
+        self.stopped = True
+        sys.stdout = self.stdout.stream
+        sys.stderr = self.stderr.stream
+        if self.server is not None:
+            self.server.close()
+            self.server = None
+            if os.path.exists(self.socketPath):
+                os.remove(self.socketPath)
+
+    def handle_connection(self, connection):
+        try:
+            request = json.loads(connection.makefile("rb").readline().decode("utf-8") or "{}")
+        except ValueError:
+            request = dict()
+        session = RenderSession(self, connection)
+        try:
+            if request.get("command") == "render":
+                self.render(session, request)
+            elif request.get("command") == "status":
+                with self.lock:
+                    sessions = list(self.sessions)
+                session.send("renders", [otherSession.get_status() for otherSession in sessions])
+            elif request.get("command") == "cancel":
+                session.send("cancelled", self.cancel(request.get("project")))
+            else:
+                session.send("err", "unknown request: {request}\n".format(request=request))
+                session.send("exit", 2)
+        finally:
+            connection.close()
+
+    def cancel(self, projectName):
+        """ cancels the renders of 'projectName' (and only those), returning how many there were """
+        with self.lock:
+            sessions = [session for session in self.sessions if session.manager and session.projectName == projectName]
+        for session in sessions:
+            session.manager.stop()
+        if sessions and self.verbose >= 1:
+            pflush("Cancelling the render of project '{projectName}'".format(projectName=projectName))
+        return len(sessions)
+
+    def render(self, session, request):
+        with self.lock:
+            self.sessions.append(session)
+        watcher = threading.Thread(target=session.watch, name="Thread-RenderSession-watch")
+        watcher.daemon = True
+        watcher.start()
+        self.stdout.route(session)
+        self.stderr.route(session)
+        exitCode = 0
+        try:
+            self.render_func([str(arg) for arg in request.get("args", [])], request.get("frames") or "[]", session)
+        except SystemExit as e:
+            exitCode = e.code if isinstance(e.code, int) else (0 if e.code is None else 1)
+        except Exception:
+            eflush(traceback.format_exc())
+            exitCode = 1
+        finally:
+            session.done = True
+            self.stdout.unroute()
+            self.stderr.unroute()
+            with self.lock:
+                self.sessions.remove(session)
+        if self.verbose >= 1:
+            pflush("Render of project '{projectName}' finished with exit code {exitCode}".format(projectName=session.projectName, exitCode=exitCode))
+        session.send("exit", exitCode)
+
+
+def connect_to_service(socketPath):
+    """ returns a socket connected to the render service at 'socketPath', or None if there isn't one running """
+    if not os.path.exists(socketPath):
+        return None
+    connection = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        connection.connect(socketPath)
+    except socket.error:
+        connection.close()
+        return None
+    return connection
+
+def service_is_running(socketPath):
+    connection = connect_to_service(socketPath)
+    if connection is None:
+        return False
+    connection.close()
+    return True
+
+def submit_to_service(socketPath, args, frames):
+    """ hands a render to the service at 'socketPath' and relays its output, returning its exit code (None if no service is running) """
+    connection = connect_to_service(socketPath)
+    if connection is None:
+        return None
+    try:
+        connection.sendall((json.dumps({"command":"render", "args":args, "frames":frames}) + "\n").encode("utf-8"))
+        for line in connection.makefile("rb"):
+            reply = json.loads(line.decode("utf-8"))
+            if "exit" in reply:
+                return reply["exit"]
+            for key, stream in (("out", sys.stdout), ("err", sys.stderr)):
+                if key in reply:
+                    text = reply[key]
+                    if not isinstance(text, str):
+                        text = text.encode("utf-8")
+                    stream.write(text)
+                    stream.flush()
+    finally:
+        connection.close()
+    eflush("Lost connection to the render service\n")
+    return 1
+
+def cancel_service_render(socketPath, projectName):
+    """ has the service at 'socketPath' cancel the renders of 'projectName', returning how many it cancelled (None if no service is running) """
+    connection = connect_to_service(socketPath)
+    if connection is None:
+        return None
+    try:
+        connection.sendall((json.dumps({"command":"cancel", "project":projectName}) + "\n").encode("utf-8"))
+        line = connection.makefile("rb").readline()
+    finally:
+        connection.close()
+    return json.loads(line.decode("utf-8")).get("cancelled", 0) if line else 0
+
+def service_status(socketPath):
+    """ returns a list describing each render the service at 'socketPath' is running, or None if there isn't one running """
+    connection = connect_to_service(socketPath)
+    if connection is None:
+        return None
+    try:
+        connection.sendall((json.dumps({"command":"status"}) + "\n").encode("utf-8"))
+        line = connection.makefile("rb").readline()
+    finally:
+        connection.close()
+    return json.loads(line.decode("utf-8")).get("renders") if line else None
@@ -0,0 +1,184 @@
+#!/usr/bin/env python
+# Copyright (C) 2018 Christopher Gearhart
+# chris@bblanimation.com
+# http://bblanimation.com/
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+# system imports
+import json
+import re
+import shlex
+import subprocess
+import threading
+from supporting_methods import *
+
+WORKER_MARKER = "##RFC_WORKER##"
+
+class RenderWorker():
+    """ A long-lived Blender process on a render node (running 'blender_worker.py') that renders frames on request """
+
+    def __init__(self, hostname, username, projectName, projectPath, sshOptions="", progress=False, verbose=0, statusQueue=None):
+        self.hostname = hostname
+        self.username = username
+        self.projectName = projectName
+        self.projectPath = projectPath
+        self.sshOptions = sshOptions
+        self.progress = progress
+        self.verbose = verbose
+        self.process = None
+        self.numRendered = 0
+        # Status lines are reported to the scheduler against the job being rendered
+        self.statusQueue = statusQueue
+        self.jobId = None
+        self.lastReport = 0
+
+    def is_alive(self):
+        return self.process is not None and self.process.poll() is None
+
+    def start(self):
+        """ starts Blender on the node and blocks until the project file is loaded """
+        blenderCommand = "blender -b {projectPath}/{projectName}.blend -P {projectPath}/blender_p.py -P {projectPath}/blender_worker.py".format(projectPath=self.projectPath, projectName=self.projectName)
+        sshCommand = "{ssh_c_string} '{blenderCommand}'".format(ssh_c_string=ssh_string(self.username, self.hostname, self.verbose, self.sshOptions), blenderCommand=blenderCommand)
+        self.process = subprocess.Popen(shlex.split(sshCommand), stdin=subprocess.PIPE, stdout=subprocess.PIPE)
+        response = self.read_response()
+        return response is not None and response.get("ready", False)
+
+    def read_response(self):
+        """ reads Blender's output up to the next worker response (returns None if the worker died) """
+        while True:
+            line = self.process.stdout.readline()
+            if not line:
+                return None
+            if not isinstance(line, str):
+                line = line.decode("utf-8", "replace")
+            if WORKER_MARKER in line:
+                return json.loads(line.split(WORKER_MARKER)[1])
+            if self.progress:
+                process_blender_output(self.hostname, line)
+            self.lastReport = report_blender_status(self.statusQueue, self.hostname, self.jobId, line, self.lastReport)
+
+    def render(self, frame, output, seed=None):
+        """ renders 'frame' to 'output' (Blender path with '#' frame placeholders) and returns 0 on success """
+        if not self.is_alive():
+            return 1
+        request = json.dumps({"frame":frame, "output":output, "seed":seed}) + "\n"
+        try:
+            self.process.stdin.write(request.encode("utf-8"))
+            self.process.stdin.flush()
+        except (IOError, OSError):
+            return 1
+        response = self.read_response()
+        if response is None:
+            return 1
+        if response.get("status") != 0:
+            eflush("render worker error on {hostname}: {error}\n".format(hostname=self.hostname, error=response.get("error")))
+            return 1
+        self.numRendered += 1
+        return 0
+
+    def render_job(self, jobString, jobId=None):
+        """ renders every frame of a Blender job string ('-o <output> -s <start> -e <end>') """
+        match = re.search(r"-o (\S+) -s (\d+) -e (\d+)", jobString)
+        if not match:
+            eflush("render worker could not parse job: {jobString}\n".format(jobString=jobString))
+            return 1
+        output = match.group(1)
+        self.jobId = jobId
+        for frame in range(int(match.group(2)), int(match.group(3)) + 1):
+            if self.render(frame, output) != 0:
+                return 1
+        return 0
+
+    def stop(self):
+        if not self.is_alive():
+            return
+        try:
+            self.process.stdin.write((json.dumps({"quit":True}) + "\n").encode("utf-8"))
+            self.process.stdin.close()
+        except (IOError, OSError):
+            pass
+        self.process.wait()
+
+    def terminate(self):
+        if self.is_alive():
+            self.process.terminate()
+
+
+class WorkerJob(threading.Thread):
+    """ Runs one job on a host's resident render workers; stands in for the 'Process' running 'start_tasks' """
+
+    def __init__(self, host, job, kwargs):
+        super(WorkerJob, self).__init__()
+        self.daemon = True
+        self.host = host
+        self.job = job
+        self.kwargs = kwargs
+        self.exitcode = None
+        self.pid = None
+        self.worker = None
+
+    def run(self):
+        try:
+            self.exitcode = start_worker_tasks(self.host, self, **self.kwargs)
+        except Exception as e:
+            eflush("render worker job failed on {hostname}: {error}\n".format(hostname=self.host.get_hostname(), error=str(e)))
+            self.exitcode = 1
+
+    def terminate(self):
+        if self.worker:
+            self.worker.terminate()
+
+
+def start_worker_tasks(host, workerJob, projectName, projectPath, projectSyncPath, hostname, username, jobString, remoteResultsPath, localResultsPath, JobHostObject=None, firstTime=True, frame=False, progress=False, verbose=0, sshOptions="", statusQueue=None, jobId=None):
+    """ Render a job on a resident worker on the remote server and get output files when finished """
+
+    # get output file name
+    startS = "-o //results/"
+    endS = "_####."
+    outputName = jobString[jobString.find(startS) + len(startS):jobString.find(endS)]
+    if frame:
+        frameString = "_{frame}".format(frame=str(frame).zfill(4))
+    else:
+        frameString = "_????"
+
+    rsync_to            = rsync_files_to_node_string(remoteResultsPath, projectSyncPath, username, hostname, projectPath, verbose, sshOptions)
+    rsync_from          = rsync_files_from_node_string(username, hostname, remoteResultsPath, localResultsPath, outputName, frameString, verbose, sshOptions)
+    run_status          = {"p":-1, "q":-1, "r":-1}
+
+    # only sync project files if they haven't already been synced (the worker loads them once when it starts)
+    if firstTime:
+        p = subprocess.call(rsync_to, shell=True)
+        run_status["p"] = 0 if p == 0 else 1
+    else:
+        run_status["p"] = 0
+
+    # Now render the frames on an idle worker, starting one if necessary
+    worker = host.acquire_worker()
+    workerJob.worker = worker
+    q = worker.render_job(jobString, jobId) if worker else 1
+    host.release_worker(worker)
+    run_status["q"] = q
+    if q != 0:
+        eflush("blender worker error on {hostname}".format(hostname=hostname))
+
+    # Now rsync the files in <remoteResultsPath> back to this host.
+    r = subprocess.call(rsync_from, shell=True)
+    if r == 0 and q == 0:
+        run_status["r"] = 0
+    else:
+        eflush("rsync error: {r}".format(r=r))
+        run_status["r"] = 1
+
+    return run_status["p"] + run_status["q"] + run_status["r"]
@@ -0,0 +1,126 @@
+#!/usr/bin/env python
+# Copyright (C) 2018 Christopher Gearhart
+# chris@bblanimation.com
+# http://bblanimation.com/
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+# system imports
+import os
+import shutil
+import subprocess
+import threading
+import time
+from supporting_methods import *
+
+class SSHConnectionPool():
+    """ Keeps one OpenSSH ControlMaster connection open per host so every ssh/rsync call can reuse it """
+
+    def __init__(self, controlDir, username, persist=600, verbose=0):
+        self.controlDir = controlDir
+        self.username = username
+        # Seconds an idle master stays up if it is never closed explicitly (e.g. blender_task was killed)
+        self.persist = persist
+        self.verbose = verbose
+        self.lock = threading.Lock()
+        # Stores connection info and reuse counts, indexed by hostname
+        self.connections = dict()
+        self.open_locks = dict()
+        self.closed = False
+        if not os.path.exists(controlDir):
+            os.makedirs(controlDir)
+
+    def control_path(self):
+        # ssh expands the tokens itself; keep this short since unix socket paths are limited to ~100 characters
+        return os.path.join(self.controlDir, "%r@%h:%p")
+
+    def ssh_options(self, hostname):
+        """ options to pass to ssh (or rsync -e) so it reuses the master connection to 'hostname' """
+        with self.lock:
+            self.get_connection(hostname)
+        # 'auto' falls back to starting a master if the one from 'open' has gone away
+        return "-oControlMaster=auto -oControlPath={controlPath} -oControlPersist={persist}".format(controlPath=self.control_path(), persist=self.persist)
+
+    def get_connection(self, hostname):
+        if hostname not in self.connections:
+            self.connections[hostname] = {"opened":False, "openedAt":None, "uses":0}
+        return self.connections[hostname]
+
+    def open(self, hostname):
+        """ starts a background master connection to 'hostname' (blocks until authentication is done) """
+        with self.lock:
+            openLock = self.open_locks.setdefault(hostname, threading.Lock())
+        # several threads may want the connection first (e.g. the capacity probe and the host thread)
+        with openLock:
+            with self.lock:
+                if self.get_connection(hostname)["opened"]:
+                    return True
+            return self.open_master(hostname)
+
+    def open_master(self, hostname):
+        openCommand = "ssh -oStrictHostKeyChecking=no -oBatchMode=yes -oControlMaster=yes -oControlPersist={persist} -oControlPath='{controlPath}' -fN {username}@{hostname}".format(persist=self.persist, controlPath=self.control_path(), username=self.username, hostname=hostname)
+        if self.verbose >= 3:
+            pflush(openCommand)
+        # NOTE: the master outlives this call, so it must not hold on to our stdout (the client's ssh session would hang)
+        devnull = open(os.devnull, "r+")
+        rc = subprocess.call(openCommand, shell=True, stdin=devnull, stdout=devnull, stderr=devnull)
+        devnull.close()
+        with self.lock:
+            connection = self.get_connection(hostname)
+            connection["opened"] = rc == 0
+            connection["openedAt"] = time.time()
+        if rc != 0 and self.verbose >= 1:
+            eflush("Could not open ssh master connection to {hostname} (return code: {rc}). Falling back to a connection per command.\n".format(hostname=hostname, rc=rc))
+        return rc == 0
+
+    def is_open(self, hostname):
+        with self.lock:
+            return self.get_connection(hostname)["opened"]
+
+    def record_use(self, hostname, numCommands=1):
+        with self.lock:
+            self.get_connection(hostname)["uses"] += numCommands
+
+    def get_stats(self):
+        with self.lock:
+            return dict((hostname, dict(connection)) for hostname, connection in self.connections.items())
+
+    def print_stats(self):
+        stats = self.get_stats()
+        totalUses = sum(connection["uses"] for connection in stats.values())
+        numOpened = len([connection for connection in stats.values() if connection["opened"]])
+        pflush("SSH connection reuse: {totalUses} commands over {numOpened} master connections".format(totalUses=totalUses, numOpened=numOpened))
+        if self.verbose >= 2:
+            for hostname in sorted(stats.keys()):
+                pflush("    {hostname}: {uses} commands{opened}".format(hostname=hostname, uses=stats[hostname]["uses"], opened="" if stats[hostname]["opened"] else " (no master connection)"))
+
+    def close(self, hostname):
+        closeCommand = "ssh -oControlPath='{controlPath}' -O exit {username}@{hostname}".format(controlPath=self.control_path(), username=self.username, hostname=hostname)
+        if self.verbose >= 3:
+            pflush(closeCommand)
+        devnull = open(os.devnull, "w")
+        subprocess.call(closeCommand, shell=True, stdout=devnull, stderr=devnull)
+        devnull.close()
+        with self.lock:
+            self.get_connection(hostname)["opened"] = False
+
+    def close_all(self):
+        if self.closed:
+            return
+        self.closed = True
+        if self.verbose >= 1:
+            self.print_stats()
+        for hostname in list(self.connections.keys()):
+            self.close(hostname)
+        shutil.rmtree(self.controlDir, ignore_errors=True)
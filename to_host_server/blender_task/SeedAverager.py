@@ -0,0 +1,287 @@
+#!/usr/bin/env python
+# Copyright (C) 2018 Christopher Gearhart
+# chris@bblanimation.com
+# http://bblanimation.com/
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+# system imports
+import fnmatch
+import json
+import os
+import threading
+import numpy
+from supporting_methods import *
+from TargaImage import *
+
+# Extension of the weighted sums of several seeds 'blender_p.py' writes on the render node (see 'buildJobString')
+PARTIAL_SUMS_EXTENSION = ".sum"
+# Type of the sums: each value is weighted by its seed's sample count, so a float32 sum of squares (255**2 * samples
+# per seed) runs past its 2**24 exact integers within a few seeds, and float64 keeps them exact for any real render
+SUM_DTYPE = numpy.float64
+
+def read_partial_sums_header(path):
+    """ returns the image the partial sums at 'path' are of (without pixels), the offset the sums start at, and the seed and sample counts in them """
+    with open(path, "rb") as f:
+        # a line of json, then the float64 sums and sums of squares of the seeds' stored TGA values, bottom row first
+        header = f.readline()
+    try:
+        info = json.loads(header.decode("utf-8"))
+    except ValueError:
+        raise ValueError("'{path}' doesn't start with the header of partial sums".format(path=path))
+    image = TargaImage(info["width"], info["height"], info["imageType"], info["pixelDepth"], info["alphaBits"], None)
+    if os.path.getsize(path) < len(header) + 2 * SUM_DTYPE().itemsize * image.height * image.get_row_size():
+        raise ValueError("'{path}' is truncated".format(path=path))
+    return image, len(header), info["seeds"], info["samples"]
+
+class SeedAverager():
+    """ Folds the seeds of a frame into a running average as their jobs finish, so the add-on fetches one image instead of every seed
+
+    Seeds (or the sums of several, made on their render node) are read and summed a band of rows at a time into sums kept
+    in files mapped into memory, so frames of any size average in bounded memory, and an interrupted render can resume
+    with the seeds it has already folded in. The average is written as float32 RGBA pixels, so it keeps the precision
+    the seeds add up to
+    """
+
+    # bytes per channel value of the working arrays of a band (the most the average takes)
+    BAND_BYTES = 40
+    # room left in the json header of the average for the noise estimate, so the header can be written after the pixels are
+    NOISE_LENGTH = 32
+
+    def __init__(self, localResultsPath, nameOutputFiles, frame, verbose=0, accumulatorPath=None, memoryLimit=512 * 2**20, samples=None, resume=False):
+        self.localResultsPath = localResultsPath
+        self.nameOutputFiles = nameOutputFiles
+        self.frame = frame
+        self.verbose = verbose
+        self.fileName = averageFileName(nameOutputFiles, frame)
+        # Folder for the sums and the log of the seeds in them (outside 'localResultsPath', which the add-on fetches)
+        self.accumulatorPath = accumulatorPath or localResultsPath
+        self.memoryLimit = memoryLimit
+        # Sample count of seeds whose names don't have one (see 'seedOutputSuffix')
+        self.samples = samples
+        self.lock = threading.Lock()
+        # Header of the first seed folded in (the average is written in its format)
+        self.template = None
+        self.sum = None
+        self.sqSum = None
+        self.bandRows = None
+        self.numSeeds = 0
+        # Each seed is weighted by its sample count (or counts once if it isn't known)
+        self.numSamples = 0
+        self.samplesKnown = True
+        # Seeds already in the average (a speculative copy of the job can bring one back)
+        self.folded = set()
+        if resume and self.resume_sums():
+            if self.verbose >= 1:
+                pflush("Resuming the average of frame {frame} with {numSeeds} seeds".format(frame=frame, numSeeds=self.numSeeds))
+            return
+        # an average (or sums) left by an earlier render would count seeds this one renders again
+        for path in [self.get_path(), self.get_log_path()] + self.get_sum_paths():
+            if os.path.exists(path):
+                os.remove(path)
+
+    def get_path(self):
+        return os.path.join(self.localResultsPath, self.fileName)
+
+    def get_sum_paths(self):
+        return [os.path.join(self.accumulatorPath, ".{fileName}.{name}".format(fileName=self.fileName, name=name)) for name in ("sum", "sqsum")]
+
+    def get_log_path(self):
+        return os.path.join(self.accumulatorPath, ".{fileName}.log".format(fileName=self.fileName))
+
+    def get_shape(self):
+        return (self.template.height, self.template.get_row_size())
+
+    def record(self, record):
+        """ appends 'record' to the log of the seeds in the sums """
+        with open(self.get_log_path(), "a") as log:
+            log.write(json.dumps(record) + "\n")
+            log.flush()
+            os.fsync(log.fileno())
+
+    def resume_sums(self):
+        """ picks up the sums an interrupted render of the frame left, returning False if there are none (or a seed was being added when it stopped) """
+        if not all(os.path.exists(path) for path in [self.get_log_path()] + self.get_sum_paths()):
+            return False
+        template = None
+        adding = None
+        added = list()
+        with open(self.get_log_path(), "r") as log:
+            for line in log:
+                try:
+                    record = json.loads(line)
+                except ValueError:
+                    # cut short mid-write, so the sums may hold part of a seed
+                    return False
+                if "template" in record:
+                    template = TargaImage(*(record["template"] + [None]))
+                elif "adding" in record:
+                    adding = record["adding"]
+                elif "added" in record and record["added"] == adding:
+                    adding = None
+                    added.append(record)
+        if adding is not None or template is None:
+            return False
+        # sums of another size (or type) can't be picked up
+        sumBytes = SUM_DTYPE().itemsize * template.height * template.get_row_size()
+        if any(os.path.getsize(path) != sumBytes for path in self.get_sum_paths()):
+            return False
+        self.template = template
+        for record in added:
+            self.folded.add(record["added"])
+            self.numSeeds += record["seeds"]
+            self.numSamples += record["samples"]
+            self.samplesKnown = self.samplesKnown and record["samplesKnown"]
+        self.sum, self.sqSum = [numpy.memmap(path, SUM_DTYPE, "r+", shape=self.get_shape()) for path in self.get_sum_paths()]
+        self.set_band_rows()
+        return True
+
+    def start_sums(self, image):
+        """ sets up the sums for seeds like 'image' """
+        self.template = image
+        self.sum, self.sqSum = [numpy.memmap(path, SUM_DTYPE, "w+", shape=self.get_shape()) for path in self.get_sum_paths()]
+        self.record({"template":[image.width, image.height, image.imageType, image.pixelDepth, image.alphaBits]})
+        self.set_band_rows()
+
+    def set_band_rows(self):
+        # mapped pages of the sums can be written out and dropped, so they don't count against the limit
+        self.bandRows = max(1, self.memoryLimit // (self.BAND_BYTES * self.template.get_row_size()))
+
+    def get_bands(self):
+        for startRow in range(0, self.template.height, self.bandRows):
+            yield startRow, min(startRow + self.bandRows, self.template.height)
+
+    def add(self, fileNames):
+        """ folds the seed images 'fileNames' into the average, removing them; returns the file names to fetch in their place """
+        with self.lock:
+            for fileName in fileNames:
+                seedPath = os.path.join(self.localResultsPath, fileName)
+                if fileName in self.folded:
+                    os.remove(seedPath)
+                    continue
+                partial = fileName.endswith(PARTIAL_SUMS_EXTENSION)
+                samplesKnown = True
+                if partial:
+                    image, start, numSeeds, weight = read_partial_sums_header(seedPath)
+                else:
+                    image, start, topOrigin = TargaImage.read_header(seedPath)
+                    numSeeds = 1
+                    weight = seedSamples(fileName) or self.samples
+                    if not weight:
+                        weight = 1
+                        samplesKnown = False
+                if self.template is None:
+                    self.start_sums(image)
+                elif (image.width, image.height, image.imageType, image.pixelDepth) != (self.template.width, self.template.height, self.template.imageType, self.template.pixelDepth):
+                    raise ValueError("'{seedPath}' doesn't match the size and format of the seeds before it".format(seedPath=seedPath))
+                # logged on either side of changing the sums, so a resumed render knows whether they hold all of the seed or none of it
+                self.record({"adding":fileName})
+                height = image.height
+                if partial:
+                    # already weighted, so they're added as they are
+                    sums = numpy.memmap(seedPath, SUM_DTYPE, "r", offset=start, shape=(2, height, image.get_row_size()))
+                    for startRow, endRow in self.get_bands():
+                        self.sum[startRow:endRow] += sums[0, startRow:endRow]
+                        self.sqSum[startRow:endRow] += sums[1, startRow:endRow]
+                    del sums
+                else:
+                    seed = numpy.memmap(seedPath, numpy.uint8, "r", offset=start, shape=(height, image.get_row_size()))
+                    for startRow, endRow in self.get_bands():
+                        # rows are summed bottom row first, whichever way up the seed was stored
+                        rows = seed[height - endRow:height - startRow][::-1] if topOrigin else seed[startRow:endRow]
+                        values = rows.astype(SUM_DTYPE)
+                        weighted = values * weight
+                        self.sum[startRow:endRow] += weighted
+                        weighted *= values
+                        self.sqSum[startRow:endRow] += weighted
+                    del seed
+                self.sum.flush()
+                self.sqSum.flush()
+                self.record({"added":fileName, "seeds":numSeeds, "samples":weight, "samplesKnown":samplesKnown})
+                self.numSeeds += numSeeds
+                self.numSamples += weight
+                self.samplesKnown = self.samplesKnown and samplesKnown
+                self.folded.add(fileName)
+                os.remove(seedPath)
+            if not self.numSeeds:
+                return []
+            self.write_average()
+            return [self.fileName]
+
+    def add_leftovers(self):
+        """ folds in the seeds of the frame already in 'localResultsPath' (an interrupted render may have brought them back without folding them in) """
+        pattern = "{nameOutputFiles}_seed-*_{frame}.???".format(nameOutputFiles=self.nameOutputFiles, frame=str(self.frame).zfill(4))
+        fileNames = sorted(fileName for fileName in os.listdir(self.localResultsPath) if fnmatch.fnmatch(fileName, pattern))
+        return self.add(fileNames) if fileNames else []
+
+    def to_rgba(self, values):
+        """ converts rows of stored TGA values to float RGBA pixels on Blender's 0-1 scale """
+        channels = self.template.pixelDepth // 8
+        values = values.reshape(len(values), self.template.width, channels)
+        rgba = numpy.empty(values.shape[:2] + (4,), numpy.float32)
+        if channels == 1:
+            rgba[..., :3] = values
+        else:
+            # stored as BGR(A)
+            rgba[..., :3] = values[..., 2::-1]
+        rgba[..., 3] = values[..., 3] if channels == 4 else 255
+        rgba /= 255
+        return rgba
+
+    def write_average(self):
+        """ writes the average out a band at a time, after a line of json with its size, the seed and sample counts and noise estimate """
+        N = self.numSeeds
+        W = self.numSamples
+        # the standard error of each pixel's mean, averaged over the image (on the add-on's 0-1 scale); each seed's
+        # variance is taken to shrink with its sample count, so the per-sample variance is estimated from the weighted sums
+        totalError = 0.0
+        tmpPath = self.get_path() + ".tmp"
+        with open(tmpPath, "wb") as f:
+            # the header is written once the noise is known
+            f.seek(len(self.get_info(N, W, None)))
+            for startRow, endRow in self.get_bands():
+                mean = self.sum[startRow:endRow] / W
+                f.write(self.to_rgba(mean).tobytes())
+                if N >= 2:
+                    sampleVariance = numpy.maximum(self.sqSum[startRow:endRow] / W - mean * mean, 0) * W / (N - 1)
+                    totalError += float(numpy.sum(numpy.sqrt(sampleVariance / W)))
+            noise = totalError / self.sum.size / 255 if N >= 2 else None
+            f.seek(0)
+            f.write(self.get_info(N, W, noise))
+        os.rename(tmpPath, self.get_path())
+        if self.verbose >= 2:
+            pflush("Averaged {numSeeds} seeds of frame {frame} into {fileName}".format(numSeeds=N, frame=self.frame, fileName=self.fileName))
+
+    def get_info(self, numSeeds, numSamples, noise):
+        # the seeds folded in are listed, so the add-on can tell them from seeds that came back without being folded in
+        info = {"width":self.template.width, "height":self.template.height, "alpha":self.template.pixelDepth == 32, "seeds":numSeeds, "samples":numSamples if self.samplesKnown else None, "folded":sorted(self.folded), "noise":noise}
+        # the same length whatever the noise
+        length = len(json.dumps(dict(info, noise=None))) + self.NOISE_LENGTH
+        return (json.dumps(info).ljust(length) + "\n").encode("utf-8")
+
+    def finish(self, keepSums=False):
+        """ writes the average out again (the add-on may have fetched it already), removing late copies of seeds it has and (unless 'keepSums', to resume with) the sums """
+        with self.lock:
+            for fileName in self.folded:
+                seedPath = os.path.join(self.localResultsPath, fileName)
+                if os.path.exists(seedPath):
+                    os.remove(seedPath)
+            if self.numSeeds:
+                self.write_average()
+            self.sum = self.sqSum = None
+            if keepSums:
+                return
+            for path in [self.get_log_path()] + self.get_sum_paths():
+                if os.path.exists(path):
+                    os.remove(path)
@@ -0,0 +1,118 @@
+#!/usr/bin/env python
+# Copyright (C) 2018 Christopher Gearhart
+# chris@bblanimation.com
+# http://bblanimation.com/
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+# system imports
+import os
+import struct
+from supporting_methods import *
+
+# Uncompressed true-color and grayscale images (what Blender writes for 'TARGA_RAW')
+TGA_TRUECOLOR = 2
+TGA_GRAYSCALE = 3
+# Descriptor bit set when the first row stored is the top one
+TGA_TOP_ORIGIN = 0x20
+
+class TargaImage():
+    """ Uncompressed TGA image, read and written without an imaging library (the host server may not have one) """
+
+    def __init__(self, width, height, imageType, pixelDepth, alphaBits, pixels, imageId=b""):
+        self.width = width
+        self.height = height
+        self.imageType = imageType
+        self.pixelDepth = pixelDepth
+        self.alphaBits = alphaBits
+        # Pixel data, bottom row first
+        self.pixels = pixels
+        # Free-form field of up to 255 bytes stored in the header
+        self.imageId = imageId
+
+    @classmethod
+    def read_header(cls, path):
+        """ returns the image at 'path' without its pixels, the offset they start at and whether they're stored top row first """
+        with open(path, "rb") as f:
+            data = f.read(18)
+            if len(data) < 18:
+                raise ValueError("'{path}' is truncated".format(path=path))
+            idLength, colorMapType, imageType = struct.unpack("<BBB", data[:3])
+            colorMapLength, colorMapDepth = struct.unpack("<HB", data[5:8])
+            width, height, pixelDepth, descriptor = struct.unpack("<HHBB", data[12:18])
+            imageId = f.read(idLength)
+        if imageType not in (TGA_TRUECOLOR, TGA_GRAYSCALE):
+            raise ValueError("'{path}' is not an uncompressed TGA image (image type {imageType})".format(path=path, imageType=imageType))
+        start = 18 + idLength + (colorMapLength * ((colorMapDepth + 7) // 8) if colorMapType else 0)
+        if os.path.getsize(path) < start + height * width * pixelDepth // 8:
+            raise ValueError("'{path}' is truncated".format(path=path))
+        return cls(width, height, imageType, pixelDepth, descriptor & 0x0f, None, imageId), start, bool(descriptor & TGA_TOP_ORIGIN)
+
+    @classmethod
+    def read(cls, path):
+        image, start, topOrigin = cls.read_header(path)
+        rowSize = image.get_row_size()
+        with open(path, "rb") as f:
+            f.seek(start)
+            pixels = f.read(rowSize * image.height)
+        if topOrigin:
+            pixels = b"".join(pixels[row * rowSize:(row + 1) * rowSize] for row in reversed(range(image.height)))
+        image.pixels = pixels
+        return image
+
+    def get_row_size(self):
+        return self.width * self.pixelDepth // 8
+
+    def get_header(self):
+        return struct.pack("<BBBHHBHHHHBB", len(self.imageId), 0, self.imageType, 0, 0, 0, 0, 0, self.width, self.height, self.pixelDepth, self.alphaBits) + self.imageId
+
+    def write(self, path):
+        # write to a temporary file first, so nothing picks up a half-written image
+        tmpPath = path + ".tmp"
+        with open(tmpPath, "wb") as f:
+            f.write(self.get_header())
+            f.write(self.pixels)
+        os.rename(tmpPath, path)
+
+    @classmethod
+    def stack(cls, strips):
+        """ returns one image made of 'strips' (same width and format) stacked from the bottom up """
+        first = strips[0]
+        for strip in strips[1:]:
+            if (strip.width, strip.imageType, strip.pixelDepth) != (first.width, first.imageType, first.pixelDepth):
+                raise ValueError("strips must share their width and pixel format to be stitched")
+        return cls(first.width, sum(strip.height for strip in strips), first.imageType, first.pixelDepth, first.alphaBits, b"".join(strip.pixels for strip in strips))
+
+
+def stitch_tiles(localResultsPath, nameOutputFiles, frame, numTiles, verbose=0, samples=None):
+    """ stitches the strips rendered by 'buildTileJobStrings' for 'frame' into one image, removing the strips; returns the tiles missing (stitching nothing if there are any) """
+    frameString = str(frame).zfill(4)
+    tilePaths = list()
+    missingTiles = list()
+    for tileIndex in range(numTiles):
+        tilePath = os.path.join(localResultsPath, "{outputName}_{frame}.tga".format(outputName=tileOutputName(nameOutputFiles, tileIndex, numTiles), frame=frameString))
+        if os.path.exists(tilePath):
+            tilePaths.append(tilePath)
+        else:
+            missingTiles.append(tileIndex)
+    if missingTiles:
+        return missingTiles
+    # the whole frame at full samples stands in for a single seed, so the add-on averages it like any other still
+    outputPath = os.path.join(localResultsPath, "{nameOutputFiles}{seedString}_{frame}.tga".format(nameOutputFiles=nameOutputFiles, seedString=seedOutputSuffix(0, samples), frame=frameString))
+    TargaImage.stack([TargaImage.read(tilePath) for tilePath in tilePaths]).write(outputPath)
+    for tilePath in tilePaths:
+        os.remove(tilePath)
+    if verbose >= 2:
+        pflush("Stitched {numTiles} tiles into {outputPath}".format(numTiles=numTiles, outputPath=outputPath))
+    return missingTiles
@@ -0,0 +1,118 @@
+#!/usr/bin/env python
+# Copyright (C) 2018 Christopher Gearhart
+# chris@bblanimation.com
+# http://bblanimation.com/
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+# system imports
+import multiprocessing
+import threading
+import time
+from supporting_methods import *
+
+class ThroughputTracker():
+    """ Rolling estimate of the seconds each host takes per frame, from finished jobs and Blender's live status lines """
+
+    def __init__(self, smoothing=.3, verbose=0):
+        # Weight given to the newest measurement in the moving averages
+        self.smoothing = smoothing
+        self.verbose = verbose
+        self.lock = threading.Lock()
+        # Smoothed seconds per frame (including job overhead) measured from finished jobs, indexed by hostname
+        self.frame_times = dict()
+        # Latest status of the frame each running job is rendering, indexed by hostname then job id
+        self.live_estimates = dict()
+        # Frames finished by each host, indexed by hostname
+        self.frames_done = dict()
+        # Child processes report status lines here (see 'start_tasks'); read by 'status_reader'
+        self.status_queue = None
+        self.status_reader = None
+        self.stopped = False
+
+    def get_status_queue(self):
+        """ returns the queue job processes should put (hostname, jobId, frame, elapsed, remaining) tuples on """
+        if self.status_queue is None:
+            self.status_queue = multiprocessing.Queue()
+            self.status_reader = threading.Thread(target=self.read_status_queue, name="Thread-ThroughputTracker")
+            self.status_reader.daemon = True
+            self.status_reader.start()
+        return self.status_queue
+
+    def read_status_queue(self):
+        while True:
+            status = self.status_queue.get()
+            if status is None:
+                return
+            self.update_progress(*status)
+
+    def stop(self):
+        """ stops reading status lines; returns False if already stopped """
+        if self.stopped:
+            return False
+        self.stopped = True
+        if self.status_queue is not None:
+            self.status_queue.put(None)
+        return True
+
+    def update_progress(self, hostname, jobId, frame, elapsed, remaining):
+        with self.lock:
+            self.live_estimates.setdefault(hostname, dict())[jobId] = {"frame":frame, "elapsed":elapsed, "remaining":remaining, "updated":time.time()}
+
+    def job_finished(self, hostname, job, elapsed):
+        """ folds the time a finished Job took into its host's seconds per frame """
+        numFrames = job.num_frames()
+        frameTime = elapsed / float(numFrames)
+        with self.lock:
+            self.live_estimates.get(hostname, dict()).pop(job.id, None)
+            oldFrameTime = self.frame_times.get(hostname)
+            self.frame_times[hostname] = frameTime if oldFrameTime is None else (1 - self.smoothing) * oldFrameTime + self.smoothing * frameTime
+            self.frames_done[hostname] = self.frames_done.get(hostname, 0) + numFrames
+
+    def job_stopped(self, hostname, job):
+        with self.lock:
+            self.live_estimates.get(hostname, dict()).pop(job.id, None)
+
+    def get_progress(self, hostname, job):
+        """ returns the latest status of 'job' on 'hostname' (None if Blender hasn't reported any) """
+        with self.lock:
+            return self.live_estimates.get(hostname, dict()).get(job.id)
+
+    def get_frame_time(self, hostname):
+        """ seconds per frame on 'hostname' (None until there is a measurement) """
+        with self.lock:
+            frameTime = self.frame_times.get(hostname)
+            # a frame that has already run longer than the average means the host has slowed down (or is new)
+            for estimate in self.live_estimates.get(hostname, dict()).values():
+                if frameTime is None or estimate["elapsed"] > frameTime:
+                    frameTime = max(frameTime or 0, estimate["elapsed"] + estimate["remaining"])
+            return frameTime
+
+    def get_average_frame_time(self):
+        with self.lock:
+            frameTimes = list(self.frame_times.values())
+        if not frameTimes:
+            return None
+        return sum(frameTimes) / float(len(frameTimes))
+
+    def get_rate(self, hostname, default=None):
+        """ frames per second one slot on 'hostname' can render """
+        frameTime = self.get_frame_time(hostname)
+        if frameTime is None:
+            return default
+        return 1. / max(frameTime, .001)
+
+    def print_stats(self):
+        for hostname in sorted(self.frame_times.keys()):
+            pflush("    {hostname}: {frameTime:.1f}s per frame ({framesDone} frames)".format(hostname=hostname, frameTime=self.frame_times[hostname], framesDone=self.frames_done.get(hostname, 0)))
@@ -22,28 +22,56 @@ import fnmatch
 import getpass
 import json
 import os
-import re
 import signal
 import subprocess
 import sys
-import telnetlib
+import threading
+import time
 from JobHost import *
 from JobHostManager import *
+from CapacityMonitor import *
+from JobJournal import *
+from FrameSet import *
+from RenderService import *
+from SeedAverager import *
+from TargaImage import *
 from VerboseAction import verbose_action
 
 # Set up parameters
 parser = argparse.ArgumentParser()
-parser.add_argument("-l", "--frame_range", action="store", default="[]", help="Pass a list of frame numbers (no spaces) to be rendered.")
+parser.add_argument("-l", "--frame_range", action="store", default="[]", help="Pass a list of frame numbers and [start,end] ranges (no spaces) to be rendered, or '-' to read the list from stdin.")
 # Takes a string dictionary of hosts
 # If neither of these arguments are provided, then use the default hosts file to load hosts
 parser.add_argument("-d", "--hosts", action="store", default=None, help="Pass a dictionary or list of hosts. Should be valid json.")
 parser.add_argument("-H", "--hosts_online", action="store_true", default=None, help="Telnets to ports to find out if a host is availible to ssh into, skips everything else.")
 parser.add_argument("-i", "--hosts_file", action="store", default="remoteServers.txt", help="Pass a filename from which to load hosts. Should be valid json format.")
 parser.add_argument("-m", "--max_server_load", action="store", default=1, help="Max render processes to run on each server at a time.")
-parser.add_argument("-a", "--average_results", action="store_true", default=None, help="Average frames when finished.")
+parser.add_argument("--auto_load", action="store_true", default=False, help="Set each server's max load from its cores, free memory and load average (up to --max_server_load), re-checking while rendering.")
+parser.add_argument("--cores_per_job", action="store", default=8, help="Cores to allow for each job when setting server loads with --auto_load.")
+parser.add_argument("--job_memory", action="store", default=2048, help="Memory (MB) to allow for each job when setting server loads with --auto_load.")
+parser.add_argument("--capacity_interval", action="store", default=30, help="Seconds between checks of each server's load with --auto_load.")
+parser.add_argument("-a", "--average_results", action="store_true", default=None, help="Average the seeds of each frame (with --jobs_per_frame) on this server as their jobs finish, weighting each by its sample count, and leave one float '<name>_average_<frame>.raw' (a line of json with its size, seed and sample counts, then float32 RGBA pixels) instead of the seeds. Seeds are rendered as 8 bit TGA images for this.")
 parser.add_argument("-j", "--jobs_per_frame", action="store", default=False, help="Number of jobs to queue for each frame")
+parser.add_argument("--tiles", action="store", default=False, help="Render each frame as this many horizontal strips (a job each), stitching them back together on the host server when done.")
+parser.add_argument("--node_reduce", action="store_true", default=False, help="With --average_results, render the seeds of each frame in about one job per server job slot, and sum each job's seeds on its server, so one file per job comes back instead of every seed.")
+parser.add_argument("--average_memory", action="store", default=512, help="Megabytes the seeds of each frame may use while being averaged with --average_results (the sums themselves are kept in files, mapped into memory).")
+parser.add_argument("--stream_results", action="store_true", default=False, help="Print '##RESULT##<file name>##RESULT##' to stdout for each output file as soon as its job is done, so it can be fetched right away.")
 parser.add_argument("-s", "--samples", action="store", default=False, help="Number of samples to render per job")
+parser.add_argument("--chunk_time", action="store", default=False, help="Render consecutive frames in one Blender session per job, sizing each job to take about this many seconds.")
+parser.add_argument("--resident_workers", action="store_true", default=False, help="Keep a Blender process with the project loaded running on each server and send it frames, instead of starting Blender for every job.")
+parser.add_argument("--process_per_job", action="store_true", default=False, help="Run each job's rsync/ssh commands from a child process of its own, instead of from one shared thread.")
+parser.add_argument("--max_attempts", action="store", default=3, help="Number of times to try each job (on different servers where possible) before giving up on it.")
+parser.add_argument("--retry_delay", action="store", default=2, help="Seconds to wait before retrying a failed job (doubled after each failed attempt).")
+parser.add_argument("--no_speculation", action="store_true", default=False, help="Don't start copies of the slowest running jobs on idle servers once every job has been handed out.")
+parser.add_argument("--service", action="store_true", default=False, help="Keep running as a render service: hosts stay probed and connected between renders, and renders submitted by other blender_task calls share them.")
+parser.add_argument("--service_socket", action="store", default=None, help="Unix socket of the render service (defaults to 'blender_task.sock' in the project root).")
+parser.add_argument("--service_status", action="store_true", default=False, help="Print the renders the render service is running as a json list, and exit.")
+parser.add_argument("--cancel", action="store_true", default=False, help="Cancel the render of --project_name (and no other): through the render service if one is running, or by stopping the blender_task rendering it, and exit.")
+parser.add_argument("--no_service", action="store_true", default=False, help="Render from this process even if a render service is running.")
+parser.add_argument("--no_resume", action="store_true", default=False, help="Render every frame, even if an interrupted render of the same project file already finished some of them.")
 parser.add_argument("-t", "--connection_timeout", action="store", default=.01, help="Pass a float for the timeout in seconds for telnet connections to client servers.")
+parser.add_argument("--probe_interval", action="store", default=5, help="Seconds between background reachability checks of each client server while rendering.")
+parser.add_argument("--probe_threads", action="store", default=256, help="Max number of client servers to check for reachability at once.")
 # NOTE: this parameter is currently required
 parser.add_argument("-n", "--project_name", action="store", default=False) # just project name. default path will be in /tmp/blenderProjects
 # TODO: test this for directories other than toRemote
@@ -62,16 +90,19 @@ parser.add_argument("-O", "--name_output_files", action="store", default=False,
 def signal_handler(signal, frame):
     sys.exit(1)
 
-def main():
-    """ Main function runs when blender_task is called """
+def get_project_root(args):
+    """ root path for project files on the host server (see '--project_root') """
+    if not args.project_root:
+        username = getpass.getuser()
+        return os.path.join("/tmp", username)
+    if args.project_root[-1] == "/":
+        args.project_root = args.project_root[:-1]
+    return args.project_root
 
-    startTime = time.time()
-    args = parser.parse_args()
+def setup_hosts(args):
+    """ returns the hostnames, a JobHost for each (indexed by hostname) and the HostMonitor probing them, after probing every host once """
     verbose = args.verbose
 
-    signal.signal(signal.SIGINT, signal_handler)
-    signal.signal(signal.SIGTERM, signal_handler)
-
     # Getting hosts from some source
     if args.hosts_file:
         hosts = listHosts(setServersDict(args.hosts_file))
@@ -80,49 +111,47 @@ def main():
     else:
         hosts = listHosts(HOSTS)
 
-    # Test hosts to see which ones are available
     host_objects = dict()
-    hosts_online = list()
-    hosts_offline = list()
-
     max_server_load = int(args.max_server_load)
+    host_monitor = HostMonitor(hostnames=hosts, interval=float(args.probe_interval), timeout=float(args.connection_timeout), max_workers=int(args.probe_threads), verbose=verbose, print_connection_issue=args.hosts_online)
+    # probe all hosts concurrently, so discovery takes about one timeout rather than one per host
+    host_monitor.probe_all()
     for host in hosts:
-        jh = JobHost(hostname=host, timeout=float(args.connection_timeout), thread_func=start_tasks, verbose=verbose, print_connection_issue=args.hosts_online, max_on_host=max_server_load)
-        if jh.is_reachable():
-            hosts_online.append(str(host))
-        else:
-            hosts_offline.append(str(host))
+        # a render service shares its hosts between projects, so it can't keep one project loaded on them (and workers don't take tiles)
+        jh = JobHost(hostname=host, timeout=float(args.connection_timeout), thread_func=start_tasks, verbose=verbose, print_connection_issue=args.hosts_online, max_on_host=max_server_load, host_monitor=host_monitor, use_workers=args.resident_workers and not args.service and not args.tiles and not args.node_reduce)
         host_objects[host] = jh
-    numHosts = len(hosts_online)
+    return hosts, host_objects, host_monitor
 
-    # if this parameter is passed, print number of servers online and exit
-    if args.hosts_online:
-        if verbose >= 2: print("Hosts Online : ")
-        print(hosts_online)
-        if verbose >= 2: print("Hosts Offline: ")
-        print(hosts_offline)
-        sys.exit(0)
-    # Print the start message
-    elif verbose >= 1:
-        pflush("Starting distribute task...")
+def start_services(args, projectRoot, host_objects, username):
+    """ starts what every render shares: ssh master connections, the capacity monitor and the job engine """
+    verbose = args.verbose
 
-    # Verify there are hosts available
-    if len(hosts_online) == 0:
-        sys.stderr.write("No hosts available.")
-        sys.exit(58)
-    elif verbose >= 1:
-        print("hosts available: {numHostsOnline}".format(numHostsOnline=len(hosts_online)))
+    # open one ssh master connection per host and reuse it for every ssh/rsync call (sockets live under the project root)
+    # a render service keeps its connections open for as long as it runs
+    ssh_pool = SSHConnectionPool(os.path.join(projectRoot, ".ssh-{pid}".format(pid=os.getpid())), username, persist="yes" if args.service else 600, verbose=verbose)
 
-    # Set up 'projectRoot' as root path for project on host and client servers
-    username = getpass.getuser()
-    if not args.project_root:
-        projectRoot = os.path.join("/tmp", username)
-    else:
-        if args.project_root[-1] == "/":
-            args.project_root = args.project_root[:-1]
-        projectRoot = args.project_root
+    # size each server's load from its hardware and current load, and keep adjusting it while the render runs
+    capacity_monitor = None
+    if args.auto_load:
+        capacity_monitor = CapacityMonitor(username, hosts=host_objects.values(), interval=float(args.capacity_interval), cores_per_job=int(args.cores_per_job), job_memory=int(args.job_memory), max_on_host=int(args.max_server_load), ssh_pool=ssh_pool, verbose=verbose)
+        capacity_monitor.update_all()
+        capacity_monitor.start()
+
+    # run every job's commands from one thread, rather than forking a copy of this process for each running job
+    engine = None
+    if not args.process_per_job:
+        engine = JobEngine(verbose=verbose)
+        engine.start()
+
+    return ssh_pool, capacity_monitor, engine
+
+def render_project(args, frames, host_objects, projectRoot, startTime, session=None, **manager_args):
+    """ renders 'frames' of the project named in 'args' on 'host_objects' (shared with other renders if given the RenderService 'session' submitting it) """
+    verbose = args.verbose
+    numHosts = len([host for host in host_objects.values() if host.is_reachable()])
 
     # Set up 'projectName', 'projectPath', 'projectSyncPath', 'localResultsPath' & 'remoteResultsPath'
+    username = getpass.getuser()
     if args.project_name:
         if not args.name_output_files:
             args.name_output_files = args.project_name
@@ -161,12 +190,16 @@ def main():
         pflush("sorry, please give your project a name using the -n or --project_name flags.")
         sys.exit(0)
 
+    # Pick up where an interrupted render of the same project file left off (its results are kept)
+    journalKey = {"blend":fileChecksum(os.path.join(projectSyncPath, "{projectName}.blend".format(projectName=projectName))), "samples":args.samples}
+    journal = JobJournal(os.path.join(projectPath, "jobs.journal"), journalKey, resume=not args.no_resume, verbose=verbose)
+
     # Set up 'localResultsPath'
     if not args.output_file_path:
         localResultsPath = os.path.join(projectPath, 'results')
         if not os.path.exists(localResultsPath):
             os.mkdir(localResultsPath)
-        for file in os.listdir(localResultsPath):
+        for file in os.listdir(localResultsPath) if not journal.resumed else []:
             if fnmatch.fnmatch(file, '*_seed-*') or file[-3:] in getSupportedFileTypes():
                 outputFile = os.path.join(localResultsPath, file)
                 if args.verbose >= 3:
@@ -177,26 +210,79 @@ def main():
             os.mkdir(localResultsPath)
         localResultsPath = os.path.join(localResultsPath, '.')
 
+    # the add-on creates this file to end the render early (see JobHostManager.stop_early), so clear one left by an earlier render
+    stopFile = os.path.join(projectPath, "render.stop")
+    if os.path.exists(stopFile):
+        os.remove(stopFile)
+
     # Copy blender_p.py to project folder and append seed value if given
     pyFilePathDest = os.path.join(projectPath, "toRemote", "blender_p.py")
     subprocess.call("rsync -e 'ssh -oStrictHostKeyChecking=no' -a '{pyFilePathSource}' '{pyFilePathDest}'".format(pyFilePathSource=os.path.join(projectRoot, "blender_p.py"), pyFilePathDest=pyFilePathDest), shell=True)
     if args.samples:
         with open(pyFilePathDest, "a") as f:
-            f.write("    scene.cycles.progressive = 'PATH'\n")
-            f.write("    scene.cycles.samples = {samples}\n".format(samples=args.samples))
-            f.write("    scene.cycles.use_square_samples = False\n")
+            f.write("    scn.cycles.progressive = 'PATH'\n")
+            f.write("    scn.cycles.samples = {samples}\n".format(samples=args.samples))
+            f.write("    scn.cycles.use_square_samples = False\n")
             f.write("    try:\n")
-            f.write("        scene.render.layers.active.cycles.use_denoising = False\n")
+            f.write("        scn.render.layers.active.cycles.use_denoising = False\n")
             f.write("    except Exception as e:\n")
             f.write("        print(e)\n")
+    numTiles = int(args.tiles) if args.tiles else 0
+    averageSeeds = args.average_results and args.jobs_per_frame and not numTiles
+    if averageSeeds:
+        # seeds are read back here without an imaging library, so they're written as uncompressed TGA
+        with open(pyFilePathDest, "a") as f:
+            f.write("    scn.render.image_settings.file_format = 'TARGA_RAW'\n")
+    # each job slot gets about one job per frame, so its seeds of the frame are summed on the node they're rendered on
+    seedJobs = max(1, numHosts) * int(args.max_server_load) if averageSeeds and args.node_reduce else None
+    chunkTime = float(args.chunk_time) if args.chunk_time and not args.jobs_per_frame and not numTiles else 0
+    if chunkTime:
+        # keep scene data (BVH, images, etc.) loaded between the frames of a chunk
+        with open(pyFilePathDest, "a") as f:
+            f.write("    scn.render.use_persistent_data = True\n")
+
+    if args.resident_workers and (session or numTiles or args.node_reduce):
+        pflush("Resident workers aren't used by the render service, for tiles or with --node_reduce; starting Blender for each job.")
+    elif args.resident_workers:
+        # resident workers run this script after 'blender_p.py' to take frames over stdin
+        workerFilePathDest = os.path.join(projectPath, "toRemote", "blender_worker.py")
+        subprocess.call("rsync -e 'ssh -oStrictHostKeyChecking=no' -a '{workerFilePathSource}' '{workerFilePathDest}'".format(workerFilePathSource=os.path.join(projectRoot, "blender_worker.py"), workerFilePathDest=workerFilePathDest), shell=True)
 
     # Print frame range to be rendered
-    frames = json.loads(args.frame_range)
     if verbose >= 1:
         pflush("{numFrames} frames queued from project '{projectName}': {frameRange}".format(numFrames=str(len(frames)), frameRange=str(frames), projectName=projectName))
 
-    # set up variables for threads
-    jobStrings = buildJobStrings(frames, projectName, projectPath, args.name_output_files, int(args.jobs_per_frame), numHosts)
+    # an interrupted render's sums are picked up along with the journal, so the seeds in them aren't rendered again
+    averagers = dict((frame, SeedAverager(localResultsPath, args.name_output_files, frame, verbose, accumulatorPath=projectPath, memoryLimit=int(float(args.average_memory) * 2**20), samples=int(args.samples) if args.samples else None, resume=journal.resumed)) for frame in frames) if averageSeeds else dict()
+    for averager in averagers.values() if journal.resumed else []:
+        try:
+            averager.add_leftovers()
+        except (IOError, ValueError) as e:
+            eflush("Could not average the seeds of frame {frame} left by the interrupted render: {e}\n".format(frame=averager.frame, e=e))
+    foldedFiles = [fileName for averager in averagers.values() for fileName in averager.folded]
+
+    # set up variables for threads (skipping frames an interrupted render already finished)
+    if not args.jobs_per_frame and not numTiles:
+        numJobs = len(frames)
+        if journal.resumed:
+            frames = journal.remove_completed_frames(frames, args.name_output_files, localResultsPath)
+        numDone = numJobs - len(frames)
+        # animation jobs are built as hosts ask for them (chunks sized from the measured time per frame with --chunk_time)
+        jobStrings = None
+        job_queue = FrameChunkQueue(frames, lambda startFrame, endFrame: buildJobString(projectPath, projectName, args.name_output_files, startFrame, endFrame=endFrame), chunk_time=chunkTime or None, speculate=not args.no_speculation)
+    else:
+        if numTiles:
+            # more strips than hosts, so faster hosts end up taking more of each frame
+            jobStrings = buildTileJobStrings(frames, projectName, projectPath, args.name_output_files, numTiles)
+        else:
+            jobStrings = buildJobStrings(frames, projectName, projectPath, args.name_output_files, int(args.jobs_per_frame), numHosts, samples=args.samples, seedJobs=seedJobs)
+        numJobs = len(jobStrings)
+        if journal.resumed:
+            jobStrings = journal.remove_completed_jobs(jobStrings, localResultsPath, foldedFiles)
+        numDone = numJobs - len(jobStrings)
+        job_queue = JobQueue(jobStrings, speculate=not args.no_speculation)
+    if verbose >= 1 and numDone:
+        pflush("Resuming interrupted render: {numDone} of {numJobs} jobs already finished".format(numDone=numDone, numJobs=numJobs))
     job_args = {
         "projectName":      projectName,
         "projectPath":      projectPath,
@@ -208,12 +294,60 @@ def main():
         "progress":         args.progress,
     }
     if len(frames) == 1:
-        job_args["frame"] = frames[0]
+        job_args["frame"] = frames.min()
+
+    if args.stream_results or averagers:
+        def result_callback(hostname, job):
+            fileNames = jobOutputFiles(job.command, localResultsPath)
+            if averagers:
+                try:
+                    fileNames = averagers[parseJobString(job.command)[1]].add(fileNames)
+                except (IOError, ValueError) as e:
+                    # the seeds stay where they are, for the add-on to average
+                    eflush("Could not average {fileNames}: {e}\n".format(fileNames=fileNames, e=e))
+            if not args.stream_results:
+                return
+            # name each file, so the add-on can fetch just the new ones (and without waiting for the rest of the render)
+            for fileName in fileNames:
+                line = "##RESULT##{fileName}##RESULT##".format(fileName=fileName)
+                # called from a host thread, so the service's output routing wouldn't pick this up
+                if session:
+                    session.send("out", line + "\n")
+                else:
+                    pflush(line)
+    else:
+        result_callback = None
 
     # Sets up kwargs, and callbacks on the hosts
-    jhm = JobHostManager(jobs=jobStrings, hosts=host_objects, function_args=job_args, verbose=verbose, max_on_hosts=max_server_load)
-    jhm.start()
-    status = jhm.get_cumulative_status()
+    jhm = JobHostManager(jobs=None, hosts=host_objects, function_args=job_args, verbose=verbose, max_on_hosts=int(args.max_server_load), job_queue=job_queue, max_attempts=int(args.max_attempts), retry_delay=float(args.retry_delay), journal=journal, shared=session is not None, result_callback=result_callback, stop_file=stopFile, **manager_args)
+    if session:
+        # the service's hosts take turns between this render's queue and those of the other renders it is serving
+        session.set_manager(jhm, projectName)
+        session.service.job_queue.add_queue(job_queue)
+    try:
+        jhm.start()
+    finally:
+        if session:
+            session.service.job_queue.remove_queue(job_queue)
+    journal.close()
+    for averager in averagers.values():
+        averager.finish(keepSums=jhm.interrupted)
+    if os.path.exists(stopFile):
+        os.remove(stopFile)
+    failedJobs = jhm.get_failed_jobs()
+    jhm.print_failed_jobs()
+
+    # put the strips of each frame back together
+    unstitchedFrames = list()
+    for frame in frames if numTiles else []:
+        try:
+            missingTiles = stitch_tiles(localResultsPath, args.name_output_files, frame, numTiles, verbose, samples=args.samples)
+            reason = "missing tiles {missingTiles}".format(missingTiles=missingTiles) if missingTiles else None
+        except (IOError, ValueError) as e:
+            reason = str(e)
+        if reason:
+            unstitchedFrames.append(frame)
+            eflush("Could not stitch frame {frame}: {reason}\n".format(frame=frame, reason=reason))
 
     if verbose >= 3:
         pflush("\nJob exit statuses:")
@@ -222,14 +356,170 @@ def main():
     # report on the success/failure of the tasks
     endTime = time.time()
     timer = stopWatch(endTime-startTime)
+    numFinished = numDone + jhm.job_queue.store.count(JOB_DONE)
     if verbose >= 1:
         pflush("Elapsed time: {timer}".format(timer=timer))
-        # TODO: Define failed earlier on... keep the strings the same to preserve render status
-        failed = "?"
-        if status == 0:
+    # NOTE: keep the strings the same to preserve render status
+    if failedJobs or unstitchedFrames:
+        eflush("Render failed for {numFailed} jobs\n".format(numFailed=len(failedJobs)))
+        sys.exit(1)
+    if jhm.interrupted:
+        eflush("Render interrupted with {numFinished} of {numJobs} jobs finished\n".format(numFinished=numFinished, numJobs=numJobs))
+        sys.exit(1)
+    if verbose >= 1:
+        # a stop the add-on asked for ends the render with the results it has, so it isn't an error
+        if jhm.stopped_early:
+            pflush("Render stopped early with {numFinished} of {numJobs} jobs finished".format(numFinished=numFinished, numJobs=numJobs))
+        else:
             pflush("Render completed successfully!")
+
+def cancel_render(args, socketPath):
+    """ cancels the render of 'args.project_name' only, returning how many renders were cancelled """
+    numCancelled = cancel_service_render(socketPath, args.project_name)
+    if numCancelled is not None:
+        return numCancelled
+    numCancelled = 0
+    output = subprocess.Popen(["ps", "-eo", "pid=,args="], stdout=subprocess.PIPE).communicate()[0].decode("utf-8", "replace")
+    for line in output.splitlines():
+        pid, command = line.strip().split(None, 1)
+        argv = command.split()
+        if "blender_task" not in command or "--cancel" in argv or int(pid) in (os.getpid(), os.getppid()):
+            continue
+        if any(argv[i] in ("-n", "--project_name") and argv[i + 1] == args.project_name for i in range(len(argv) - 1)):
+            # it cancels its jobs on the render nodes as it exits (see 'signal_handler')
+            os.kill(int(pid), signal.SIGTERM)
+            numCancelled += 1
+    return numCancelled
+
+def run_service(args, projectRoot, socketPath):
+    """ keeps hosts, ssh connections and the job engine running, rendering the projects other blender_task calls submit until killed """
+    verbose = args.verbose
+    username = getpass.getuser()
+    hosts, host_objects, host_monitor = setup_hosts(args)
+    ssh_pool, capacity_monitor, engine = start_services(args, projectRoot, host_objects, username)
+    # every host pulls from the queues of all the renders being served, giving each render an equal share
+    job_queue = FairShareQueue()
+    started = set()
+    startLock = threading.Lock()
+    def start_host(hostname):
+        with startLock:
+            if hostname in started:
+                return
+            started.add(hostname)
+        host = host_objects[hostname]
+        host.set_job_queue(job_queue)
+        host.set_ssh_pool(ssh_pool)
+        if engine:
+            host.set_engine(engine)
+        host.start()
+    def host_reachability_changed(hostname, reachable):
+        if reachable:
+            start_host(hostname)
+            host_objects[hostname].wake()
         else:
-            eflush("Render failed for {numFailed} jobs\n".format(numFailed=failed))
+            # a slow host may have been leaving the last jobs for this one
+            job_queue.wake_hosts()
+    for hostname, host in host_objects.items():
+        if host.is_reachable():
+            start_host(hostname)
+    host_monitor.add_callback(host_reachability_changed)
+    host_monitor.start()
+    if verbose >= 1:
+        pflush("hosts available: {numHostsOnline}".format(numHostsOnline=len(started)))
+
+    def render(renderArgv, framesString, session):
+        renderArgs = parser.parse_args(renderArgv)
+        if renderArgs.project_root and get_project_root(renderArgs) != projectRoot:
+            eflush("The render service renders projects under '{projectRoot}' only\n".format(projectRoot=projectRoot))
+            sys.exit(2)
+        render_project(renderArgs, FrameSet.from_string(framesString), host_objects, projectRoot, time.time(), session=session, host_monitor=host_monitor, ssh_pool=ssh_pool, capacity_monitor=capacity_monitor, engine=engine)
+
+    service = RenderService(socketPath, render, job_queue, verbose=verbose)
+    try:
+        service.serve_forever()
+    finally:
+        service.stop()
+        for hostname in started:
+            host_objects[hostname].kill()
+        host_monitor.stop()
+        if capacity_monitor:
+            capacity_monitor.stop()
+        if engine:
+            engine.stop()
+        ssh_pool.close_all()
+
+def main():
+    """ Main function runs when blender_task is called """
+
+    startTime = time.time()
+    args = parser.parse_args()
+    verbose = args.verbose
+
+    signal.signal(signal.SIGINT, signal_handler)
+    signal.signal(signal.SIGTERM, signal_handler)
+
+    # Set up 'projectRoot' as root path for project on host and client servers
+    projectRoot = get_project_root(args)
+    socketPath = args.service_socket or os.path.join(projectRoot, "blender_task.sock")
+    if args.service:
+        run_service(args, projectRoot, socketPath)
+        sys.exit(0)
+    if args.service_status:
+        renders = service_status(socketPath)
+        if renders is None:
+            eflush("No render service is running on {socketPath}\n".format(socketPath=socketPath))
+            sys.exit(1)
+        print(json.dumps(renders))
+        sys.exit(0)
+
+    if args.cancel:
+        numCancelled = cancel_render(args, socketPath)
+        if verbose >= 1:
+            pflush("Cancelled {numCancelled} renders of project '{projectName}'".format(numCancelled=numCancelled, projectName=args.project_name))
+        sys.exit(0)
+
+    # long frame lists come over stdin rather than the command line
+    framesString = sys.stdin.read() if args.frame_range == "-" else args.frame_range
+
+    # hand the render to a running render service, which has its hosts probed and connected already
+    if not args.hosts_online and not args.no_service:
+        exitCode = submit_to_service(socketPath, sys.argv[1:], framesString)
+        if exitCode is not None:
+            sys.exit(exitCode)
+
+    # Test hosts to see which ones are available
+    hosts, host_objects, host_monitor = setup_hosts(args)
+    hosts_online = list()
+    hosts_offline = list()
+    for host in hosts:
+        if host_objects[host].is_reachable():
+            hosts_online.append(str(host))
+        else:
+            hosts_offline.append(str(host))
+
+    # if this parameter is passed, print number of servers online and exit
+    if args.hosts_online:
+        if verbose >= 2: print("Hosts Online : ")
+        print(hosts_online)
+        if verbose >= 2: print("Hosts Offline: ")
+        print(hosts_offline)
+        sys.exit(0)
+    # Print the start message
+    elif verbose >= 1:
+        pflush("Starting distribute task...")
+
+    # Verify there are hosts available
+    if len(hosts_online) == 0:
+        sys.stderr.write("No hosts available.")
+        sys.exit(58)
+    elif verbose >= 1:
+        print("hosts available: {numHostsOnline}".format(numHostsOnline=len(hosts_online)))
+
+    ssh_pool, capacity_monitor, engine = start_services(args, projectRoot, host_objects, getpass.getuser())
+
+    # keep reachability fresh in the background while the render runs
+    host_monitor.start()
+    render_project(args, FrameSet.from_string(framesString), host_objects, projectRoot, startTime, host_monitor=host_monitor, ssh_pool=ssh_pool, capacity_monitor=capacity_monitor, engine=engine)
 
 if __name__ == "__main__":
     main()
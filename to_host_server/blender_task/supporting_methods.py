@@ -16,13 +16,19 @@
 # along with this program.  If not, see <http://www.gnu.org/licenses/>.
 
 # system imports
+import hashlib
 import json
-import numpy
 import os
 import re
 import shlex
 import sys
 import subprocess
+import threading
+import time
+try:
+    import Queue as queue
+except:
+    import queue
 
 def pflush(string):
     """ Helper function that prints and flushes a string """
@@ -34,6 +40,27 @@ def eflush(string):
     sys.stderr.write(string)
     sys.stderr.flush()
 
+def run_threaded(func, items, max_workers=256, name="Thread-Worker"):
+    """ calls 'func' on every item on a bounded pool of threads, returning once every call has finished """
+    itemQueue = queue.Queue()
+    for item in items:
+        itemQueue.put(item)
+    def worker():
+        while True:
+            try:
+                item = itemQueue.get_nowait()
+            except queue.Empty:
+                return
+            func(item)
+    workers = list()
+    for i in range(min(max_workers, len(items))):
+        workerThread = threading.Thread(target=worker, name="{name}-{i}".format(name=name, i=i))
+        workerThread.daemon = True
+        workerThread.start()
+        workers.append(workerThread)
+    for workerThread in workers:
+        workerThread.join()
+
 def process_blender_output(hostname, line):
     """ helper function to process blender output and print helpful json object """
 
@@ -60,27 +87,92 @@ def process_blender_output(hostname, line):
 
         hostcount[hostname] += 1
 
-def ssh_string(username, hostname, verbose=0):
+def ssh_string(username, hostname, verbose=0, sshOptions=""):
+
+    tmpStr = "ssh -oStrictHostKeyChecking=no {sshOptions}{username}@{hostname}".format(sshOptions=sshOptions + " " if sshOptions else "", username=username, hostname=hostname)
+    if verbose >= 3:
+        pflush(tmpStr)
+    return tmpStr
 
-    tmpStr = "ssh -oStrictHostKeyChecking=no {username}@{hostname}".format(username=username, hostname=hostname)
+def kill_blender_string(username, hostname, jobString, verbose=0, sshOptions=""):
+    """ command that kills the Blender process running 'jobString' on 'hostname' """
+    # the output path and frame range pick out this job from any others running on the node ('-e 5' mustn't match '-e 50')
+    jobPattern = jobString[jobString.find("-o "):jobString.find(" -P ")] if " -P " in jobString else jobString
+    tmpStr = "{ssh_c_string} 'pkill -f -- \"{jobPattern}( |$)\"'".format(ssh_c_string=ssh_string(username, hostname, 0, sshOptions), jobPattern=jobPattern.replace("'", ""))
     if verbose >= 3:
         pflush(tmpStr)
     return tmpStr
 
-def rsync_files_to_node_string(remoteResultsPath, projectSyncPath, username, hostname, projectPath, verbose=0):
-    tmpStr = "rsync -e 'ssh -oStrictHostKeyChecking=no' --rsync-path='mkdir -p {remoteResultsPath} && rsync' -a {projectSyncPath} {username}@{hostname}:{projectPath}/".format(remoteResultsPath=remoteResultsPath.replace(" ", "\\ "), projectSyncPath=projectSyncPath, username=username, hostname=hostname, projectPath=projectPath)
+def rsync_files_to_node_string(remoteResultsPath, projectSyncPath, username, hostname, projectPath, verbose=0, sshOptions=""):
+    tmpStr = "rsync -e 'ssh -oStrictHostKeyChecking=no{sshOptions}' --rsync-path='mkdir -p {remoteResultsPath} && rsync' -a {projectSyncPath} {username}@{hostname}:{projectPath}/".format(remoteResultsPath=remoteResultsPath.replace(" ", "\\ "), projectSyncPath=projectSyncPath, username=username, hostname=hostname, projectPath=projectPath, sshOptions=" " + sshOptions if sshOptions else "")
     if verbose >= 3:
         pflush(tmpStr)
     return tmpStr
 
-def rsync_files_from_node_string(username, hostname, remoteResultsPath, localResultsPath, outputName="", frameString="", verbose=0):
-    tmpStr = "rsync -atu -e 'ssh -oStrictHostKeyChecking=no' --include='{outputName}{frameString}.???' --exclude='*' --remove-source-files --rsync-path='mkdir -p {localResultsPath} && rsync' {username}@{hostname}:{remoteResultsPath} {localResultsPath}".format(outputName=outputName, username=username, hostname=hostname, remoteResultsPath=remoteResultsPath, frameString=frameString, localResultsPath=localResultsPath.replace(" ", "\\ "))
+def rsync_files_from_node_string(username, hostname, remoteResultsPath, localResultsPath, outputName="", frameString="", verbose=0, sshOptions=""):
+    tmpStr = "rsync -atu -e 'ssh -oStrictHostKeyChecking=no{sshOptions}' --include='{outputName}{frameString}.???' --exclude='*' --remove-source-files --rsync-path='mkdir -p {localResultsPath} && rsync' {username}@{hostname}:{remoteResultsPath} {localResultsPath}".format(outputName=outputName, username=username, hostname=hostname, remoteResultsPath=remoteResultsPath, frameString=frameString, localResultsPath=localResultsPath.replace(" ", "\\ "), sshOptions=" " + sshOptions if sshOptions else "")
     if verbose >= 3:
         pflush(tmpStr)
     return tmpStr
 
-def start_tasks(projectName, projectPath, projectSyncPath, hostname, username, jobString, remoteResultsPath, localResultsPath, JobHostObject=None, firstTime=True, frame=False, progress=False, verbose=0):
+def parseBlenderTime(timeString):
+    """ converts a Blender status time ('MM:SS.ss' or 'HH:MM:SS.ss') to seconds """
+    seconds = 0.
+    for part in timeString.split(":"):
+        seconds = seconds * 60 + float(part)
+    return seconds
+
+def parse_blender_status(line):
+    """ returns (frame, elapsed seconds, remaining seconds) from a Blender status line, or None if there is no estimate in it """
+    match = re.search(r"Fra:(\d+)\s.*Time:([\d:.]+).*Remaining:([\d:.]+)", line)
+    if not match:
+        return None
+    return int(match.group(1)), parseBlenderTime(match.group(2)), parseBlenderTime(match.group(3))
+
+def report_blender_status(statusQueue, hostname, jobId, line, lastReport=0):
+    """ puts the status in 'line' on 'statusQueue' at most once a second; returns the time of the last report """
+    if statusQueue is None or time.time() - lastReport < 1:
+        return lastReport
+    status = parse_blender_status(line)
+    if not status:
+        return lastReport
+    statusQueue.put((hostname, jobId) + status)
+    return time.time()
+
+class Command():
+    """ A command for a task pipeline to run; 'on_line' is called with each line it writes to stdout (which is passed through when None) """
+
+    def __init__(self, args, shell=False, on_line=None):
+        self.args = args
+        self.shell = shell
+        self.on_line = on_line
+
+    def run(self):
+        """ runs the command in this thread, returning its exit code """
+        if not self.on_line:
+            return subprocess.call(self.args, shell=self.shell)
+        process = subprocess.Popen(self.args, shell=self.shell, stdout=subprocess.PIPE)
+        # This blocks til there is something to read
+        for line in iter(process.stdout.readline, b""):
+            if not isinstance(line, str):
+                line = line.decode("utf-8", "replace")
+            self.on_line(line)
+        return process.wait()
+
+def run_pipeline(pipeline):
+    """ runs each Command 'pipeline' yields to completion in this thread, and returns the exit status it yields last """
+    step = next(pipeline)
+    while isinstance(step, Command):
+        step = pipeline.send(step.run())
+    pipeline.close()
+    return step
+
+def start_tasks(projectName, projectPath, projectSyncPath, hostname, username, jobString, remoteResultsPath, localResultsPath, JobHostObject=None, firstTime=True, frame=False, progress=False, verbose=0, sshOptions="", statusQueue=None, jobId=None):
     """ Render frame on remote server and get output file when finished """
+    return run_pipeline(task_pipeline(projectName, projectPath, projectSyncPath, hostname, username, jobString, remoteResultsPath, localResultsPath, JobHostObject, firstTime, frame, progress, verbose, sshOptions, statusQueue, jobId))
+
+def task_pipeline(projectName, projectPath, projectSyncPath, hostname, username, jobString, remoteResultsPath, localResultsPath, JobHostObject=None, firstTime=True, frame=False, progress=False, verbose=0, sshOptions="", statusQueue=None, jobId=None):
+    """ The steps of 'start_tasks': yields each Command to run (and is sent back its exit code), then yields the job's exit status """
 
     if verbose >= 2 and frame:
         pflush("Starting thread. Rendering frame {frame} on {hostname}".format(frame=frame, hostname=hostname))
@@ -96,9 +188,9 @@ def start_tasks(projectName, projectPath, projectSyncPath, hostname, username, j
 
 
     # First copy the files over using rsync
-    rsync_to            = rsync_files_to_node_string(remoteResultsPath, projectSyncPath, username, hostname, projectPath, verbose)
-    rsync_from          = rsync_files_from_node_string(username, hostname, remoteResultsPath, localResultsPath, outputName, frameString, verbose)
-    ssh_c_string        = ssh_string(username, hostname, verbose)
+    rsync_to            = rsync_files_to_node_string(remoteResultsPath, projectSyncPath, username, hostname, projectPath, verbose, sshOptions)
+    rsync_from          = rsync_files_from_node_string(username, hostname, remoteResultsPath, localResultsPath, outputName, frameString, verbose, sshOptions)
+    ssh_c_string        = ssh_string(username, hostname, verbose, sshOptions)
     ssh_blender         = "{ssh_c_string} '{jobString}'".format(ssh_c_string=ssh_c_string, jobString=jobString)
     run_status          = {"p":-1, "q":-1, "r":-1}
 
@@ -106,7 +198,7 @@ def start_tasks(projectName, projectPath, projectSyncPath, hostname, username, j
     if firstTime:
         if verbose >= 3:
             pflush("Syncing project file {projectName}.blend to {hostname}\nrsync command: {rsync_to}".format(projectName=projectName, hostname=hostname, rsync_to=rsync_to))
-        p = subprocess.call(rsync_to, shell=True)
+        p = yield Command(rsync_to, shell=True)
         if verbose >= 3:
             pflush("Finished the rsync to host {hostname} with return code {p}".format(hostname=hostname, p=p))
         if p == 0:
@@ -120,32 +212,31 @@ def start_tasks(projectName, projectPath, projectSyncPath, hostname, username, j
     if verbose >= 3:
         pflush("blender command: {jobString}".format(jobString=jobString))
 
-    q = subprocess.Popen(shlex.split(ssh_blender), stdout=subprocess.PIPE)
-
-    # This blocks til q is done
-    while type(q.poll()) == type(None):
-        # This blocks til there is something to read
-        line = q.stdout.readline()
+    blender_status = {"lastReport":0}
+    def process_line(line):
         if progress:
             process_blender_output(hostname, line)
+        # let the scheduler know how fast this host is going
+        blender_status["lastReport"] = report_blender_status(statusQueue, hostname, jobId, line, blender_status["lastReport"])
+    q = yield Command(shlex.split(ssh_blender), on_line=process_line)
 
     # Successful blender
-    if q.returncode == 0:
+    if q == 0:
         run_status["q"] = 0
 
         if verbose >= 2 and frame:
             pflush("Successfully completed render for frame ({frame}) on hostname {hostname}.".format(frame=frame, hostname=hostname))
     else:
-        eflush("blender error: {returncode}".format(returncode=q.returncode))
+        eflush("blender error: {returncode}".format(returncode=q))
         run_status["q"] = 1
 
 
     # Now rsync the files in <remoteResultsPath> back to this host.
     if verbose >= 3:
         pflush("rsync pull: {rsync_from}".format(rsync_from=rsync_from))
-    r = subprocess.call(rsync_from, shell=True)
+    r = yield Command(rsync_from, shell=True)
 
-    if r == 0 and q.returncode == 0:
+    if r == 0 and q == 0:
         run_status["r"] = 0
         if verbose >= 2 and frame:
             pflush("Render frame ({frame}) has been copied back from hostname {hostname}".format(frame=frame, hostname=hostname))
@@ -153,14 +244,48 @@ def start_tasks(projectName, projectPath, projectSyncPath, hostname, username, j
         eflush("rsync error: {r}".format(r=r))
         run_status["r"] = 1
 
-    return run_status["p"] + run_status["q"] + run_status["r"]
-
-def buildJobString(projectPath, projectName, nameOutputFiles, frame, seedString=""):
-    builtString = "blender -b {projectPath}/{projectName}.blend -x 1 -o //results/{nameOutputFiles}{seedString}_####.png -s {frame} -e {frame} -P {projectPath}/blender_p.py -a".format(projectPath=projectPath, projectName=projectName, nameOutputFiles=nameOutputFiles, seedString=seedString, frame=str(frame))
+    yield run_status["p"] + run_status["q"] + run_status["r"]
+
+def buildJobString(projectPath, projectName, nameOutputFiles, frame, seedString="", endFrame=None, tile=None, seeds=None):
+    """ builds the Blender command rendering 'frame' (through 'endFrame', if given, in a single Blender session) """
+    if endFrame is None:
+        endFrame = frame
+    # Blender renders the animation again for each '-a', so a job of several seeds is one Blender session too
+    builtString = "blender -b {projectPath}/{projectName}.blend -x 1 -o //results/{nameOutputFiles}{seedString}_####.png -s {frame} -e {endFrame} -P {projectPath}/blender_p.py{renders}".format(projectPath=projectPath, projectName=projectName, nameOutputFiles=nameOutputFiles, seedString=seedString, frame=str(frame), endFrame=str(endFrame), renders=" -a" * (seeds or 1))
+    if tile is not None:
+        # 'blender_p.py' reads the strip to render from the arguments Blender leaves alone
+        builtString += " -- --tile {tileIndex} {numTiles}".format(tileIndex=tile[0], numTiles=tile[1])
+    elif seeds is not None:
+        # 'blender_p.py' sums the seeds into one '.sum' file (see 'SeedAverager.add'), so the node sends back one file for all of them
+        builtString += " -- --seeds {seeds}".format(seeds=seeds)
     return builtString
 
-def buildJobStrings(frames, projectName, projectPath, nameOutputFiles, jobsPerFrame=False, servers=1): # jobList is a list of lists containing start and end values
-    """ Helper function to build Blender job strings to be sent to client servers """
+def tileOutputName(nameOutputFiles, tileIndex, numTiles):
+    return "{nameOutputFiles}_tile-{tileIndex}".format(nameOutputFiles=nameOutputFiles, tileIndex=str(tileIndex).zfill(len(str(numTiles - 1))))
+
+def averageFileName(nameOutputFiles, frame):
+    """ name of the float image 'SeedAverager' keeps the running average of the seeds of 'frame' in """
+    return "{nameOutputFiles}_average_{frame}.raw".format(nameOutputFiles=nameOutputFiles, frame=str(frame).zfill(4))
+
+def buildTileJobStrings(frames, projectName, projectPath, nameOutputFiles, numTiles):
+    """ Blender job strings rendering each frame as 'numTiles' horizontal strips (bottom strip first), to be put back together with 'stitch_tiles' """
+    jobStrings = []
+    for frame in frames:
+        for tileIndex in range(numTiles):
+            jobStrings.append(buildJobString(projectPath, projectName, tileOutputName(nameOutputFiles, tileIndex, numTiles), frame, tile=(tileIndex, numTiles)))
+    return jobStrings
+
+def seedOutputSuffix(seedNum, samples=None):
+    """ output name suffix of a seed job; its sample count goes in the name, so seeds of different sizes can be weighted when they're averaged """
+    return "_seed-{seedNum}{samplesString}".format(seedNum=seedNum, samplesString="-{samples}s".format(samples=samples) if samples else "")
+
+def seedSamples(fileName):
+    """ returns the sample count in the name of a seed's output file (None if it doesn't have one) """
+    match = re.search(r"_seed-\d+-(\d+)s_", fileName)
+    return int(match.group(1)) if match else None
+
+def buildJobStrings(frames, projectName, projectPath, nameOutputFiles, jobsPerFrame=False, servers=1, samples=None, seedJobs=None): # jobList is a list of lists containing start and end values
+    """ Helper function to build Blender job strings to be sent to client servers ('jobsPerFrame' seeds of each frame are split between 'seedJobs' jobs, if given) """
 
     jobStrings = []
     # the following code may be used in the future, if I decide to distribute animation renders amongst multiple servers
@@ -169,10 +294,12 @@ def buildJobStrings(frames, projectName, projectPath, nameOutputFiles, jobsPerFr
     # else:
     #     jobsPerFrame = int(jobsPerFrame)
     if jobsPerFrame:
-        for i in range(jobsPerFrame):
+        numJobs = min(seedJobs, jobsPerFrame) if seedJobs else jobsPerFrame
+        for i in range(numJobs):
+            # the seeds are split as evenly as the jobs allow
+            seeds = jobsPerFrame // numJobs + (1 if i < jobsPerFrame % numJobs else 0) if seedJobs else None
             for frame in frames:
-                seedString = "_seed-{seedNum}".format(seedNum=str(i).zfill(len(str(servers))))
-                builtString = buildJobString(projectPath, projectName, nameOutputFiles, frame, seedString)
+                builtString = buildJobString(projectPath, projectName, nameOutputFiles, frame, seedOutputSuffix(str(i).zfill(len(str(servers))), samples), seeds=seeds)
                 jobStrings.append(builtString)
     else:
         for frame in frames:
@@ -180,6 +307,40 @@ def buildJobStrings(frames, projectName, projectPath, nameOutputFiles, jobsPerFr
             jobStrings.append(builtString)
     return jobStrings
 
+def jobOutputFiles(jobString, localResultsPath):
+    """ returns the names of the output files 'jobString' rendered into 'localResultsPath' """
+    parsed = parseJobString(jobString)
+    if not parsed or not os.path.isdir(localResultsPath):
+        return []
+    outputName, startFrame, endFrame = parsed
+    # the extension is left off, since Blender replaces '.png' with the scene's file format
+    prefixes = set("{outputName}_{frame}.".format(outputName=outputName, frame=str(frame).zfill(4)) for frame in range(startFrame, endFrame + 1))
+    return sorted(fileName for fileName in os.listdir(localResultsPath) if fileName[:-3] in prefixes)
+
+def parseJobString(jobString):
+    """ returns (outputName, startFrame, endFrame) for a job string built by 'buildJobString' (None if it can't be parsed) """
+    match = re.search(r"-o //results/(\S+)_####\.\S+ -s (\d+) -e (\d+)", jobString)
+    if not match:
+        return None
+    return match.group(1), int(match.group(2)), int(match.group(3))
+
+def listOutputFiles(localResultsPath):
+    """ returns the names (without their 3 letter extensions) of the output files in 'localResultsPath' """
+    if not os.path.isdir(localResultsPath):
+        return set()
+    return set(fileName[:-4] for fileName in os.listdir(localResultsPath) if len(fileName) > 4 and fileName[-4] == ".")
+
+def missingOutputFiles(jobString, localResultsPath, outputFiles=None):
+    """ returns the frames rendered by 'jobString' that have no output file in 'localResultsPath' (pass 'outputFiles' from 'listOutputFiles' to check many jobs at once) """
+    parsed = parseJobString(jobString)
+    if not parsed:
+        return []
+    outputName, startFrame, endFrame = parsed
+    if outputFiles is None:
+        outputFiles = listOutputFiles(localResultsPath)
+    # match any extension, since Blender replaces '.png' with the scene's file format
+    return [frame for frame in range(startFrame, endFrame + 1) if "{outputName}_{frame}".format(outputName=outputName, frame=str(frame).zfill(4)) not in outputFiles]
+
 def readFileFor(f, flagName):
     readLines = ""
 
@@ -219,6 +380,18 @@ def testHosts(host, hosts_online, hosts_offline, start_tasks, verbose=0):
     else:
         hosts_offline.append(str(host))
 
+def fileChecksum(filePath, blockSize=1 << 20):
+    """ returns the md5 hex digest of the file at 'filePath' (None if it doesn't exist) """
+    if not os.path.exists(filePath):
+        return None
+    md5 = hashlib.md5()
+    with open(filePath, "rb") as f:
+        block = f.read(blockSize)
+        while block:
+            md5.update(block)
+            block = f.read(blockSize)
+    return md5.hexdigest()
+
 def getSupportedFileTypes():
     return ["png", "tga", "tif", "jpg", "jp2", "bmp", "cin", "dpx", "exr", "hdr", "rgb"]
 
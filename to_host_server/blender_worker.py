@@ -0,0 +1,76 @@
+# Copyright (C) 2018 Christopher Gearhart
+# chris@bblanimation.com
+# http://bblanimation.com/
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+# Resident render worker: run after 'blender_p.py' with the project file already loaded, e.g.
+#   blender -b project.blend -P blender_p.py -P blender_worker.py
+# then write one json request per line to stdin:
+#   {"frame":12, "output":"//results/name_####.png", "seed":null}
+# Each request is answered with one '##RFC_WORKER##{json}##RFC_WORKER##' line on stdout.
+
+# system imports
+import bpy
+import json
+import random
+import sys
+import traceback
+
+MARKER = "##RFC_WORKER##"
+
+def respond(response):
+    sys.stdout.write("{marker}{json}{marker}\n".format(marker=MARKER, json=json.dumps(response)))
+    sys.stdout.flush()
+
+def render_request(request):
+    """ renders one frame of the active scene as described by 'request' """
+    scn = bpy.context.scene
+    seed = request.get("seed")
+    if seed is None:
+        seed = random.randint(1, 10000)
+    for s in bpy.data.scenes:
+        s.cycles.seed = seed
+    scn.frame_set(request["frame"])
+    scn.render.filepath = request["output"]
+    bpy.ops.render.render(write_still=True)
+
+def main():
+    # keep scene data loaded between requests, since that is the point of a resident worker
+    for scn in bpy.data.scenes:
+        scn.render.use_persistent_data = True
+        scn.render.use_file_extension = True
+    respond({"ready":True})
+    while True:
+        line = sys.stdin.readline()
+        if not line:
+            break
+        line = line.strip()
+        if not line:
+            continue
+        try:
+            request = json.loads(line)
+        except ValueError:
+            respond({"status":1, "error":"invalid request: {line}".format(line=line)})
+            continue
+        if request.get("quit"):
+            break
+        try:
+            render_request(request)
+            respond({"frame":request["frame"], "status":0})
+        except Exception as e:
+            traceback.print_exc()
+            respond({"frame":request.get("frame"), "status":1, "error":str(e)})
+
+main()
@@ -0,0 +1,70 @@
+# Copyright (C) 2018 Christopher Gearhart
+# chris@bblanimation.com
+# http://bblanimation.com/
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+# system imports
+import os
+import sys
+import unittest
+
+# the host server's modules import each other by name (see 'blender_task/__main__.py')
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir, "blender_task"))
+from FrameSet import *
+
+
+class FrameSetTest(unittest.TestCase):
+
+    def test_merges_overlapping_and_touching_ranges(self):
+        frames = FrameSet([[5, 8], 1, [2, 3], 4, [7, 10], 20])
+        self.assertEqual(list(frames.ranges()), [(1, 10), (20, 20)])
+        self.assertEqual(len(frames), 11)
+
+    def test_from_string(self):
+        self.assertEqual(FrameSet.from_string("1-250, 300"), FrameSet([[1, 250], 300]))
+        self.assertEqual(FrameSet.from_string("[[1,250],300]"), FrameSet([[1, 250], 300]))
+        self.assertEqual(str(FrameSet.from_string("300,1-250")), "1-250,300")
+
+    def test_contains(self):
+        frames = FrameSet([[1, 3], [10, 12]])
+        self.assertTrue(2 in frames)
+        self.assertTrue(12 in frames)
+        self.assertFalse(5 in frames)
+        self.assertFalse(0 in frames)
+
+    def test_pop_range(self):
+        frames = FrameSet([[1, 5], 9])
+        self.assertEqual(frames.pop_range(3), (1, 3))
+        # a chunk never spans a gap
+        self.assertEqual(frames.pop_range(3), (4, 5))
+        self.assertFalse(4 in frames)
+        self.assertEqual(frames.pop_range(3), (9, 9))
+        self.assertFalse(frames)
+        self.assertRaises(IndexError, frames.pop_range)
+
+    def test_difference(self):
+        frames = FrameSet([[1, 10], [20, 30]])
+        self.assertEqual(frames.difference([[3, 4], 10, [15, 22], 30]), FrameSet([[1, 2], [5, 9], [23, 29]]))
+        self.assertEqual(frames.difference(FrameSet([[1, 30]])), FrameSet())
+        self.assertEqual(frames.difference([]), frames)
+
+    def test_difference_after_pop(self):
+        frames = FrameSet([[1, 10]])
+        frames.pop_range(4)
+        self.assertEqual(frames.difference([6]), FrameSet([5, [7, 10]]))
+
+
+if __name__ == "__main__":
+    unittest.main()
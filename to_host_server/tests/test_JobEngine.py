@@ -0,0 +1,109 @@
+# Copyright (C) 2018 Christopher Gearhart
+# chris@bblanimation.com
+# http://bblanimation.com/
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+# system imports
+import os
+import signal
+import sys
+import unittest
+
+# the host server's modules import each other by name (see 'blender_task/__main__.py')
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir, "blender_task"))
+from JobEngine import *
+
+
+def pipeline(commands, results):
+    """ runs each of the shell 'commands' in turn (like 'task_pipeline'), exiting with the sum of their exit codes """
+    total = 0
+    for command in commands:
+        returncode = yield command
+        results.append(returncode)
+        total += returncode
+    yield total
+
+
+class JobEngineTest(unittest.TestCase):
+
+    def setUp(self):
+        self.engine = JobEngine(poll_interval=.05)
+        self.engine.start()
+
+    def tearDown(self):
+        self.engine.stop()
+        self.engine.join(5)
+
+    def run_job(self, name, commands, timeout=10):
+        results = list()
+        finished = list()
+        job = EngineJob(self.engine, name, pipeline(commands, results), callback=finished.append)
+        job.start()
+        job.join(timeout)
+        self.assertFalse(job.is_alive())
+        self.assertEqual(finished, [job])
+        return job, results
+
+    def test_exit_codes(self):
+        job, results = self.run_job("codes", [Command("exit 0", shell=True), Command("exit 3", shell=True), Command(["false"])])
+        self.assertEqual(results, [0, 3, 1])
+        self.assertEqual(job.exitcode, 4)
+
+    def test_output_lines(self):
+        lines = list()
+        job, results = self.run_job("lines", [Command("printf 'one\\ntwo\\nthree'", shell=True, on_line=lines.append)])
+        self.assertEqual(job.exitcode, 0)
+        # the last line is passed on even without a newline at the end
+        self.assertEqual(lines, ["one\n", "two\n", "three"])
+
+    def test_missing_command(self):
+        job, results = self.run_job("missing", [Command(["/nonexistent/command"])])
+        self.assertEqual(results, [127])
+        self.assertEqual(job.exitcode, 127)
+
+    def test_many_jobs(self):
+        # each waits on its own command, so they're run side by side rather than one after the other
+        jobs = [EngineJob(self.engine, str(i), pipeline([Command("sleep .5; exit {i}".format(i=i), shell=True)], list())) for i in range(20)]
+        for job in jobs:
+            job.start()
+        for job in jobs:
+            job.join(5)
+        self.assertEqual([job.exitcode for job in jobs], list(range(20)))
+
+    def test_terminate(self):
+        results = list()
+        job = EngineJob(self.engine, "terminated", pipeline([Command(["sleep", "30"]), Command("exit 0", shell=True)], results))
+        job.start()
+        while job.pid is None:
+            job.join(.05)
+        job.terminate()
+        job.join(5)
+        self.assertFalse(job.is_alive())
+        # the steps after it aren't run
+        self.assertEqual(results, [])
+        self.assertEqual(job.exitcode, -signal.SIGTERM)
+
+    def test_stop(self):
+        job = EngineJob(self.engine, "stopped", pipeline([Command(["sleep", "30"])], list()))
+        job.start()
+        while job.pid is None:
+            job.join(.05)
+        self.engine.stop()
+        job.join(5)
+        self.assertEqual(job.exitcode, -signal.SIGTERM)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,112 @@
+# Copyright (C) 2018 Christopher Gearhart
+# chris@bblanimation.com
+# http://bblanimation.com/
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+# system imports
+import os
+import shutil
+import sys
+import tempfile
+import unittest
+
+# the host server's modules import each other by name (see 'blender_task/__main__.py')
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir, "blender_task"))
+from JobJournal import *
+
+
+def job_string(frame, endFrame=None, outputName="out"):
+    return buildJobString("/p", "proj", outputName, frame, endFrame=endFrame)
+
+
+class JobJournalTest(unittest.TestCase):
+
+    def setUp(self):
+        self.folder = tempfile.mkdtemp()
+        self.path = os.path.join(self.folder, "render.journal")
+        self.resultsPath = os.path.join(self.folder, "results")
+        os.mkdir(self.resultsPath)
+
+    def tearDown(self):
+        shutil.rmtree(self.folder)
+
+    def touch(self, fileName):
+        open(os.path.join(self.resultsPath, fileName), "w").close()
+
+    def run_journal(self, events, key="key"):
+        journal = JobJournal(self.path, key)
+        for event, job in events:
+            journal.record(event, job, "h1")
+        journal.close()
+
+    def test_new_journal_isnt_resumed(self):
+        journal = JobJournal(self.path, "key")
+        self.assertFalse(journal.resumed)
+        journal.close()
+
+    def test_resumes_with_the_last_event_of_each_job(self):
+        self.run_journal([("dispatch", job_string(1)), ("failed", job_string(1)), ("dispatch", job_string(1)), ("done", job_string(1)), ("dispatch", job_string(2))])
+        journal = JobJournal(self.path, "key")
+        self.assertTrue(journal.resumed)
+        self.assertEqual(journal.previous[job_string(1)]["event"], "done")
+        self.assertEqual(journal.previous[job_string(2)]["event"], "dispatch")
+        journal.close()
+
+    def test_another_render_starts_over(self):
+        self.run_journal([("done", job_string(1))])
+        journal = JobJournal(self.path, "other key")
+        self.assertFalse(journal.resumed)
+        self.assertEqual(journal.previous, dict())
+        journal.close()
+        # and its own journal replaces the old one
+        self.assertTrue(JobJournal(self.path, "other key").resumed)
+
+    def test_truncated_last_line_is_skipped(self):
+        self.run_journal([("done", job_string(1)), ("done", job_string(2))])
+        with open(self.path, "a") as f:
+            f.write('{"event": "done", "job": "blender -b')
+        journal = JobJournal(self.path, "key")
+        self.assertTrue(journal.resumed)
+        self.assertEqual(sorted(journal.previous), sorted([job_string(1), job_string(2)]))
+        # what's written next starts on a line of its own
+        journal.record("done", job_string(3))
+        journal.close()
+        self.assertTrue(job_string(3) in JobJournal(self.path, "key").previous)
+
+    def test_remove_completed_jobs(self):
+        jobs = [job_string(1), job_string(2), job_string(3), job_string(4, 6)]
+        self.run_journal([("done", jobs[0]), ("done", jobs[1]), ("dispatch", jobs[2]), ("done", jobs[3])])
+        self.touch("out_0001.png")
+        # frame 2 was done, but its output has gone
+        self.touch("out_0003.png")
+        self.touch("out_0004.png")
+        self.touch("out_0006.png")
+        journal = JobJournal(self.path, "key")
+        self.assertEqual(journal.remove_completed_jobs(jobs, self.resultsPath), jobs[1:])
+        self.assertEqual(journal.remove_completed_frames([[1, 6]], "out", self.resultsPath), FrameSet([[2, 3], 5]))
+        journal.close()
+
+    def test_folded_seeds_count_as_completed(self):
+        seedJob = job_string(1, outputName="out" + seedOutputSuffix(0, 16))
+        self.run_journal([("done", seedJob)])
+        journal = JobJournal(self.path, "key")
+        self.assertEqual(journal.remove_completed_jobs([seedJob], self.resultsPath), [seedJob])
+        journal.completed_frames = None
+        self.assertEqual(journal.remove_completed_jobs([seedJob], self.resultsPath, ["out_seed-0-16s_0001.tga"]), [])
+        journal.close()
+
+
+if __name__ == "__main__":
+    unittest.main()
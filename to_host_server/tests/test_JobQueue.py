@@ -0,0 +1,251 @@
+# Copyright (C) 2018 Christopher Gearhart
+# chris@bblanimation.com
+# http://bblanimation.com/
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+# system imports
+import os
+import sys
+import time
+import unittest
+
+# the host server's modules import each other by name (see 'blender_task/__main__.py')
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir, "blender_task"))
+from JobQueue import *
+
+
+def job_string(frame, endFrame=None, outputName="out"):
+    return buildJobString("/p", "proj", outputName, frame, endFrame=endFrame)
+
+
+class FakeHost():
+    """ stands in for a JobHost, with the parts of it the queues look at """
+
+    def __init__(self, hostname, max_on_host=1, reachable=True):
+        self.hostname = hostname
+        self.max_on_host = max_on_host
+        self.reachable = reachable
+        # jobs with a copy on this host, and jobs waiting in its local backlog
+        self.jobs = list()
+        self.backlog = list()
+
+    def get_hostname(self):
+        return self.hostname
+
+    def is_reachable(self):
+        return self.reachable
+
+    def wake(self):
+        pass
+
+    def has_job(self, job):
+        return job in self.jobs
+
+    def is_running(self, job):
+        return job in self.jobs
+
+    def get_running_jobs(self):
+        # every job has only just started
+        return [(job, {"start_time": time.time()}) for job in self.jobs]
+
+    def has_backlog(self):
+        return bool(self.backlog)
+
+    def backlog_size(self):
+        return len(self.backlog)
+
+    def give_up_job(self):
+        return self.backlog.pop(0) if self.backlog else None
+
+
+class FakeThroughput():
+    """ fixed seconds per frame for each host """
+
+    def __init__(self, frameTimes):
+        self.frameTimes = frameTimes
+
+    def get_frame_time(self, hostname):
+        return self.frameTimes.get(hostname)
+
+    def get_average_frame_time(self):
+        if not self.frameTimes:
+            return None
+        return sum(self.frameTimes.values()) / float(len(self.frameTimes))
+
+    def get_progress(self, hostname, job):
+        return None
+
+
+class JobQueueTest(unittest.TestCase):
+
+    def setUp(self):
+        self.queue = JobQueue([job_string(frame) for frame in range(1, 4)])
+        self.host1 = FakeHost("h1")
+        self.host2 = FakeHost("h2")
+        self.queue.add_host(self.host1)
+        self.queue.add_host(self.host2)
+
+    def test_jobs_in_order(self):
+        frames = [self.queue.get(self.host1).startFrame for i in range(3)]
+        self.assertEqual(frames, [1, 2, 3])
+        self.assertEqual(self.queue.get(self.host1), None)
+        self.assertEqual(self.queue.store.count(JOB_QUEUED), 3)
+
+    def test_retry_goes_first_and_avoids_the_host_it_failed_on(self):
+        job = self.queue.get(self.host1)
+        job.add_failed_host("h1")
+        self.queue.retry(job)
+        self.assertEqual(len(self.queue), 3)
+        self.assertEqual(self.queue.get(self.host1).startFrame, 2)
+        self.assertTrue(self.queue.get(self.host2) is job)
+
+    def test_retry_goes_back_to_a_failed_host_once_every_host_failed_it(self):
+        job = self.queue.get(self.host1)
+        job.add_failed_host("h1")
+        self.host2.reachable = False
+        self.queue.retry(job)
+        self.assertTrue(self.queue.get(self.host1) is job)
+
+    def test_retry_never_goes_to_a_host_with_a_copy(self):
+        job = self.queue.get(self.host1)
+        self.host1.jobs.append(job)
+        self.queue.jobs.clear()
+        self.queue.retry(job)
+        self.assertFalse(self.queue.has_jobs(self.host1))
+        self.assertEqual(self.queue.get(self.host1), None)
+        self.assertTrue(self.queue.has_jobs(self.host2))
+        self.assertTrue(self.queue.get(self.host2) is job)
+
+    def test_steal_from_the_largest_backlog(self):
+        host3 = FakeHost("h3")
+        self.queue.add_host(host3)
+        self.host1.backlog = ["a"]
+        self.host2.backlog = ["b", "c"]
+        self.assertTrue(self.queue.can_steal(host3))
+        self.assertEqual(self.queue.steal(host3), "b")
+        # then in host order, once the backlogs are as long
+        self.assertEqual(self.queue.steal(host3), "a")
+        self.assertEqual(self.queue.steal(host3), "c")
+        self.assertFalse(self.queue.can_steal(host3))
+        self.assertEqual(self.queue.steal(host3), None)
+
+    def test_last_jobs_wait_for_faster_hosts(self):
+        self.queue.set_throughput(FakeThroughput({"h1": 10., "h2": 1.}))
+        # three jobs left, but the fast host has only one slot
+        self.assertFalse(self.queue.defers_to_faster_hosts(self.host1))
+        self.queue.get(self.host2)
+        self.queue.get(self.host2)
+        self.assertTrue(self.queue.defers_to_faster_hosts(self.host1))
+        self.assertEqual(self.queue.get(self.host1), None)
+        self.assertEqual(self.queue.get(self.host2).startFrame, 3)
+
+    def test_speculative_copy_of_a_straggler(self):
+        self.queue.set_throughput(FakeThroughput({"h1": 100., "h2": 1.}))
+        job = self.queue.get(self.host1)
+        self.host1.jobs.append(job)
+        self.queue.jobs.clear()
+        self.assertEqual(self.queue.get(self.host1), None)
+        self.assertTrue(self.queue.get(self.host2) is job)
+        self.assertTrue(self.queue.is_speculative(job))
+        # only one copy per job
+        self.assertEqual(self.queue.get(FakeHost("h3")), None)
+
+
+class FrameChunkQueueTest(unittest.TestCase):
+
+    def make_queue(self, frames, frameTimes=None, chunk_time=60):
+        queue = FrameChunkQueue(frames, lambda startFrame, endFrame: job_string(startFrame, endFrame), chunk_time=chunk_time)
+        self.host = FakeHost("h1")
+        queue.add_host(self.host)
+        if frameTimes is not None:
+            queue.set_throughput(FakeThroughput(frameTimes))
+        return queue
+
+    def test_single_frames_until_measured(self):
+        queue = self.make_queue([[1, 100]])
+        job = queue.get(self.host)
+        self.assertEqual((job.startFrame, job.endFrame), (1, 1))
+        self.assertEqual(queue.num_unbuilt(), 99)
+
+    def test_single_frames_without_chunk_time(self):
+        queue = self.make_queue([[1, 100]], {"h1": 2.}, chunk_time=None)
+        job = queue.get(self.host)
+        self.assertEqual((job.startFrame, job.endFrame), (1, 1))
+
+    def test_chunks_sized_from_frame_time(self):
+        queue = self.make_queue([[1, 100]], {"h1": 2.})
+        job = queue.get(self.host)
+        self.assertEqual((job.startFrame, job.endFrame), (1, 30))
+
+    def test_chunks_capped_and_split_at_gaps(self):
+        queue = self.make_queue([[1, 200], [300, 310]], {"h1": .01})
+        self.assertEqual(queue.get(self.host).num_frames(), 50)
+        self.assertEqual(len(queue), 161)
+        queue.jobs = FrameSet([[1, 5], [300, 310]])
+        job = queue.get(self.host)
+        self.assertEqual((job.startFrame, job.endFrame), (1, 5))
+
+    def test_last_frames_split_between_hosts(self):
+        queue = self.make_queue([[1, 10]], {"h1": 2., "h2": 2.})
+        queue.add_host(FakeHost("h2"))
+        # the two hosts are as fast, so each gets half of what's left
+        job = queue.get(self.host)
+        self.assertEqual((job.startFrame, job.endFrame), (1, 5))
+
+    def test_failed_chunk_retried_as_issued(self):
+        queue = self.make_queue([[1, 100]], {"h1": 2.})
+        job = queue.get(self.host)
+        queue.retry(job)
+        self.assertTrue(queue.get(self.host) is job)
+
+
+class FairShareQueueTest(unittest.TestCase):
+
+    def setUp(self):
+        self.shared = FairShareQueue()
+        self.host = FakeHost("h1")
+        self.renders = [JobQueue([job_string(frame, outputName=name) for frame in range(1, 4)]) for name in ("a", "b")]
+        for render in self.renders:
+            render.add_host(self.host)
+            self.shared.add_queue(render)
+
+    def test_renders_take_turns(self):
+        names = [self.shared.get(self.host).outputName for i in range(4)]
+        self.assertEqual(names, ["a", "b", "a", "b"])
+
+    def test_fewest_running_first(self):
+        for i in range(2):
+            job = self.renders[0].get(self.host)
+            self.renders[0].store.set_state(job, JOB_RUNNING)
+        self.assertEqual(self.shared.get(self.host).outputName, "b")
+        self.assertEqual(self.shared.get(self.host).outputName, "b")
+        self.assertEqual(self.shared.get(self.host).outputName, "b")
+        self.assertEqual(self.shared.get(self.host).outputName, "a")
+
+    def test_removed_render_is_not_served(self):
+        self.shared.remove_queue(self.renders[0])
+        self.assertEqual(len(self.shared), 3)
+        self.assertEqual(set(self.shared.get(self.host).outputName for i in range(3)), set(["b"]))
+        self.assertEqual(self.shared.get(self.host), None)
+        self.assertFalse(self.shared.has_jobs(self.host))
+
+    def test_retry_goes_back_to_its_render(self):
+        job = self.shared.get(self.host)
+        self.shared.retry(job)
+        self.assertEqual(len(job.queue.retries), 1)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,109 @@
+# Copyright (C) 2018 Christopher Gearhart
+# chris@bblanimation.com
+# http://bblanimation.com/
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+# system imports
+import json
+import os
+import shutil
+import sys
+import tempfile
+import unittest
+import numpy
+
+# the host server's modules import each other by name (see 'blender_task/__main__.py')
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir, "blender_task"))
+from SeedAverager import *
+
+
+class SeedAveragerTest(unittest.TestCase):
+
+    def setUp(self):
+        self.path = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.path)
+
+    def write_seed(self, seedNum, samples, values):
+        """ writes a 2x1 grayscale seed of frame 1 with pixel 'values', returning its file name """
+        fileName = "out{suffix}_0001.tga".format(suffix=seedOutputSuffix(seedNum, samples))
+        TargaImage(2, 1, TGA_GRAYSCALE, 8, 0, bytes(bytearray(values))).write(os.path.join(self.path, fileName))
+        return fileName
+
+    def read_average(self, averager):
+        with open(averager.get_path(), "rb") as f:
+            header = f.readline()
+            pixels = numpy.frombuffer(f.read(), numpy.float32)
+        return json.loads(header.decode("utf-8")), pixels.reshape(-1, 4)
+
+    def test_weighted_by_samples(self):
+        averager = SeedAverager(self.path, "out", 1)
+        averager.add([self.write_seed(1, 10, [0, 255]), self.write_seed(2, 30, [100, 55])])
+        info, pixels = self.read_average(averager)
+        self.assertEqual((info["width"], info["height"], info["seeds"], info["samples"]), (2, 1, 2, 40))
+        # each seed counts for as many samples as it was rendered with
+        expected = numpy.array([(0 * 10 + 100 * 30) / 40.0, (255 * 10 + 55 * 30) / 40.0]) / 255
+        numpy.testing.assert_allclose(pixels[:, 0], expected, rtol=1e-6)
+        numpy.testing.assert_allclose(pixels[:, 3], 1)
+        self.assertIsNotNone(info["noise"])
+
+    def test_sums_exact(self):
+        # a float32 sum of squares stops counting by ones past 2**24 (a few hundred white seeds of this size)
+        averager = SeedAverager(self.path, "out", 1)
+        numSeeds = 300
+        for seedNum in range(numSeeds):
+            averager.add([self.write_seed(seedNum, 1000, [255, 1])])
+        self.assertEqual(averager.sqSum[0, 0], 255 ** 2 * 1000 * numSeeds)
+        self.assertEqual(averager.sum[0, 1], 1000 * numSeeds)
+
+    def test_folded_seeds_listed(self):
+        averager = SeedAverager(self.path, "out", 1)
+        first = self.write_seed(1, 10, [10, 20])
+        second = self.write_seed(2, 10, [30, 40])
+        averager.add([first, second])
+        info = self.read_average(averager)[0]
+        self.assertEqual(info["folded"], sorted([first, second]))
+        # a speculative copy of a seed already in it is dropped rather than counted again
+        self.write_seed(1, 10, [10, 20])
+        averager.add([first])
+        self.assertEqual(self.read_average(averager)[0]["seeds"], 2)
+        self.assertFalse(os.path.exists(os.path.join(self.path, first)))
+
+    def test_header_length_fixed(self):
+        averager = SeedAverager(self.path, "out", 1)
+        averager.add([self.write_seed(1, 10, [10, 20])])
+        header = averager.get_info(1, 10, None)
+        self.assertEqual(len(averager.get_info(1, 10, 0.123456789012345678)), len(header))
+        self.assertEqual(len(averager.get_info(1, 10, 1e-300)), len(header))
+
+    def test_resume(self):
+        averager = SeedAverager(self.path, "out", 1)
+        averager.add([self.write_seed(1, 10, [0, 255])])
+        averager.finish(keepSums=True)
+        resumed = SeedAverager(self.path, "out", 1, resume=True)
+        self.assertEqual((resumed.numSeeds, resumed.numSamples), (1, 10))
+        resumed.add([self.write_seed(2, 10, [255, 0])])
+        info, pixels = self.read_average(resumed)
+        self.assertEqual(info["seeds"], 2)
+        numpy.testing.assert_allclose(pixels[:, 0], 0.5, rtol=1e-6)
+        resumed.finish()
+        # without 'resume' an average left by an earlier render is started over
+        self.assertEqual(SeedAverager(self.path, "out", 1).numSeeds, 0)
+        self.assertFalse(os.path.exists(resumed.get_path()))
+
+
+if __name__ == "__main__":
+    unittest.main()
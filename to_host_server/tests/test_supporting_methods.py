@@ -0,0 +1,114 @@
+# Copyright (C) 2018 Christopher Gearhart
+# chris@bblanimation.com
+# http://bblanimation.com/
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+# system imports
+import os
+import shutil
+import sys
+import tempfile
+import unittest
+
+# the host server's modules import each other by name (see 'blender_task/__main__.py')
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir, "blender_task"))
+from supporting_methods import *
+
+
+class JobStringTest(unittest.TestCase):
+
+    def test_parse_built_job_strings(self):
+        self.assertEqual(parseJobString(buildJobString("/p", "proj", "out", 7)), ("out", 7, 7))
+        self.assertEqual(parseJobString(buildJobString("/p", "proj", "out", 1, endFrame=25)), ("out", 1, 25))
+        seedJob = buildJobString("/p", "proj", "out", 3, seedString=seedOutputSuffix(2, 64), seeds=4)
+        self.assertEqual(parseJobString(seedJob), ("out_seed-2-64s", 3, 3))
+
+    def test_parse_unknown_job_string(self):
+        self.assertEqual(parseJobString("blender -b proj.blend -a"), None)
+
+    def test_seed_samples(self):
+        self.assertEqual(seedSamples("out" + seedOutputSuffix(2, 64) + "_0003.tga"), 64)
+        self.assertEqual(seedSamples("out" + seedOutputSuffix(2) + "_0003.tga"), None)
+
+
+class MissingOutputFilesTest(unittest.TestCase):
+
+    def setUp(self):
+        self.resultsPath = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.resultsPath)
+
+    def touch(self, fileName):
+        open(os.path.join(self.resultsPath, fileName), "w").close()
+
+    def test_any_extension_counts(self):
+        jobString = buildJobString("/p", "proj", "out", 1, endFrame=4)
+        self.touch("out_0001.png")
+        self.touch("out_0002.exr")
+        self.touch("out_0004.tga")
+        self.touch("other_0003.png")
+        self.assertEqual(missingOutputFiles(jobString, self.resultsPath), [3])
+        self.assertEqual(jobOutputFiles(jobString, self.resultsPath), ["out_0001.png", "out_0002.exr", "out_0004.tga"])
+
+    def test_output_files_listed_once(self):
+        self.touch("out_0001.png")
+        outputFiles = listOutputFiles(self.resultsPath)
+        self.assertEqual(missingOutputFiles(buildJobString("/p", "proj", "out", 1, endFrame=2), self.resultsPath, outputFiles), [2])
+
+    def test_missing_results_folder(self):
+        shutil.rmtree(self.resultsPath)
+        self.assertEqual(missingOutputFiles(buildJobString("/p", "proj", "out", 1), self.resultsPath), [1])
+        os.mkdir(self.resultsPath)
+
+
+class TaskPipelineTest(unittest.TestCase):
+
+    def run_steps(self, returncodes, firstTime=True):
+        """ sends 'returncodes' to the commands 'task_pipeline' yields in turn, returning the commands and its exit status """
+        pipeline = task_pipeline("proj", "/p", "/sync", "node1", "user", buildJobString("/p", "proj", "out", 1), "/p/results", "/local/results", firstTime=firstTime)
+        commands = [next(pipeline)]
+        for returncode in returncodes:
+            step = pipeline.send(returncode)
+            if not isinstance(step, Command):
+                return commands, step
+            commands.append(step)
+        self.fail("the pipeline didn't finish after {numSteps} steps".format(numSteps=len(returncodes)))
+
+    def test_steps(self):
+        commands, status = self.run_steps([0, 0, 0])
+        self.assertEqual(status, 0)
+        self.assertEqual(len(commands), 3)
+        self.assertTrue(commands[0].shell and "rsync" in commands[0].args)
+        # blender runs over ssh, split into arguments rather than through a shell
+        self.assertFalse(commands[1].shell)
+        self.assertEqual(commands[1].args[0], "ssh")
+        self.assertTrue(commands[2].shell and "rsync" in commands[2].args)
+
+    def test_synced_project(self):
+        commands, status = self.run_steps([0, 0], firstTime=False)
+        self.assertEqual(status, 0)
+        self.assertEqual(commands[0].args[0], "ssh")
+
+    def test_exit_status(self):
+        # one for each step that failed (a failed render's results aren't counted as fetched either)
+        self.assertEqual(self.run_steps([1, 0, 0])[1], 1)
+        self.assertEqual(self.run_steps([0, 255, 0])[1], 2)
+        self.assertEqual(self.run_steps([0, 0, 23])[1], 1)
+        self.assertEqual(self.run_steps([12, 1, 1])[1], 3)
+
+
+if __name__ == "__main__":
+    unittest.main()
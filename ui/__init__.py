@@ -142,10 +142,29 @@ class serversPanel(Panel):
             col = box.column(align=True)
             col.label(text="Distribution:")
             col.prop(scn, "rfc_maxServerLoad")
+            col.prop(scn, "rfc_autoServerLoad")
+            col.prop(scn, "rfc_chunkTime")
+            col.prop(scn, "rfc_residentWorkers")
             col.prop(scn, "rfc_timeout")
             if scn.render.engine == "CYCLES":
                 col.prop(scn, "rfc_samplesPerFrame")
                 col.prop(scn, "rfc_maxSamples")
+                col.prop(scn, "rfc_splitMode", text="")
+                # a frame split into tiles is only seen once it's stitched together
+                tiles = getSplitMode(scn) == "TILES"
+                if tiles and scn.rfc_splitMode == "AUTO":
+                    col.label(text="Auto: tiles (no preview or early stop)", icon="INFO")
+                elif tiles and not isEightBitOutput(scn):
+                    col.label(text="Tiles only support 8 bit outputs", icon="ERROR")
+                row = col.row(align=True)
+                row.active = not tiles
+                row.prop(scn, "rfc_sumOnServers")
+                row = col.row(align=True)
+                row.active = not tiles
+                row.prop(scn, "rfc_progressivePreview")
+                row = col.row(align=True)
+                row.active = scn.rfc_progressivePreview and not tiles
+                row.prop(scn, "rfc_noiseThreshold")
 
             layout.separator()
 